@@ -0,0 +1,99 @@
+import os
+import atexit
+import numpy
+
+# Per-step summary of a run, kept while it runs so the count and expression curves need no
+# snapshot: for each recorded step the cells of every type and the mean, variance, min and
+# max of each rnaamt/geneamt channel over the cells of that type.
+#
+#   stats = OnlineAggregator(os.path.join(sim.outputDirPath, 'summary.npz'))
+#   stats.record(step, eng.cellType, eng.rnaamt, eng.geneamt) # from update()
+#   ...
+#   summary = numpy.load('data/<run>/summary.npz')
+#   summary['counts'][:, 3]          # IBs at each step in summary['steps']
+#   summary['geneMean'][:, 1, 1]     # mean Euo protein of RBr cells
+#
+# Arrays in the file: steps (S,), counts (S, nTypes) and rnaMean, rnaVar, rnaMin, rnaMax,
+# geneMean, geneVar, geneMin, geneMax (S, nTypes, nGenes), nan where a type has no cells.
+# Each step is reduced in one pass of bincounts over the columns and only the reduced rows
+# are kept. The file is rewritten (atomically) every saveSteps records and on close().
+
+class OnlineAggregator:
+
+    def __init__(self, path, nTypes=8, nGenes=4, every=1, saveSteps=10):
+        self.path = path
+        self.nTypes = nTypes
+        self.nGenes = nGenes
+        self.every = every
+        self.saveSteps = saveSteps
+        self.steps = []
+        self.rows = {name: [] for name in self.names()}
+        atexit.register(self.close)
+
+    def names(self):
+        return ['counts'] + [prefix + stat for prefix in ['rna', 'gene'] for stat in ['Mean', 'Var', 'Min', 'Max']]
+
+    def records(self, step, final=False):
+        # Whether record() keeps step; final: the last state of the run, kept whatever its step
+        return step >= 0 and (step % self.every == 0 or final)
+
+    def record(self, step, cellType, rnaamt, geneamt, final=False):
+        if not self.records(step, final):
+            return
+        nTypes, nGenes = self.nTypes, self.nGenes
+        cellType = numpy.asarray(cellType, dtype=numpy.int64)
+        counts = numpy.bincount(cellType, minlength=nTypes)[:nTypes]
+        present = counts[:, None] > 0
+        cell = (cellType[:, None] * nGenes + numpy.arange(nGenes)).ravel()
+        self.steps.append(step)
+        self.rows['counts'].append(counts)
+        for (prefix, x) in [('rna', rnaamt), ('gene', geneamt)]:
+            x = numpy.asarray(x, dtype=float).reshape(len(cellType), nGenes)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                total = numpy.bincount(cell, x.ravel(), minlength=nTypes * nGenes).reshape(nTypes, nGenes)
+                mean = numpy.where(present, total / counts[:, None], numpy.nan)
+                dev = x - mean[cellType]
+                var = numpy.bincount(cell, (dev * dev).ravel(), minlength=nTypes * nGenes).reshape(nTypes, nGenes)
+                var = numpy.where(present, var / counts[:, None], numpy.nan)
+            low = numpy.full((nTypes, nGenes), numpy.inf)
+            high = numpy.full((nTypes, nGenes), -numpy.inf)
+            numpy.minimum.at(low, cellType, x)
+            numpy.maximum.at(high, cellType, x)
+            self.rows[prefix + 'Mean'].append(mean)
+            self.rows[prefix + 'Var'].append(var)
+            self.rows[prefix + 'Min'].append(numpy.where(present, low, numpy.nan))
+            self.rows[prefix + 'Max'].append(numpy.where(present, high, numpy.nan))
+        if len(self.steps) % self.saveSteps == 0:
+            self.save()
+
+    def recordCells(self, step, cells, final=False):
+        # record() from the CellStates, for the per-cell update() path
+        if not self.records(step, final):
+            return
+        states = cells.values()
+        cellType = numpy.fromiter((cell.cellType for cell in states), dtype=numpy.int64, count=len(cells))
+        rnaamt = [cell.rnaamt[:self.nGenes] for cell in states]
+        geneamt = [cell.geneamt[:self.nGenes] for cell in states]
+        self.record(step, cellType, rnaamt, geneamt, final)
+
+    def series(self):
+        # The summary so far as arrays, the content of the file
+        series = {'steps': numpy.array(self.steps, dtype=numpy.int64)}
+        for (name, rows) in self.rows.items():
+            if rows:
+                series[name] = numpy.array(rows)
+            elif name == 'counts':
+                series[name] = numpy.zeros((0, self.nTypes), dtype=numpy.int64)
+            else:
+                series[name] = numpy.zeros((0, self.nTypes, self.nGenes))
+        return series
+
+    def save(self):
+        tmp = self.path + '.tmp.npz'
+        numpy.savez_compressed(tmp, **self.series())
+        os.replace(tmp, self.path)
+
+    def close(self):
+        if self.steps:
+            self.save()
+        atexit.unregister(self.close)
@@ -1,13 +1,23 @@
+import os
 import random
 import numpy
 import math
+from ExpressionEngine import ExpressionEngine
+from GeneNetwork import GeneNetwork
+from LinearKinetics import LinearKinetics
+from TransitionScheduler import TransitionScheduler
+from WellMixed import WellMixedBiophysics, WellMixedRegulator
+from ColumnStore import ColumnWriter
+from Aggregator import OnlineAggregator
+from Lineage import LineageRecorder
+from Checkpoint import CheckpointWriter
+import CellRandom as cr # cr.GROWTH etc. are draw purposes; GROWTH below is a species index
+import HazardCurves
+from DebugLog import DebugLog
+from Profiler import Profiler
+import KernelCache
+from SpeciesIntegrator import AdaptiveIntegrator
 from CellModeller.Regulation.ModuleRegulator import ModuleRegulator
-from CellModeller.Biophysics.BacterialModels.CLBacterium import CLBacterium
-from CellModeller.Integration.CLCrankNicIntegrator import CLCrankNicIntegrator 
-from CellModeller.Integration.CLEulerSigIntegrator import CLEulerSigIntegrator
-from CellModeller.Signalling.GridDiffusion import GridDiffusion 
-from CellModeller.Integration.CLEulerIntegrator import CLEulerIntegrator
-from CellModeller.GUI import Renderers
 
 #Launch Code: python Scripts/CellModellerGUI.py
 #Launch Code Batch: python Scripts/batch.py
@@ -16,6 +26,14 @@ from CellModeller.GUI import Renderers
 
 max_cells = 2**15
 
+clExpression = False # run the RNA/protein kinetics as species rates in the OpenCL kernel (expressionRateCL)
+# species layout with clExpression: the model species, then the growth factor, RNA[0..3], protein[0..3]
+GROWTH = 2
+RNA = 3
+GENE = 7
+tickTime = 0.025 # integrator time per update() step, set from sim.dt in setup()
+wellMixed = False # no contact mechanics, diffusion grid or species integration, volume growth only (WellMixed.py)
+
 #Specify parameter for solving diffusion dynamics #Add
 grid_size = (4, 4, 4) # grid size
 grid_dim = (64, 8, 12) # dimension of diffusion space, unit = number of grid
@@ -23,12 +41,67 @@ grid_orig = (-128, -14, -8) # where to place the diffusion space onto simulation
 
 
 def setup(sim):
+    global tickTime, grn, kin, sched, store, stats, lineage, checkpoint, cellRandom, hazard, profiler, speciesInteg, scatterAll, debug
+    tickTime = sim.dt
+    grn = GeneNetwork(networkSpec)
+    kin = LinearKinetics(grn)
+    sched = TransitionScheduler(grn, kin) if useScheduler else None
+    store = None
+    if columnOutput and getattr(sim, 'saveOutput', False):
+        store = ColumnWriter(os.path.join(sim.outputDirPath, 'columns.npz'), outputSteps, engine.nGenes)
+    stats = None
+    if aggregate and getattr(sim, 'saveOutput', False):
+        stats = OnlineAggregator(os.path.join(sim.outputDirPath, 'summary.npz'), nGenes=engine.nGenes)
+    lineage = None
+    if recordLineage and getattr(sim, 'saveOutput', False):
+        lineage = LineageRecorder(os.path.join(sim.outputDirPath, 'lineage.npz'))
+    checkpoint = None
+    if checkpoints and getattr(sim, 'saveOutput', False):
+        checkpoint = CheckpointWriter(sim, os.path.join(sim.outputDirPath, 'checkpoints'), restartSteps, outputSteps)
+    cellRandom = None
+    if randomSeed is not None: # an Ensemble numbers its cells per replicate
+        cellRandom = cr.CellRandom(randomSeed, getattr(sim, 'replicates', 1))
+    hazard = HazardCurves.table(conversionCurve) if conversionCurve is not None else None
+    scatterAll = sim.is_gui
+    debug = debugLog if debugLog is not None else DebugLog(lines=20, everySteps=10) if sim.is_gui else DebugLog(0)
+    if lazyColor and not sim.is_gui:
+        engine.colors = False # update() paints the recorded steps
+    profiler = None
+    if profile:
+        profiler = Profiler(os.path.join(sim.outputDirPath, 'profile') if getattr(sim, 'saveOutput', False) else None)
+        profiler.attach(sim, {'columns': store, 'summary': stats, 'lineage': lineage, 'checkpoint': checkpoint})
+    speciesInteg = None
+    if adaptiveSpecies:
+        if clExpression:
+            raise ValueError('adaptiveSpecies integrates specRate on the host and cannot run with clExpression')
+        speciesInteg = AdaptiveIntegrator(specRate, rtol=speciesTol[0], atol=speciesTol[1])
+        if profiler is not None:
+            profiler.wrap(speciesInteg, 'step', 'integrator')
+
+    if wellMixed:
+        # Population dynamics only: the callbacks run as usual, cells just grow and divide
+        if clExpression:
+            raise ValueError('clExpression needs the OpenCL integrator and cannot run with wellMixed')
+        sim.init(WellMixedBiophysics(sim), WellMixedRegulator(sim, 2, 1), None, None)
+        sim.addCell(cellType=0, pos=(0,0,0))
+        sim.pickleSteps = pickleInterval()
+        return
+
     # Set biophysics, signalling, and regulation models
+    # The OpenCL classes load here, not with the module, so well-mixed runs never import them
+    if kernelCache is not None:
+        KernelCache.install(kernelCache)
+    from CellModeller.Biophysics.BacterialModels.CLBacterium import CLBacterium
+    from CellModeller.Integration.CLEulerIntegrator import CLEulerIntegrator
     biophys = CLBacterium(sim, max_cells=max_cells, jitter_z=False)
-    integ = CLEulerIntegrator(sim, 2, max_cells) # 2 is for number of spec
+    nSpecies = GENE + 4 if clExpression else 2
+    integ = CLEulerIntegrator(sim, nSpecies, max_cells) if speciesInteg is None else None # 2 is for number of spec
 
     # use this file for reg too
-    regul = ModuleRegulator(sim)
+    if integ is not None:
+        regul = ModuleRegulator(sim)
+    else: # update() integrates the species, the regulator gives the cells their arrays
+        regul = WellMixedRegulator(sim, nSpecies, 1)
     # Only biophys and regulation
     sim.init(biophys, regul, None, integ)
 
@@ -36,10 +109,12 @@ def setup(sim):
     sim.addCell(cellType=0, pos=(0,0,0)) 
 
     # Add some objects to draw the models
-    therenderer = Renderers.GLBacteriumRenderer(sim)
-    sim.addRenderer(therenderer)
+    if sim.is_gui:
+        from CellModeller.GUI import Renderers
+        therenderer = Renderers.GLBacteriumRenderer(sim)
+        sim.addRenderer(therenderer)
 
-    sim.pickleSteps = 10
+    sim.pickleSteps = pickleInterval()
     
 def init(cell):
 
@@ -48,7 +123,7 @@ def init(cell):
     cell.targetVol = 2 #* numpy.random.normal(1, 0.05) #for normally distributed variance (middle, std)
     
     # Specify growth rate of cells
-    cell.growthRate = 1.0 + random.uniform(-0.05,0.05) #remove either targetVol or GrowthRate variability
+    cell.growthRate = 1.0 + cellUniform(cell, cr.GROWTH, -0.05,0.05) #remove either targetVol or GrowthRate variability
     cell.parentGrowth = [0] #progenitor cell logged growthRate
     
     cell.color = [2.0, 0.5, 1.5]#specify color of cell
@@ -61,17 +136,61 @@ def init(cell):
     cell.geneamt = [0.0, 0.0, 0.0, 0.0]   #[0]= Ectopic protein, [1]=Euo, [2]=HctA, [3]=HctB
     
     #EB to RB germination time
-    cell.germTime = [(100 + random.uniform(-20,20))] #based on livecell and single cell expansion data: need to measure actually germ time variation and fit to dist
+    cell.germTime = [(100 + cellUniform(cell, cr.GERM_TIME, -20,20))] #based on livecell and single cell expansion data: need to measure actually germ time variation and fit to dist
 
     #RBr > RBe conversion percent
     cell.percentchance = [0,0] #curve that drives RBr > RBe conversion
 
     #Specify initial concentration of chemical 
-    cell.species[:] = [0,0] #species is concentration, normal per cell = * volume
+    cell.species[:] = 0.0
+    cell.species[:2] = [0,0] #species is concentration, normal per cell = * volume
     #cell.signals[:] = [0.0]
 
-def specRateCL(): # Signal adds at rate k0
+def expressionRateCL():
+    # Euo/HctA/HctB kinetics of updateEngine() as species rates keyed on cellType.
+    # g is growthRate for RBs and parentGrowth for IBs, written into species by update().
+    # Rates are per update() step, so they are divided by the integrator time of one step.
+    if not clExpression:
+        return ''
     return '''
+    const float tick = %ff;
+    float g = species[%d];
+    float r1 = species[%d];
+    float r2 = species[%d];
+    float r3 = species[%d];
+    float e1 = species[%d];
+    float e2 = species[%d];
+    float e3 = species[%d];
+    for (int i=%d; i<%d; i++) rates[i] = 0.0f;
+
+    if (cellType==1 || cellType==2){ //RBr, RBe: Euo
+    rates[%d] = (0.02f*g - 0.02f*r1*g)/tick;
+    rates[%d] = (0.5f*g*r1 - 0.08f*g*e1)/tick;
+    }
+    else if (cellType==3){ //IB: Euo decays, HctA
+    rates[%d] = (-0.08f*g*r1)/tick;
+    rates[%d] = (-0.08f*g*e1)/tick;
+    rates[%d] = (0.04f*g - 0.01f*r2)/tick;
+    rates[%d] = (1.0f*g*r2 - 0.05f*g*e2)/tick;
+    }
+    else if (cellType==4){ //pre_EB: HctA decays, HctB
+    rates[%d] = (-0.05f*g*e2)/tick;
+    rates[%d] = (0.08f*g - 0.024f*r3)/tick;
+    rates[%d] = (0.5f*g*r3 - 0.001f*g*e3)/tick;
+    }
+    else if (cellType==5){ //EB
+    rates[%d] = (-0.05f*g*e2)/tick;
+    rates[%d] = (0.06f*g - 0.024f*r3)/tick;
+    rates[%d] = (0.5f*g*r3 - 0.01f*g*e3)/tick;
+    }
+    ''' % (tickTime, GROWTH, RNA+1, RNA+2, RNA+3, GENE+1, GENE+2, GENE+3, GROWTH, GENE+4,
+           RNA+1, GENE+1,
+           RNA+1, GENE+1, RNA+2, GENE+2,
+           GENE+2, RNA+3, GENE+3,
+           GENE+2, RNA+3, GENE+3)
+
+def specRateCL(): # Signal adds at rate k0
+    return expressionRateCL() + '''
     const float k0 = 20.0f;
     const float d0 = 0.0f;
 
@@ -91,6 +210,29 @@ def specRateCL(): # Signal adds at rate k0
     # 200.0f adds 10 every update step
     # d0 = degradation rate of x0
 
+def specRate(species, cellType):
+    # specRateCL() in NumPy, for adaptiveSpecies
+    k0 = 20.0
+    d0 = 0.0
+    k1 = 20.0
+    d1 = 0.0
+    rates = numpy.zeros_like(species)
+    rates[:, 0] = k0 - d0*species[:, 0]
+    rates[:, 1] = k1 - d1*species[:, 1]
+    return rates
+
+def stepSpecies(cells):
+    # One sim step of the species of every cell with speciesInteg, logging the sub-steps on
+    # the recorded steps
+    states = list(cells.values())
+    species = numpy.array([cell.species for cell in states], dtype=float).reshape(len(states), -1)
+    cellType = numpy.fromiter((cell.cellType for cell in states), dtype=numpy.int64, count=len(states))
+    species = speciesInteg.step(species, tickTime, cellType=cellType)
+    for (cell, values) in zip(states, species):
+        cell.species[:] = values
+    if (time - 1) % outputSteps == 0:
+        debug.write('step %d %s' % (time - 1, speciesInteg.report()))
+
 #def sigRateCL(): #Add
 #    return '''
 #    const float k1 = 1.0f;
@@ -98,24 +240,188 @@ def specRateCL(): # Signal adds at rate k0
 #    rates[0] = k1;
 #    ''' 
     
+vectorized = True # advance cells as NumPy columns (ExpressionEngine) instead of the per-cell loop
+engine = ExpressionEngine(4)
+
+useNetwork = False # drive expression from networkSpec (GeneNetwork) instead of updateEngine()
+# Celltypes: 0=germ_EB, 1=RBr, 2=RBe, 3=IB, 4=pre_EB, 5=EB
+networkSpec = {
+    'genes': ['ectExp', 'Euo', 'HctA', 'HctB'],
+    # cellType: {gene: (RNA production, RNA degradation, protein production, protein degradation)}
+    'rates': {
+        1: {'Euo': (0.02, 0.02, 0.5, 0.08)},
+        2: {'Euo': (0.02, 0.02, 0.5, 0.08)},
+        3: {'Euo': (0.0, 0.08, 0.0, 0.08), 'HctA': (0.04, 0.01, 1.0, 0.05)},
+        4: {'HctA': (0.0, 0.0, 0.0, 0.05), 'HctB': (0.08, 0.024, 0.5, 0.001)},
+        5: {'HctA': (0.0, 0.0, 0.0, 0.05), 'HctB': (0.06, 0.024, 0.5, 0.01)},
+        # Transient types a cell passes through within a step, for the per-cell loop's extra
+        # steps: 6 an RBr converting to RBe, which takes one more Euo step at RBr rates before
+        # its RBe step, 7 a pre_EB maturing to EB, which takes its EB step at pre_EB rates
+        6: {'Euo': (0.02, 0.02, 0.5, 0.08)},
+        7: {'HctA': (0.0, 0.0, 0.0, 0.05), 'HctB': (0.08, 0.024, 0.5, 0.001)},
+    },
+    'growth': {1: 'growthRate', 2: 'growthRate', 3: 'parentGrowth', 4: 'parentGrowth', 5: 'parentGrowth',
+               6: 'growthRate', 7: 'parentGrowth'},
+    'decayScaled': {'Euo': (True, True), 'HctA': (False, True), 'HctB': (False, True)},
+    # (source, target, 'repress'/'activate', K, Hill n). Wanted feedback from the notes below, e.g.
+    # ('Euo', 'HctA', 'repress', 1.0, 4), ('HctA', 'Euo', 'repress', 5.0, 2), ('HctB', 'Euo', 'repress', 50.0, 2)
+    'edges': [],
+    'transitions': [(3, 'Euo', '<=', 0.6, 4), (4, 'HctB', '>=', 70, 7),
+                    (6, 'Euo', '>=', -numpy.inf, 2), (7, 'HctB', '>=', -numpy.inf, 5)],
+    'order': [1, 6, 2, 3, 4, 5, 7],
+}
+# Named rate constants and thresholds of updateEngine() and germination(), the values a
+# Sweep varies. The per-cell loop keeps its own literals and networkSpec its own rates.
+params = {
+    'pr1': 0.02, 'dr1': 0.02, 'pp1': 0.5, 'dp1': 0.08, # Euo in RBs
+    'euoDecayIB': 0.08, # Euo RNA and protein decay in IBs
+    'pr2': 0.04, 'dr2': 0.01, 'pp2': 1.0, 'dp2': 0.05, # HctA
+    'pr3': 0.08, 'dr3': 0.024, 'pp3': 0.5, 'dp3': 0.001, # HctB in pre_EBs
+    'pr3EB': 0.06, 'dp3EB': 0.01, # HctB in EBs
+    'washoutEuo': 1.5, # Euo level IBs are held at during the washout
+    'washoutHours': 1, # the washout lasts while time/10 < washoutHours
+    'euoSwitch': 0.6, # IB -> pre_EB when Euo drops to this
+    'hctBSwitch': 70, # pre_EB -> EB when HctB reaches this
+    # percentchance = pcMax/(1 + exp((pcMid - hours*growthRate)*pcSlope)) + pcBase
+    'pcMax': 97.81, 'pcMid': 21.5841312, 'pcSlope': 0.677630536, 'pcBase': 2.19,
+}
+grn = None # GeneNetwork compiled from networkSpec in setup()
+kin = None # LinearKinetics over grn, for exact multi-step jumps
+fastForwardTypes = [5] # terminal types left out of the per-step network update, jumped forward to the recorded steps
+useScheduler = True # test network transitions only for cells whose predicted event is due
+sched = None # TransitionScheduler, built in setup() when useScheduler
+columnOutput = True # record the cells to columns.npz in the output dir (ColumnStore.py) every outputSteps
+outputSteps = 10 # steps between column records, and between pickles without columnOutput
+restartSteps = 100 # steps between restart points: checkpoint bases, or cellStates pickles without checkpoints
+store = None # ColumnWriter of this run, opened in setup()
+aggregate = True # per-type counts and expression statistics of every step to summary.npz (Aggregator.py)
+stats = None # OnlineAggregator of this run, opened in setup()
+recordLineage = True # record every division (parent, daughters, step, types) to lineage.npz (Lineage.py)
+lineage = None # LineageRecorder of this run, opened in setup()
+checkpoints = True # restart checkpoints (Checkpoint.py): a base every restartSteps, deltas every outputSteps
+checkpoint = None # CheckpointWriter of this run, opened in setup()
+dropPickles = False # opt in: pickle cellStates only for what the columns and checkpoints do not cover (every restartSteps without checkpoints, else step 0 only); scripts that read the step pickles need it off
+randomSeed = None # seed of counter-based per-cell draws (CellRandom.py), keyed by cell id, step and purpose; None takes them from the global random streams
+cellRandom = None # CellRandom of this run, built in setup() from randomSeed
+conversionCurve = None # RBr -> RBi conversion chance from a curve of HazardCurves.py ('lva', 'livecell', 'early'), tabulated and evaluated on conversion steps only; None computes the pc* logistic of params every step
+hazard = None # HazardTable of conversionCurve, built in setup()
+scatterAll = False # write every CellState back on every step, set in setup() for the GUI, which draws them all; otherwise only on the recorded and pickled steps (recordedStep())
+lazyColor = True # outside the GUI, color the cells from cellType and geneamt (setColors) in one pass on the recorded steps (every outputSteps) only
+debugLog = None # per-cell debug output of update() and divide(): a DebugLog, at most lines a step every everySteps steps, DebugLog(None) prints all of it; None is DebugLog(lines=20, everySteps=10) in the GUI and silent otherwise
+debug = DebugLog(0) # the DebugLog in use, chosen in setup()
+profile = False # time each phase of a step (update, divide, biophysics, integrator, diffusion, pickles, outputs) and count cells per type, transitions, divisions and bytes written (Profiler.py), to profile.trace.json, .folded and .csv in the output dir; profiler.enabled switches it at run time
+profiler = None # Profiler of this run, made in setup()
+kernelCache = 'kernel-cache' # directory of compiled OpenCL programs (KernelCache.py), reused by later runs on the same device and driver; None compiles them every run
+adaptiveSpecies = False # integrate the species on the host from specRate, with error-controlled sub-steps per cell and ROS2 for the stiff ones (SpeciesIntegrator.py), instead of the OpenCL integrator; the sub-steps taken go to the run log every outputSteps. This model has no signal, so unlike the signalling models it needs no adaptiveGrid
+speciesTol = (1e-4, 1e-6) # relative and absolute error allowed to adaptiveSpecies
+speciesInteg = None # AdaptiveIntegrator of this run, made in setup()
+
+def cellUniform(cell, purpose, low, high):
+    # random.uniform(low, high), or the draw of this cell, step and purpose with randomSeed
+    if cellRandom is None:
+        return random.uniform(low, high)
+    return cellRandom.uniform(cell.id, time, purpose, low, high)
+
+def cellNormal(cell, purpose, mean, sd):
+    # numpy.random.normal(mean, sd), or the draw of this cell, step and purpose with randomSeed
+    if cellRandom is None:
+        return numpy.random.normal(mean, sd)
+    return cellRandom.normal(cell.id, time, purpose, mean, sd)
+
+def pickleInterval():
+    # sim.pickleSteps: a pickle every outputSteps, or with dropPickles only for what columns
+    # and checkpoints do not cover
+    if store is None or not dropPickles:
+        return outputSteps
+    if checkpoint is None:
+        return restartSteps
+    return 10**9 # the step 0 pickle only, restarts come from the checkpoints
+
+def recordedStep():
+    # Whether the state this update() leaves is pickled, recorded or drawn, when every CellState
+    # has to hold it. On the other steps the engine writes back only what CellModeller reads
+    # before the next update() (ExpressionEngine.changedRows())
+    return scatterAll or (time - 1) % outputSteps == 0 or (time - 1) % pickleInterval() == 0
+
+def recordState(cells, step, final=False):
+    # The state of step to the columns, summary and checkpoints that are on: from update(), for
+    # the step before the one it advances, and from finish() for the last
+    if not (vectorized or clExpression):
+        if store is not None:
+            store.record(step, cells, final=final)
+        if stats is not None:
+            stats.recordCells(step, cells, final)
+        if checkpoint is not None:
+            checkpoint.record(step, cells, time=step + 1)
+        return
+    if useNetwork and not clExpression and (final or (stats is not None and stats.records(step))):
+        kin.catchUp(engine, step + 1) # parked cells, on the steps the summary takes
+    if store is not None:
+        store.record(step, cells, engine, final)
+    if stats is not None:
+        stats.record(step, engine.cellType, engine.rnaamt, engine.geneamt, final)
+    if checkpoint is not None:
+        checkpoint.record(step, cells, time=step + 1, lastStep=(engine.ids.copy(), engine.lastStep.copy()))
+
+def finish(cells):
+    # Record the state the last update() left, which no later update() will. BatchRunner and
+    # Fork call this when a run is over, before they close the outputs
+    if vectorized or clExpression:
+        engine.sync(cells, time)
+        if clExpression:
+            engine.readSpecies(cells, RNA, GENE)
+        if useNetwork and not clExpression:
+            kin.catchUp(engine, time) # parked cells, before they are written back
+        engine.scatter(cells)
+    recordState(cells, time - 1, final=True)
+
 time = 0
 def update(cells):
     global time
     time += 1
+    debug.step(time)
+    if vectorized or clExpression:
+        engine.sync(cells, time - 1) # the daughters are as far as their parents
+        before = engine.cellType.copy() if profiler is not None else None
+        if clExpression:
+            engine.readSpecies(cells, RNA, GENE)
+        recordState(cells, time - 2) # the state step-<time-2>.pickle would hold
+        if speciesInteg is not None:
+            stepSpecies(cells)
+        if useNetwork and not clExpression:
+            updateNetwork(engine)
+        else:
+            updateEngine(engine)
+        if clExpression:
+            growth = numpy.where(engine.cellType >= 3, engine.parentGrowth, engine.growthRate)
+            engine.writeSpecies(cells, RNA, GENE, GROWTH, growth)
+        if not engine.colors and lazyColor and (time - 1) % outputSteps == 0:
+            engine.paint(setColors) # the state the next pickle or checkpoint holds
+        if profiler is not None:
+            profiler.cells(before, engine.cellType)
+        engine.scatter(cells, None if recordedStep() else engine.changedRows())
+        return
+    recordState(cells, time - 2)
+    if speciesInteg is not None:
+        stepSpecies(cells)
     #print('time hours = ' + str(time/10))
     
     # Celltypes: 0=germ_EB, 1=RBr, 2=RBe, 3=IB, 4=pre_EB, 5=EB, 6=non-dividing RBs
     # Iterate through each cell
+    before = [cell.cellType for cell in cells.values()] if profiler is not None else None
     for (id, cell) in cells.items():
-        print('cell sp = ' + str(cell.species[1]))
-        print('cell sp norm = ' + str(cell.species[1]*cell.volume))
-        print('time = '+ str(time))
+        debug('cell sp = %s', cell.species[1])
+        debug('cell sp norm = %s', cell.species[1]*cell.volume)
+        debug('time = %s', time)
     
         if time >= cell.germTime[0]:
+            if hazard is None:
 
-            #cell.percentchance[0] = (105/(1 + numpy.exp((1.76663094e+01-(time/10))*3.77251916e-01)) - 5) #on singlecell LVA counts
-            cell.percentchance[0] = (97.81/(1 + numpy.exp((2.15841312e+01-(((time/10)*cell.growthRate)))*6.77630536e-01)) + 2.19) #on livecell data and early RBe counts, percent chance of RB conversion
-            #cell.percentchance[0] = (96.45042921/(1 + numpy.exp((13.60222209-(time/10))*1.4553212)) + 1.68390956)#early RBe counts
+                #cell.percentchance[0] = (105/(1 + numpy.exp((1.76663094e+01-(time/10))*3.77251916e-01)) - 5) #on singlecell LVA counts
+                cell.percentchance[0] = (97.81/(1 + numpy.exp((2.15841312e+01-(((time/10)*cell.growthRate)))*6.77630536e-01)) + 2.19) #on livecell data and early RBe counts, percent chance of RB conversion
+                #cell.percentchance[0] = (96.45042921/(1 + numpy.exp((13.60222209-(time/10))*1.4553212)) + 1.68390956)#early RBe counts
+            elif (time/10).is_integer() and cell.cellType <= 1:
+                cell.percentchance[0] = hazard(time/10, cell.growthRate)
        
         #pr = RNA production rate
         #dr = RNA degradation rate
@@ -148,7 +454,7 @@ def update(cells):
             cell.growthRate = 0.0
             if time >= cell.germTime[0]: #Become RBr if time is reached
                 cell.cellType = 1 #RBr
-                cell.growthRate = 1.0 + random.uniform(-0.05,0.05)
+                cell.growthRate = 1.0 + cellUniform(cell, cr.GROWTH, -0.05,0.05)
                 cell.parentGrowth[0] = cell.growthRate #why is this here?
                 
         if cell.cellType == 1: #RBr
@@ -165,8 +471,8 @@ def update(cells):
             #print('percentchance = ' + str(cell.percentchance[0]))
             #print('RBe Trigger Value = ' + str(cell.percentchance[0]))
             
-            if (time/10).is_integer() and random.uniform(0,100) <= cell.percentchance[0]:
-                print('im an RBe')
+            if (time/10).is_integer() and cellUniform(cell, cr.CONVERSION, 0,100) <= cell.percentchance[0]:
+                debug('im an RBe')
                 cell.cellType = 2 #RBe conversion
                 cell.rnaamt[1] = cell.rnaamt[1] + (pr1 * cell.growthRate) - (dr1 * cell.rnaamt[1] * cell.growthRate) #Euo RNA
                 cell.geneamt[1] = cell.geneamt[1] + (pp1 * cell.growthRate * cell.rnaamt[1]) - (dp1 * cell.growthRate * cell.geneamt[1]) #Euo
@@ -199,8 +505,8 @@ def update(cells):
             cell.geneamt[1] = cell.geneamt[1] - (dp1 * cell.parentGrowth[0] * cell.geneamt[1]) # Euo
             cell.rnaamt[2] = cell.rnaamt[2] + (pr2 * cell.parentGrowth[0])  - (dr2 * cell.rnaamt[2]) #hctA RNA
             cell.geneamt[2] = cell.geneamt[2] + (pp2 * cell.parentGrowth[0] * cell.rnaamt[2]) - (dp2 * cell.parentGrowth[0] * cell.geneamt[2]) #hctA
-            print('Euo= '+str(cell.geneamt[1]))
-            print('HctA= '+str(cell.geneamt[2]))
+            debug('Euo= %s', cell.geneamt[1])
+            debug('HctA= %s', cell.geneamt[2])
             if (time/10) < 1: #theo washout with E-Euo-flag
                 cell.geneamt[1] = 1.5 #keeps Euo high to repress ctcB and hctA
             cell.color = [[0, cell.geneamt[1], cell.geneamt[2]]] #blue fast
@@ -226,22 +532,178 @@ def update(cells):
             cell.rnaamt[3] = cell.rnaamt[3] + (pr3 * cell.parentGrowth[0])  - (dr3 * cell.rnaamt[3]) #hctB RNA
             cell.geneamt[3] = cell.geneamt[3] + (pp3 * cell.parentGrowth[0] * cell.rnaamt[3])  - (dp3 * cell.parentGrowth[0] * cell.geneamt[3]) #hctB
             cell.color = [[cell.geneamt[3], 0.0, cell.geneamt[2]]] #pink
+    if profiler is not None:
+        profiler.cells(before, [cell.cellType for cell in cells.values()])
             
+def germination(eng, germinating=None):
+    # Start of every vectorised step: conversion curve, division flags and EB germination.
+    # Draws are made for germinating cells and then RBr conversion in cell order, as in the
+    # per-cell loop. germinating, from the TransitionScheduler, marks the cells due to
+    # germinate; without it every cell is tested against germTime. Returns the RBr cells that convert to RBe this step.
+    time2 = time/10
+    ct = eng.cellType
+    g = eng.growthRate
+
+    germ = time >= eng.germTime
+    if hazard is None:
+        eng.percentchance[germ] = (params['pcMax']/(1 + numpy.exp((params['pcMid']-((time2*g[germ])))*params['pcSlope'])) + params['pcBase'])
+    elif time2.is_integer():
+        due = germ & (ct <= 1) # the RBrs after germination below, which make a conversion draw
+        eng.percentchance[due] = hazard(time2, g[due])
+
+    #flag cells that reach target size for division
+    eng.divideFlag[eng.volume > eng.targetVol] = True
+
+    #germinating EB>RB
+    geb = ct == 0
+    eng.divideFlag[geb] = False
+    g[geb] = 0.0
+    germinate = geb & (germ if germinating is None else germinating)
+    ct[germinate] = 1 #RBr
+
+    rbr = ct == 1
+    trigger = rbr if time2.is_integer() else numpy.zeros_like(rbr)
+    if cellRandom is None:
+        germDraw, convDraw = eng.uniformDraws((germinate, -0.05, 0.05), (trigger, 0, 100))
+    else:
+        germDraw = cellRandom.uniform(eng.ids, time, cr.GROWTH, -0.05, 0.05, germinate)
+        convDraw = cellRandom.uniform(eng.ids, time, cr.CONVERSION, 0, 100, trigger)
+    g[germinate] = 1.0 + germDraw[germinate]
+    eng.parentGrowth[germinate] = g[germinate]
+    return trigger & (convDraw <= eng.percentchance)
+
+def setColors(eng):
+    # Colors depend only on the type and levels a cell ends the step with
+    if not eng.colors:
+        return # painted on the recorded steps (ExpressionEngine.paint()), or never in an Ensemble
+    ct = eng.cellType
+    gene = eng.geneamt
+    with numpy.errstate(divide='ignore'):
+        eng.setColor((ct == 1) | (ct == 2), 1/gene[:,1], 1, 1/gene[:,1]) #RBr, RBe
+    eng.setColor(ct == 3, 0, gene[:,1], gene[:,2]) #IB blue fast
+    eng.setColor(ct == 4, gene[:,3]/20, gene[:,1], gene[:,2]) #pre_EB blue to black to pink
+    eng.setColor(ct == 5, gene[:,3], 0.0, gene[:,2]) #EB pink
+
+def updateEngine(eng):
+    # Vectorised form of the per-cell loop in update(): every cell of a type is advanced
+    # with one array operation on its rows, in the same order and with the same rates as the
+    # loop. The rows of a type are found once per block, so an operation costs its cells,
+    # not the whole population (an Ensemble's engine holds every replicate).
+    # With clExpression the kernel does the kinetics and only the cell type switching runs here
+    time2 = time/10
+    kinetics = not clExpression
+    ct = eng.cellType
+    g = eng.growthRate
+    pg = eng.parentGrowth
+    rna = eng.rnaamt
+    gene = eng.geneamt
+
+    #pr = RNA production rate, dr = RNA degradation rate
+    pr1 = params['pr1']
+    pr2 = params['pr2']
+    dr1 = params['dr1']
+    dr2 = params['dr2']
+    #pp = protein production rate, dp = protein degradation rate
+    pp1 = params['pp1']
+    pp2 = params['pp2']
+    dp1 = params['dp1']
+    dp2 = params['dp2']
+
+    def euoStep(m):
+        if not kinetics:
+            return
+        rna[m,1] = rna[m,1] + (pr1 * g[m]) - (dr1 * rna[m,1] * g[m]) #Euo RNA
+        gene[m,1] = gene[m,1] + (pp1 * g[m] * rna[m,1]) - (dp1 * g[m] * gene[m,1]) #Euo
+
+    rbe = numpy.nonzero(germination(eng))[0]
+
+    #RBr
+    rbr = numpy.nonzero(ct == 1)[0]
+    gene[rbr,0] = 0
+    euoStep(rbr)
+    gene[rbr,2] = 0 # HctA
+    gene[rbr,3] = 0 # HctB
+    ct[rbe] = 2 #RBe conversion
+    euoStep(rbe)
+
+    #RBe
+    euoStep(numpy.nonzero(ct == 2)[0])
+
+    #IB
+    ib = numpy.nonzero(ct == 3)[0]
+    p = pg[ib]
+    if kinetics:
+        rna[ib,1] = rna[ib,1] - (params['euoDecayIB'] * p * rna[ib,1]) # Euo
+        gene[ib,1] = gene[ib,1] - (params['euoDecayIB'] * p * gene[ib,1]) # Euo
+        rna[ib,2] = rna[ib,2] + (pr2 * p) - (dr2 * rna[ib,2]) #hctA RNA
+        gene[ib,2] = gene[ib,2] + (pp2 * p * rna[ib,2]) - (dp2 * p * gene[ib,2]) #hctA
+    if time2 < params['washoutHours']: #theo washout with E-Euo-flag
+        gene[ib,1] = params['washoutEuo']
+    ct[ib[gene[ib,1] <= params['euoSwitch']]] = 4 #pre_EB
+
+    #pre_EB
+    peb = numpy.nonzero(ct == 4)[0]
+    p = pg[peb]
+    if kinetics:
+        gene[peb,2] = gene[peb,2] - (dp2 * p * gene[peb,2]) #hctA
+        rna[peb,3] = rna[peb,3] + (params['pr3'] * p) - (params['dr3'] * rna[peb,3]) #hctB RNA
+        gene[peb,3] = gene[peb,3] + (params['pp3'] * p * rna[peb,3]) - (params['dp3'] * p * gene[peb,3]) #hctB
+    g[peb] = 0
+    matured = numpy.zeros(len(ct), dtype=bool)
+    matured[peb[gene[peb,3] >= params['hctBSwitch']]] = True
+    ct[matured] = 5 #infectious EB
+
+    #infectious EB. Cells that matured this step still carry the pre_EB hctB rates,
+    #as they do in the per-cell loop
+    eb = numpy.nonzero(ct == 5)[0]
+    p = pg[eb]
+    pr3 = numpy.where(matured[eb], params['pr3'], params['pr3EB'])
+    dp3 = numpy.where(matured[eb], params['dp3'], params['dp3EB'])
+    if kinetics:
+        gene[eb,2] = gene[eb,2] - (dp2 * p * gene[eb,2]) #hctA
+        rna[eb,3] = rna[eb,3] + (pr3 * p) - (params['dr3'] * rna[eb,3]) #hctB RNA
+        gene[eb,3] = gene[eb,3] + (params['pp3'] * p * rna[eb,3]) - (dp3 * p * gene[eb,3]) #hctB
+
+    setColors(eng)
+
+def updateNetwork(eng):
+    # updateEngine() driven by the compiled networkSpec: the type blocks in order, a cell that
+    # converts or crosses a threshold running the blocks of its new types in the same step
+    ct = eng.cellType
+    due = None
+    if sched is not None:
+        sched.track(eng, time)
+        due = numpy.zeros(len(ct), dtype=bool)
+        due[sched.due(eng, time)] = True
+    rbe = germination(eng, due)
+    pins = {1: {'ectExp': 0, 'HctA': 0, 'HctB': 0}} #RBr
+    if time/10 < params['washoutHours']: #theo washout with E-Euo-flag
+        pins[3] = {'Euo': params['washoutEuo']}
+    parked = numpy.isin(ct, fastForwardTypes)
+    moved = grn.update(eng, ~parked, due, [(rbe, 6)], pins) #RBe conversion through 6
+    eng.lastStep[~parked] = time
+    if sched is not None:
+        sched.schedule(eng, numpy.nonzero(due | moved)[0], time + 1)
+    if (time - 1) % outputSteps == 0:
+        kin.catchUp(eng, time) # parked cells, for the state the next pickle, column record or checkpoint holds
+    eng.growthRate[(ct == 4) | (moved & (ct == 5))] = 0 # every cell that ran the pre_EB block
+    setColors(eng)
+
 def divide(parent, d1, d2):
     # Specify target cell size that triggers cell division
     # Celltype1=RBr, Celltype2=RBe, Celltype3=IB, Celltype4=immature EB, Celltype5=mature EB
     
     if parent.cellType == 1: # If RBr: make 2RBrs
-        print('p sp = ' + str(parent.species[1]))
+        debug('p sp = %s', parent.species[1])
         d1.cellType = 1
         d1.targetVol = 2
-        d1.growthRate = parent.parentGrowth[0] * numpy.random.normal(1, 0.05)
+        d1.growthRate = parent.parentGrowth[0] * cellNormal(d1, cr.DIVISION, 1, 0.05)
        
         d2.cellType = 1
         d2.targetVol = 2 #* numpy.random.normal(1, 0.05)
-        d2.growthRate = parent.parentGrowth[0] * numpy.random.normal(1, 0.05)
-        print('d1 sp = ' + str(d1.species[1]))
-        print('d2 sp = ' + str(d2.species[1]))
+        d2.growthRate = parent.parentGrowth[0] * cellNormal(d2, cr.DIVISION, 1, 0.05)
+        debug('d1 sp = %s', d1.species[1])
+        debug('d2 sp = %s', d2.species[1])
         d1.geneamt[0] = parent.geneamt[0]/2
         d2.geneamt[0] = parent.geneamt[0]/2
         d1.geneamt[1] = parent.geneamt[1]/2
@@ -250,7 +712,7 @@ def divide(parent, d1, d2):
     if parent.cellType == 2: # If RBe: make 1RBe, 1IB
         d1.cellType = 2
         d1.targetVol = 2 
-        d1.growthRate = parent.parentGrowth[0] * numpy.random.normal(1, 0.05)
+        d1.growthRate = parent.parentGrowth[0] * cellNormal(d1, cr.DIVISION, 1, 0.05)
         
         d2.cellType = 3
         d2.growthRate = 0
@@ -261,7 +723,53 @@ def divide(parent, d1, d2):
         d2.geneamt[0] = parent.geneamt[0]/2
         d1.geneamt[1] = parent.geneamt[1]/2
         d2.geneamt[1] = parent.geneamt[1]/2 
-        
+
+    if clExpression: # protein levels live in species when the kernel runs the kinetics
+        d1.species[GENE:GENE+2] = d1.geneamt[0:2]
+        d2.species[GENE:GENE+2] = d2.geneamt[0:2]
+
+    if lineage is not None:
+        lineage.record(time - 1, parent.id, d1.id, d2.id, parent.cellType, d1.cellType, d2.cellType)
+
+def divideEngine(eng, d1, d2):
+    # Vectorised divide() for an Ensemble. d1 and d2 are the rows of each parent's two
+    # daughters, which start as copies of the parent as in CellModeller. Draws are made
+    # per parent, d1 then d2, in the order divide() makes them.
+    ct = eng.cellType[d1].copy()
+    parentRate = eng.parentGrowth[d1].copy()
+    growth = eng.growthRate[d1].copy()
+    rbr = ct == 1
+    rbe = ct == 2
+    first = numpy.zeros(len(eng), dtype=bool)
+    second = numpy.zeros(len(eng), dtype=bool)
+    first[d1[rbr | rbe]] = True
+    second[d2[rbr]] = True
+    if cellRandom is None:
+        n1, n2 = eng.normalDraws((first, 1, 0.05), (second, 1, 0.05))
+    else:
+        n1 = cellRandom.normal(eng.ids, time, cr.DIVISION, 1, 0.05, first)
+        n2 = cellRandom.normal(eng.ids, time, cr.DIVISION, 1, 0.05, second)
+
+    # RBr: make 2 RBrs
+    eng.cellType[d1[rbr]] = 1
+    eng.targetVol[d1[rbr]] = 2
+    eng.growthRate[d1[rbr]] = parentRate[rbr] * n1[d1[rbr]]
+    eng.cellType[d2[rbr]] = 1
+    eng.targetVol[d2[rbr]] = 2
+    eng.growthRate[d2[rbr]] = parentRate[rbr] * n2[d2[rbr]]
+
+    # RBe: make 1 RBe, 1 IB
+    eng.cellType[d1[rbe]] = 2
+    eng.targetVol[d1[rbe]] = 2
+    eng.growthRate[d1[rbe]] = parentRate[rbe] * n1[d1[rbe]]
+    eng.cellType[d2[rbe]] = 3
+    eng.growthRate[d2[rbe]] = 0
+    eng.parentGrowth[d2[rbe]] = growth[rbe]
+    eng.targetVol[d2[rbe]] = 10
+
+    split = numpy.concatenate([d1[rbr | rbe], d2[rbr | rbe]])
+    eng.geneamt[split, 0:2] = eng.geneamt[split, 0:2]/2
+
 #this model: GermEB lavendar, Rbr green, Rbe green, IB blue>black>red, EB  hot pink
 
 # Rbr matures into Rbe based on percentchance curve from empirical data
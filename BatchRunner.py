@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import traceback
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import numpy
+
+# Process-pool runner for replicate and variant runs of a model file, the parallel form of
+# launching Scripts/batch.py by hand:
+#
+#   python BatchRunner.py Asym-production-E-euo-washout.py --replicates 10 --workers 4
+#
+#   runner = BatchRunner('Asym-production-E-euo-washout.py', replicates=10, seeds=range(10),
+#                        variants={'base': {}, 'wellMixed': {'wellMixed': True}})
+#   manifest = runner.run()
+#
+# Every (variant, replicate) pair is one job. Workers are separate processes (spawned, as
+# OpenCL contexts do not survive a fork) and each takes a worker slot that picks its OpenCL
+# device, so a worker holds one context at a time. A job imports the model afresh, applies
+# the variant's module flags, seeds random and numpy.random and runs a Simulator that saves
+# to its own output directory, then has the model record the state the run ended in (its
+# finish()) and closes the outputs. Jobs that raise close their outputs too, keeping what
+# they recorded, and they and jobs lost with a crashed worker are resubmitted up to retries
+# times. manifest.json in outputDir lists every job (Fork.py writes its branches' there too).
+
+def jobName(model, variant, replicate, seed):
+    name = '%s-r%03d-s%d' % (os.path.splitext(os.path.basename(model))[0], replicate, seed)
+    return '%s-%s' % (name, variant) if variant else name
+
+workerDevice = None
+
+def initWorker(slots, platform, devices):
+    # Runs once in each worker process: claim a slot and with it an OpenCL device
+    global workerDevice
+    slot = slots.get()
+    workerDevice = (platform, devices[slot % len(devices)])
+
+def runJob(job):
+    # Run one replicate in this worker, returns (output directory, seconds)
+    from CellModeller.Simulator import Simulator
+    start = time.time()
+    path, name = os.path.split(os.path.abspath(job['model']))
+    moduleName = os.path.splitext(name)[0]
+    if path not in sys.path:
+        sys.path.append(path)
+    sys.modules.pop(moduleName, None) # module globals (time, engine) hold the previous run
+    module = __import__(moduleName)
+    for (flag, value) in job['flags'].items():
+        setattr(module, flag, value)
+    random.seed(job['seed'])
+    numpy.random.seed(job['seed'])
+    (platform, device) = workerDevice
+    finished = None
+    try:
+        sim = Simulator(moduleName, job['dt'], clPlatformNum=platform, clDeviceNum=device,
+                        saveOutput=True, outputDirName=job['name'])
+        maxCells = getattr(module, 'max_cells', None)
+        steps = job['steps']
+        while (sim.stepNum < steps) if steps else (len(sim.cellStates) < maxCells):
+            sim.step()
+        finished = sim
+    finally:
+        closeOutputs(module, finished) # a failed run keeps what it recorded
+    outputDir = getattr(sim, 'outputDirPath', os.path.join('data', job['name']))
+    return (os.path.abspath(outputDir), time.time() - start)
+
+def closeOutputs(module, sim=None):
+    # Write out the last records and let go of the run's files now, the worker lives on. sim
+    # is given when the run finished: the model first records the state it ended in (its
+    # finish(), when it has one)
+    try:
+        if sim is not None and hasattr(module, 'finish'):
+            module.finish(sim.cellStates)
+    finally:
+        for output in [getattr(module, name, None) for name in ['store', 'stats', 'lineage', 'checkpoint', 'profiler']]:
+            if output is not None:
+                output.close()
+
+def writeManifest(outputDir, manifest):
+    # outputDir/manifest.json, replaced atomically so a reader never sees half of it
+    os.makedirs(outputDir, exist_ok=True)
+    path = os.path.join(outputDir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+class BatchRunner:
+
+    def __init__(self, model, replicates=1, seeds=None, variants=None, steps=None, dt=0.025,
+                 workers=None, platform=0, devices=(0,), retries=2, outputDir='.'):
+        seeds = list(range(replicates)) if seeds is None else list(seeds)
+        if len(seeds) < replicates:
+            raise ValueError('%d seeds given for %d replicates' % (len(seeds), replicates))
+        self.model = model
+        self.variants = variants if variants else {'': {}}
+        self.workers = workers or os.cpu_count()
+        self.platform = platform
+        self.devices = list(devices)
+        self.retries = retries
+        self.outputDir = outputDir
+        self.jobs = []
+        for (variant, flags) in self.variants.items():
+            for replicate in range(replicates):
+                seed = seeds[replicate]
+                self.jobs.append({'name': jobName(model, variant, replicate, seed), 'model': model,
+                                  'variant': variant, 'replicate': replicate, 'seed': seed,
+                                  'flags': dict(flags), 'steps': steps, 'dt': dt,
+                                  'status': 'pending', 'attempts': 0, 'outputDir': None,
+                                  'seconds': None, 'error': None})
+
+    def newPool(self):
+        ctx = multiprocessing.get_context('spawn')
+        slots = ctx.Queue()
+        for slot in range(self.workers):
+            slots.put(slot)
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=initWorker,
+                                                      initargs=(slots, self.platform, self.devices))
+
+    def run(self):
+        # Run every pending job, resubmitting failures, and return the manifest
+        pool = self.newPool()
+        try:
+            while True:
+                pending = [job for job in self.jobs if job['status'] == 'pending']
+                if not pending:
+                    break
+                futures = {}
+                for job in pending:
+                    job['attempts'] += 1
+                    futures[pool.submit(runJob, job)] = job
+                broken = False
+                for future in concurrent.futures.as_completed(futures):
+                    job = futures[future]
+                    try:
+                        (job['outputDir'], job['seconds']) = future.result()
+                        job['status'] = 'done'
+                        job['error'] = None
+                    except Exception as e:
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                        job['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                        job['status'] = 'pending' if job['attempts'] <= self.retries else 'failed'
+                    self.writeManifest()
+                if broken:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.newPool()
+        finally:
+            pool.shutdown()
+        return self.writeManifest()
+
+    def writeManifest(self):
+        return writeManifest(self.outputDir, {'model': self.model, 'variants': self.variants, 'jobs': self.jobs})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run replicates of a CellModeller model file in a process pool')
+    parser.add_argument('model')
+    parser.add_argument('--replicates', type=int, default=1)
+    parser.add_argument('--seeds', type=int, nargs='*')
+    parser.add_argument('--steps', type=int, help='steps per run, default until max_cells')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--platform', type=int, default=0)
+    parser.add_argument('--devices', type=int, nargs='*', default=[0])
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--wellMixed', action='store_true', help='run the physics-free backend')
+    parser.add_argument('--outputDir', default='.')
+    args = parser.parse_args()
+    variants = {'wellMixed': {'wellMixed': True}} if args.wellMixed else None
+    runner = BatchRunner(args.model, args.replicates, args.seeds, variants, args.steps,
+                         workers=args.workers, platform=args.platform, devices=args.devices,
+                         retries=args.retries, outputDir=args.outputDir)
+    manifest = runner.run()
+    failed = [job['name'] for job in manifest['jobs'] if job['status'] != 'done']
+    print('%d runs, %d failed %s' % (len(manifest['jobs']), len(failed), ' '.join(failed)))
@@ -0,0 +1,225 @@
+import os
+import sys
+import copy
+import json
+import time
+import pickle
+import argparse
+import platform
+import tempfile
+import importlib.util
+import numpy
+from CellState import CellState
+from ColumnStore import ColumnWriter, ColumnReader
+
+# Step-level benchmarks of the model callbacks and of snapshot I/O on synthetic populations,
+# without OpenCL:
+#
+#   python Benchmark.py --sizes 1000 10000 100000 --out bench-baseline.json
+#   python Benchmark.py --baseline bench-baseline.json  # run again and compare, exit 1 on a regression
+#
+#   results = run(['Asym-production-E-euo-washout.py'], sizes=[1000, 10000])
+#   for (name, seconds, base, ratio, slower) in compare(results, baseline): ...
+#
+# The model's setup() runs against StubSim, a Simulator stand-in with the well-mixed backend,
+# so no OpenCL context, renderer or output file is made. A population of n cells is built by
+# the model's own init() (through its regulator, as Simulator.addCell does) and then given the
+# cellType mix and expression levels of a mid-development inclusion (mix), at startTime, past
+# germination. Timed, as the median of repeats, for each model and size:
+#   update/<variant>    update() of the population per step, over the outputSteps steps of
+#                       one record cycle after a warm-up step (the engine sync of new cells is
+#                       in the warm-up), so the engine's full write-back on the recorded step is
+#                       counted: engine, network (useNetwork) and perCell (the loop)
+#   divide              divide() over a burst of divisions of divideFraction of the cells;
+#                       the daughters are deep copies as in CellModeller, made untimed
+#   pickleWrite/Read    the step pickle of the population
+#   columnsWrite/Read   one ColumnStore record of it, and reading that step back
+# Results are {model/cells/benchmark: seconds}, saved as JSON with the machine and versions.
+
+variants = {'engine': {}, 'network': {'useNetwork': True}, 'perCell': {'vectorized': False}}
+mix = {1: 0.25, 2: 0.15, 3: 0.25, 4: 0.15, 5: 0.20} # cellType fractions, RBr/RBe-RBi/IB/pre-EB/EB
+startTime = 300 # update() counter of the population, 30 h
+modelFiles = ['Asym-production-E-euo-washout.py', 'Asym-production-E-euo-washout_2.py',
+              'RBr-RBi-IBr-IBe-EB-model_10-14-21.py']
+
+class StubSim:
+    # What setup() and the callbacks use of a Simulator, for the well-mixed backend
+
+    def __init__(self, module, dt=0.025):
+        self.module = module
+        self.moduleName = module.__name__
+        self.dt = dt
+        self.is_gui = False
+        self.saveOutput = False
+        self.cellStates = {}
+        self.lineage = {}
+        self.pickleSteps = 10
+
+    def init(self, phys, reg, sig, integ):
+        self.phys = phys
+        self.reg = reg
+
+    def addCell(self, cellType=0, **kwargs):
+        pass # populate() makes the cells
+
+    def addRenderer(self, renderer):
+        pass
+
+def loadModel(path, flags, simClass=StubSim):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for (name, value) in dict(flags, wellMixed=True).items():
+        setattr(module, name, value)
+    sim = simClass(module)
+    module.setup(sim)
+    return (module, sim)
+
+def populate(module, sim, n, seed=0):
+    # n cells made by init(), then set to the mix
+    rng = numpy.random.default_rng(seed)
+    types = numpy.array(sorted(mix))
+    cellTypes = rng.choice(types, size=n, p=[mix[t] for t in types])
+    cells = {}
+    for cid in range(n):
+        cell = CellState(cid)
+        cell.cellType = 0
+        sim.reg.addCell(cell)
+        sim.phys.addCell(cell, length=float(rng.uniform(1.0, 2.2)))
+        cell.cellType = int(cellTypes[cid])
+        nGenes = len(cell.geneamt)
+        cell.rnaamt[:] = rng.uniform(0, 2, nGenes).tolist()
+        cell.geneamt[:] = rng.uniform(0, 10, nGenes).tolist()
+        if cell.cellType >= 3: # IBs and EBs keep their parent's growth and do not divide
+            cell.parentGrowth[0] = cell.growthRate
+            cell.growthRate = 0.0
+            cell.targetVol = 10
+        cells[cid] = cell
+    sim.cellStates = cells
+    module.time = startTime
+    return cells
+
+def timed(fn, repeats, prepare=None):
+    times = []
+    for _ in range(repeats):
+        args = prepare() if prepare is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return float(numpy.median(times))
+
+def burst(cells, fraction, nextId, seed=0):
+    # (parent, d1, d2) for fraction of the cells, dividing RBs, daughters deep copied
+    rng = numpy.random.default_rng(seed)
+    dividing = [cell for cell in cells.values() if cell.cellType in (1, 2)]
+    chosen = rng.permutation(len(dividing))[:int(fraction * len(cells))]
+    out = []
+    for i in chosen.tolist():
+        parent = dividing[i]
+        d1 = copy.deepcopy(parent)
+        d2 = copy.deepcopy(parent)
+        d1.id, d2.id = nextId, nextId + 1
+        nextId += 2
+        d1.volume = d2.volume = parent.volume / 2
+        out.append((parent, d1, d2))
+    return out
+
+def benchUpdate(path, n, repeats=3, only=None):
+    # {model/cells/update/variant: seconds per update()}
+    name = os.path.splitext(os.path.basename(path))[0]
+    results = {}
+    for (variant, flags) in variants.items():
+        if only and variant not in only:
+            continue
+        (module, sim) = loadModel(path, flags)
+        cells = populate(module, sim, n)
+        module.update(cells)
+        cycle = module.outputSteps
+        def steps():
+            for _ in range(cycle):
+                module.update(cells)
+        results['%s/%d/update/%s' % (name, n, variant)] = timed(steps, repeats) / cycle
+    return results
+
+def benchModel(path, n, repeats=3, divideFraction=0.1, only=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+    results = benchUpdate(path, n, repeats, only)
+    (module, sim) = loadModel(path, {})
+    cells = populate(module, sim, n)
+    division = lambda triples: [module.divide(*triple) for triple in triples]
+    results['%s/%d/divide' % (name, n)] = timed(division, repeats, lambda: (burst(cells, divideFraction, n),))
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'step.pickle')
+        data = {'cellStates': cells, 'stepNum': startTime, 'lineage': {}, 'moduleName': sim.moduleName}
+        def write():
+            with open(path, 'wb') as f:
+                pickle.dump(data, f, protocol=-1)
+        def read():
+            with open(path, 'rb') as f:
+                pickle.load(f)
+        results['%s/%d/pickleWrite' % (name, n)] = timed(write, repeats)
+        results['%s/%d/pickleRead' % (name, n)] = timed(read, repeats)
+        columns = os.path.join(folder, 'columns.npz')
+        nGenes = len(next(iter(cells.values())).geneamt)
+        def writeColumns():
+            store = ColumnWriter(columns, 1, nGenes)
+            store.record(0, cells)
+            store.close()
+        def readColumns():
+            reader = ColumnReader(columns)
+            reader.at(0)
+            reader.close()
+        results['%s/%d/columnsWrite' % (name, n)] = timed(writeColumns, repeats)
+        results['%s/%d/columnsRead' % (name, n)] = timed(readColumns, repeats)
+    return results
+
+def run(models=None, sizes=(1000, 10000, 100000), repeats=3, only=None):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for model in models or [os.path.join(folder, name) for name in modelFiles]:
+        for n in sizes:
+            results.update(benchModel(model, n, repeats, only=only))
+    return results
+
+def machine():
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def save(path, results):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'machine': machine(), 'results': results}, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+def compare(results, baseline, tolerance=1.25):
+    # (name, seconds, baseline seconds, ratio, slower than tolerance) for names in both
+    rows = []
+    for name in sorted(results):
+        if name in baseline:
+            ratio = results[name] / max(baseline[name], 1e-9)
+            rows.append((name, results[name], baseline[name], ratio, ratio > tolerance))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time update(), divide() and snapshot I/O on synthetic populations')
+    parser.add_argument('models', nargs='*', help='model files, default the three models')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--variants', nargs='*', choices=sorted(variants), help='update() variants, default all')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio counted as a regression')
+    args = parser.parse_args()
+    results = run(args.models, args.sizes, args.repeats, args.variants)
+    if args.out:
+        save(args.out, results)
+    if args.baseline:
+        rows = compare(results, load(args.baseline), args.tolerance)
+        for (name, seconds, base, ratio, slower) in rows:
+            print('%-60s %10.4f s %10.4f s %6.2fx%s' % (name, seconds, base, ratio, '  SLOWER' if slower else ''))
+        sys.exit(1 if any(row[4] for row in rows) else 0)
+    for (name, seconds) in sorted(results.items()):
+        print('%-60s %10.4f s' % (name, seconds))
@@ -0,0 +1,84 @@
+import numpy
+from Sweep import Sweep
+
+# Fitting the params of a model to observed cell type counts, by running it.
+#
+#   observed = {'RB': ([1, 2], hours, rbCounts),   # cellTypes summed, observation times, values
+#               'IB': ([3, 4], hours, ibCounts),
+#               'EB': ([5], hours, ebCounts)}
+#   cal = Calibration('Asym-production-E-euo-washout.py', {'pcMid': (15, 30), 'pcSlope': (0.2, 1.5)},
+#                     observed, replicates=50)
+#   fit = cal.fit(generations=8, population=24, workers=8)
+#   fit['params'], fit['loss']     # best point found, cal.loss(point) of any other
+#
+# Each candidate point is run as an Ensemble through Sweep.run(), so points are evaluated in
+# parallel worker processes and every evaluated point is cached on disk (cacheDir) and
+# reused by later fits with the same settings. All points share the seed, so they see the
+# same random streams and the loss changes smoothly with the parameters.
+#
+# The loss is, summed over the observed series, the mean squared difference between the
+# replicate mean of the series and the observations, scaled by the largest observation of the
+# series so series of different sizes weigh alike. With fractions=True the series are compared
+# as fractions of all cells at each time. Hours are converted at stepsPerHour (time2 = time/10
+# in the models).
+#
+# fit() is a cross-entropy search in the unit cube of the ranges: a Latin hypercube first,
+# then each generation samples population points around the mean of the elite (the best
+# points so far) with the spread of the elite, so the search narrows as the elite agrees.
+
+class Calibration(Sweep):
+
+    def __init__(self, model, ranges, observed, replicates=50, seed=1, cacheDir='sweep-cache', flags=None,
+                 fractions=False, stepsPerHour=10):
+        self.observed = {}
+        for (name, (types, hours, values)) in observed.items():
+            hours = numpy.asarray(hours, dtype=float)
+            index = numpy.maximum(numpy.rint(hours * stepsPerHour).astype(numpy.int64) - 1, 0)
+            self.observed[name] = (list(numpy.atleast_1d(types)), index, numpy.asarray(values, dtype=float))
+        steps = int(max(index.max() for (types, index, values) in self.observed.values())) + 1
+        Sweep.__init__(self, model, ranges, replicates, steps, seed, cacheDir, flags)
+        self.fractions = fractions
+        self.evaluated = [] # (point, loss) of every point evaluated by fit(), in order
+
+    def series(self, result):
+        # The observed series of one Sweep result: {name: replicate mean at the observed times}
+        mean = result['mean']
+        if self.fractions:
+            mean = mean / numpy.maximum(mean.sum(axis=1, keepdims=True), 1e-12)
+        return {name: mean[index][:, types].sum(axis=1) for (name, (types, index, values)) in self.observed.items()}
+
+    def lossOf(self, result):
+        loss = 0.0
+        for (name, simulated) in self.series(result).items():
+            values = self.observed[name][2]
+            loss += numpy.mean(((simulated - values) / max(numpy.abs(values).max(), 1e-12))**2)
+        return float(loss)
+
+    def loss(self, point, workers=None):
+        return self.lossOf(self.run([point], workers)[0])
+
+    def evaluate(self, unit, workers):
+        points = self.scale(unit)
+        losses = numpy.array([self.lossOf(result) for result in self.run(points, workers)])
+        self.evaluated += list(zip(points, losses.tolist()))
+        return losses
+
+    def fit(self, generations=8, population=24, elite=6, workers=None, seed=0, minSpread=0.01):
+        # Best point found: {'params', 'loss', 'result', 'evaluated'}
+        rng = numpy.random.default_rng(seed)
+        k = len(self.names)
+        unit = numpy.empty((population, k))
+        for j in range(k):
+            unit[:, j] = (rng.permutation(population) + rng.random(population)) / population
+        losses = self.evaluate(unit, workers)
+        for generation in range(generations):
+            best = numpy.argsort(losses, kind='stable')[:elite]
+            center = unit[best].mean(axis=0)
+            spread = numpy.maximum(unit[best].std(axis=0), minSpread)
+            candidates = numpy.clip(center + spread * rng.standard_normal((population, k)), 0, 1)
+            unit = numpy.concatenate([unit[best], candidates]) # the elite stays, with its losses
+            losses = numpy.concatenate([losses[best], self.evaluate(candidates, workers)])
+        i = int(numpy.argmin(losses))
+        point = self.scale(unit[i])[0]
+        return {'params': point, 'loss': float(losses[i]), 'result': self.run([point], workers)[0],
+                'evaluated': list(self.evaluated)}
@@ -0,0 +1,87 @@
+import numpy
+
+# Counter-based random draws, one per (seed, cell id, step, purpose), in place of the global
+# random / numpy.random streams.
+#
+#   rng = CellRandom(seed=7)
+#   cell.germTime = [120 + rng.uniform(cell.id, time, GERM_TIME, -40, 40)] # one cell
+#   draw = rng.uniform(eng.ids, time, CONVERSION, 0, 100, mask=trigger)  # a column, nan outside mask
+#   n1 = rng.normal(eng.ids, time, DIVISION, 1, 0.05, mask=first)
+#
+# A draw is Philox4x32-10 (Salmon et al. 2011, the Random123 generator) of the counter
+# (cell id low word, cell id high word, step, purpose) under the key seed. Nothing is
+# consumed from a stream, so the value a cell gets does not depend on how many other cells
+# drew before it, in which order, or in which process: the per-cell loop, the vectorised
+# engine, an Ensemble and a BatchRunner worker all give the same numbers. Each call computes
+# whole columns with uint64 array arithmetic; scalar calls go through the same code so they
+# agree with the columns to the last bit.
+#
+# An Ensemble numbers the cells of replicate r as local id * replicates + r. With replicates
+# set, the draws of replicate r are keyed by (seed + r, local id), which are the draws of a
+# serial run with seed + r.
+
+# Purposes, the last counter word. Draws with different purposes are independent
+GERM_TIME = 0  # EB germination time, init()
+GROWTH = 1     # growthRate jitter, init() and germination
+CONVERSION = 2 # RBr -> RBi conversion test
+DIVISION = 3   # daughter growthRate, divide()
+
+mask32 = numpy.uint64(0xFFFFFFFF)
+multipliers = (numpy.uint64(0xD2511F53), numpy.uint64(0xCD9E8D57))
+weyl = (numpy.uint64(0x9E3779B9), numpy.uint64(0xBB67AE85))
+
+def philox(c0, c1, c2, c3, k0, k1, rounds=10):
+    # Philox4x32 on uint64 arrays holding 32-bit words, returns the four output words
+    for r in range(rounds):
+        if r:
+            k0 = (k0 + weyl[0]) & mask32
+            k1 = (k1 + weyl[1]) & mask32
+        p0 = multipliers[0] * c0
+        p1 = multipliers[1] * c2
+        c0, c1, c2, c3 = ((p1 >> numpy.uint64(32)) ^ c1 ^ k0, p1 & mask32,
+                          (p0 >> numpy.uint64(32)) ^ c3 ^ k1, p0 & mask32)
+    return c0, c1, c2, c3
+
+def unitDouble(hi, lo):
+    # [0, 1) double from 53 bits of two words, as numpy's random() makes it
+    return ((hi >> numpy.uint64(5)) * numpy.uint64(1 << 26) + (lo >> numpy.uint64(6))) * (1.0 / (1 << 53))
+
+class CellRandom:
+
+    def __init__(self, seed, replicates=1):
+        self.seed = int(seed)
+        self.replicates = replicates
+
+    def words(self, ids, step, purpose, mask):
+        # Output words for every cell (or the cells in mask), and the shape of the result
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        shape = ids.shape
+        ids = ids.reshape(-1)
+        if mask is not None:
+            ids = ids[numpy.asarray(mask, dtype=bool).reshape(-1)]
+        local = (ids // self.replicates).astype(numpy.uint64)
+        seed = (self.seed + ids % self.replicates).astype(numpy.uint64)
+        c2 = numpy.full(len(ids), int(step) & 0xFFFFFFFF, dtype=numpy.uint64)
+        c3 = numpy.full(len(ids), int(purpose) & 0xFFFFFFFF, dtype=numpy.uint64)
+        return philox(local & mask32, local >> numpy.uint64(32), c2, c3, seed & mask32, seed >> numpy.uint64(32)), shape
+
+    def place(self, values, shape, mask):
+        # Scalar for a scalar id, the column otherwise, nan outside mask
+        if mask is not None:
+            out = numpy.full(shape, numpy.nan)
+            out[numpy.asarray(mask, dtype=bool)] = values
+            return out
+        return float(values[0]) if shape == () else values.reshape(shape)
+
+    def uniform(self, ids, step, purpose, low=0.0, high=1.0, mask=None):
+        # random.uniform(low, high) per cell
+        (w, shape) = self.words(ids, step, purpose, mask)
+        return self.place(low + (high - low) * unitDouble(w[0], w[1]), shape, mask)
+
+    def normal(self, ids, step, purpose, mean=0.0, sd=1.0, mask=None):
+        # numpy.random.normal(mean, sd) per cell, Box-Muller on the two doubles of the block
+        (w, shape) = self.words(ids, step, purpose, mask)
+        u1 = unitDouble(w[0], w[1])
+        u2 = unitDouble(w[2], w[3])
+        z = numpy.sqrt(-2.0 * numpy.log1p(-u1)) * numpy.cos(2 * numpy.pi * u2)
+        return self.place(mean + sd * z, shape, mask)
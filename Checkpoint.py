@@ -0,0 +1,190 @@
+import os
+import re
+import copy
+import zlib
+import pickle
+import itertools
+import numpy
+
+# Restart checkpoints as a full base plus small deltas, in place of a full cellStates pickle
+# at every restart step.
+#
+#   checkpoint = CheckpointWriter(sim, os.path.join(sim.outputDirPath, 'checkpoints'), baseSteps=100)
+#   checkpoint.record(step, cells, time=time)  # from update(), a delta every deltaSteps
+#   ...
+#   data = restore('data/<run>/checkpoints', step=250) # the latest checkpoint at or before step
+#   sim.loadFromPickle(data)                           # same keys as a step pickle
+#   resume(module, data)                               # the model's time counter, lagging cells
+#
+# base-N.ckpt holds every CellState (the content of step-N.pickle). delta-N.ckpt holds
+#   - the ids of the cells present, with the state that moves every step for every cell
+#     (volume, length, cellAge, pos, dir, species) as numpy columns
+#   - the full CellState of the cells that are new (daughters) or whose discrete or
+#     expression state (cellType, growthRate, targetVol, divideFlag, geneamt, rnaamt, ...)
+#     moved by more than tol (relative, absolute below 1) since the cell was last written
+#   - the lineage entries added since the previous checkpoint
+# restore() replays the deltas after the base onto it. A cell that was not rewritten keeps
+# the expression values it was last written with, so restored levels are within tol of the
+# true ones. Files are zlib-compressed pickles, written atomically. Integrator levels
+# (specData, sigGridData) go into every checkpoint when the run has an integrator; the
+# levels of a ColonyGrid go in with the moduleState.
+
+columnAttrs = ['volume', 'length', 'cellAge', 'pos', 'dir', 'species']
+watchedAttrs = ['cellType', 'growthRate', 'targetVol', 'divideFlag', 'parentGrowth', 'percentchance',
+                'germTime', 'geneamt', 'rnaamt']
+
+def stepOf(path):
+    match = re.search(r'-(\d+)\.ckpt$', path)
+    return int(match.group(1)) if match else None
+
+def attrColumn(cells, name):
+    # One attribute of every cell as an (n, k) float array, None unless every cell has it
+    # with the same length
+    if not all(hasattr(cell, name) for cell in cells):
+        return None
+    values = [getattr(cell, name) for cell in cells]
+    try:
+        return numpy.array(values, dtype=float).reshape(len(values), -1)
+    except (ValueError, TypeError):
+        return None
+
+def writeFile(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 6))
+    os.replace(tmp, path)
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+class CheckpointWriter:
+
+    def __init__(self, sim, path, baseSteps=100, deltaSteps=10, tol=1e-2):
+        self.sim = sim
+        self.path = path
+        self.baseSteps = baseSteps
+        self.deltaSteps = deltaSteps
+        self.tol = tol
+        self.refIds = None # ids and watched values of the cells as last written
+        self.refValues = None
+        self.lineageCount = 0
+        os.makedirs(path, exist_ok=True)
+
+    def close(self):
+        # Let go of the run, and remove what a write cut short left behind. Every checkpoint
+        # is on disk already
+        for name in os.listdir(self.path):
+            if name.endswith('.ckpt.tmp'):
+                os.remove(os.path.join(self.path, name))
+        self.sim = None
+        self.refIds = None
+        self.refValues = None
+
+    def integratorData(self):
+        integ = getattr(self.sim, 'integ', None)
+        if integ is None:
+            return {}
+        data = {'specData': numpy.array(integ.levels)}
+        if hasattr(integ, 'signalLevel'): # not with a ColonyGrid, whose levels are moduleState
+            data['sigGridData'] = numpy.array(integ.signalLevel)
+        return data
+
+    def watched(self, cells):
+        columns = [attrColumn(cells, name) for name in watchedAttrs]
+        return numpy.hstack([column for column in columns if column is not None])
+
+    def record(self, step, cells, **moduleState):
+        # Write a base or delta if step is a checkpoint step. moduleState (the model's time
+        # counter, ...) is stored with it and handed back by restore()
+        if step < 0 or step % self.deltaSteps:
+            return
+        states = list(cells.values())
+        ids = numpy.fromiter(cells.keys(), dtype=numpy.int64, count=len(states))
+        values = self.watched(states)
+        lineage = getattr(self.sim, 'lineage', {})
+        data = {'stepNum': step, 'moduleName': getattr(self.sim, 'moduleName', None), 'moduleState': moduleState}
+        data.update(self.integratorData())
+        if self.refIds is None or step % self.baseSteps == 0 or values.shape[1:] != self.refValues.shape[1:]:
+            data['cellStates'] = dict(cells)
+            data['lineage'] = dict(lineage)
+            writeFile(os.path.join(self.path, 'base-%05d.ckpt' % step), data)
+            order = numpy.argsort(ids)
+            self.refIds, self.refValues = ids[order], values[order]
+        else:
+            pos = numpy.minimum(numpy.searchsorted(self.refIds, ids), len(self.refIds) - 1)
+            known = self.refIds[pos] == ids
+            ref = self.refValues[pos]
+            moved = numpy.any(numpy.abs(values - ref) > self.tol * (1 + numpy.abs(ref)), axis=1)
+            changed = ~known | moved
+            data['ids'] = ids
+            data['columns'] = {name: column for name in columnAttrs
+                               for column in [attrColumn(states, name)] if column is not None}
+            data['changed'] = {int(cid): states[i] for (i, cid) in zip(numpy.nonzero(changed)[0], ids[changed])}
+            data['lineage'] = dict(itertools.islice(lineage.items(), self.lineageCount, None))
+            writeFile(os.path.join(self.path, 'delta-%05d.ckpt' % step), data)
+            refIds = numpy.concatenate([ids[changed], self.refIds[~numpy.isin(self.refIds, ids[changed])]])
+            refValues = numpy.concatenate([values[changed], self.refValues[~numpy.isin(self.refIds, ids[changed])]])
+            order = numpy.argsort(refIds)
+            self.refIds, self.refValues = refIds[order], refValues[order]
+        self.lineageCount = len(lineage)
+
+def resume(module, data):
+    # Put a model module back in the state of a restored checkpoint, before the first step:
+    # its time counter, the levels of its ColonyGrid and, for cells whose expression lags
+    # (fast-forwarded), the step their levels are current at, which the engine reads with the cells
+    state = data.get('moduleState', {})
+    if 'time' in state:
+        module.time = state['time']
+    if state.get('grid') is not None and getattr(module, 'colonyGrid', None) is not None:
+        module.colonyGrid.load(state['grid'])
+    if 'lastStep' in state:
+        (ids, steps) = state['lastStep']
+        cellStates = data['cellStates']
+        for (cid, step) in zip(ids.tolist(), steps.tolist()):
+            if cid in cellStates:
+                cellStates[cid].lastStep = step
+
+def checkpoints(path):
+    # (step, kind, file) of every checkpoint in path, by step
+    found = []
+    for name in os.listdir(path):
+        step = stepOf(name)
+        if step is not None and name.startswith(('base-', 'delta-')):
+            found.append((step, name.split('-')[0], os.path.join(path, name)))
+    return sorted(found)
+
+def restore(path, step=None):
+    # The state at the latest checkpoint at or before step (the last one by default), as the
+    # dict a step pickle holds: cellStates, stepNum, lineage, moduleName (+ integrator levels)
+    # and moduleState
+    found = [c for c in checkpoints(path) if step is None or c[0] <= step]
+    bases = [i for (i, c) in enumerate(found) if c[1] == 'base']
+    if not bases:
+        raise ValueError('no base checkpoint in %s at or before step %s' % (path, step))
+    data = readFile(found[bases[-1]][2])
+    cellStates = data['cellStates']
+    lineage = data['lineage']
+    for (s, kind, file) in found[bases[-1] + 1:]:
+        delta = readFile(file)
+        known = {cid: cellStates[cid] for cid in delta['ids'].tolist() if cid in cellStates}
+        cellStates = {}
+        for (i, cid) in enumerate(delta['ids'].tolist()):
+            cell = delta['changed'].get(cid) or copy.copy(known[cid])
+            for (name, column) in delta['columns'].items():
+                value = column[i]
+                old = getattr(cell, name, None)
+                if isinstance(old, (list, tuple)):
+                    setattr(cell, name, value.tolist())
+                elif isinstance(old, numpy.ndarray):
+                    setattr(cell, name, value.astype(old.dtype))
+                elif isinstance(old, (int, numpy.integer)) and not isinstance(old, bool):
+                    setattr(cell, name, type(old)(value[0]))
+                else:
+                    setattr(cell, name, float(value[0]))
+            cellStates[cid] = cell
+        lineage.update(delta['lineage'])
+        data = dict(delta, cellStates=cellStates, lineage=lineage)
+    for name in ['ids', 'columns', 'changed']:
+        data.pop(name, None)
+    return data
@@ -0,0 +1,126 @@
+import numpy
+
+# Signal diffusion on the part of the grid the colony occupies, in place of a GridDiffusion
+# box sized up front for the largest colony.
+#
+#   colonyGrid = ColonyGrid(1, grid_size, grid_orig, [10.0], rates=[1.0], margin=2)
+#   colonyGrid.step(cells, dt)    # from update(): follow the colony, add, diffuse, sample
+#   colonyGrid.mass()             # signal amount on the grid, per signal
+#   colonyGrid.bounds()           # (lower corner, upper corner) of the allocated box
+#
+# The voxels are those of the fixed grid: gridSize apart on the lattice through gridOrig.
+# Only the box around the cells is allocated: their bounding box, widened by margin voxels
+# on every side. When a cell comes within margin of a wall, step() re-grids to a box holding
+# both the old box and the new bounding box, widened by another margin of headroom. Levels
+# are copied voxel for voxel into the new box, so the signal mass is unchanged. The box does
+# not shrink, since the signal stays where it was made. Memory and the cost of a step follow
+# the voxels of the box, not grid_dim.
+#
+# A step of dt:
+#   1. each cell adds rates[s] * dt of signal s, spread over the 8 voxels around it with
+#      trilinear weights;
+#   2. diffusion at diffRates, by explicit steps small enough to be stable, with no flux
+#      through the walls of the box (boundcond='reflect'), which conserves mass exactly;
+#   3. each cell's signals are set to the levels at its position, with the same weights.
+# Levels are concentrations (amount per voxel volume). The walls move with the colony, where
+# those of a fixed grid stay at grid_dim, so signal that diffuses far beyond the cells is
+# held within margin of them.
+
+class ColonyGrid:
+
+    def __init__(self, nSignals, gridSize, gridOrig, diffRates, rates=None, margin=2):
+        self.nSignals = nSignals
+        self.size = numpy.asarray(gridSize, dtype=float)
+        self.orig = numpy.asarray(gridOrig, dtype=float)
+        self.diffRates = numpy.asarray(diffRates, dtype=float)
+        self.rates = numpy.ones(nSignals) if rates is None else numpy.asarray(rates, dtype=float)
+        self.margin = max(int(margin), 1) # the trilinear weights reach one voxel out
+        self.voxelVolume = float(numpy.prod(self.size))
+        self.lo = None # lattice index of the first voxel of the box
+        self.levels = numpy.zeros((nSignals, 0, 0, 0))
+        self.regrids = 0
+
+    @property
+    def shape(self):
+        return self.levels.shape[1:]
+
+    def bounds(self):
+        if self.lo is None:
+            return (self.orig, self.orig)
+        return (self.orig + self.lo * self.size, self.orig + (self.lo + self.shape) * self.size)
+
+    def mass(self):
+        return self.levels.sum(axis=(1, 2, 3)) * self.voxelVolume
+
+    def cover(self, positions):
+        # Re-grid if a position is within margin voxels of a wall of the box
+        index = (positions - self.orig) / self.size - 0.5 # voxel centres at integers
+        low = numpy.floor(index.min(axis=0)).astype(numpy.int64) - self.margin
+        high = numpy.floor(index.max(axis=0)).astype(numpy.int64) + 2 + self.margin
+        if self.lo is not None and numpy.all(low >= self.lo) and numpy.all(high <= self.lo + self.shape):
+            return
+        if self.lo is not None:
+            low = numpy.minimum(low - self.margin, self.lo)
+            high = numpy.maximum(high + self.margin, self.lo + self.shape)
+        levels = numpy.zeros((self.nSignals,) + tuple((high - low).tolist()))
+        if self.lo is not None:
+            at = self.lo - low
+            levels[:, at[0]:at[0] + self.shape[0], at[1]:at[1] + self.shape[1], at[2]:at[2] + self.shape[2]] = self.levels
+            self.regrids += 1
+        self.lo = low
+        self.levels = levels
+
+    def weights(self, positions):
+        # Flat voxel indices (n, 8) and trilinear weights (n, 8) of each position
+        index = (positions - self.orig) / self.size - 0.5 - self.lo
+        base = numpy.floor(index).astype(numpy.int64)
+        frac = index - base
+        (nx, ny, nz) = self.shape
+        flat = numpy.empty((len(positions), 8), dtype=numpy.int64)
+        weight = numpy.empty((len(positions), 8))
+        for corner in range(8):
+            offset = numpy.array([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1])
+            i = base + offset
+            flat[:, corner] = (i[:, 0] * ny + i[:, 1]) * nz + i[:, 2]
+            weight[:, corner] = numpy.prod(numpy.where(offset, frac, 1 - frac), axis=1)
+        return (flat, weight)
+
+    def diffuse(self, dt):
+        # Explicit steps, stable for dt * D * sum(1/h^2) <= 1/2; edge padding is no flux
+        inverse = 1 / self.size**2
+        for (s, rate) in enumerate(self.diffRates.tolist()):
+            if rate <= 0:
+                continue
+            n = max(int(numpy.ceil(dt * rate * inverse.sum() / 0.45)), 1)
+            level = self.levels[s]
+            for _ in range(n):
+                padded = numpy.pad(level, 1, mode='edge')
+                laplacian = ((padded[2:, 1:-1, 1:-1] + padded[:-2, 1:-1, 1:-1] - 2 * level) * inverse[0] +
+                             (padded[1:-1, 2:, 1:-1] + padded[1:-1, :-2, 1:-1] - 2 * level) * inverse[1] +
+                             (padded[1:-1, 1:-1, 2:] + padded[1:-1, 1:-1, :-2] - 2 * level) * inverse[2])
+                level = level + (dt / n) * rate * laplacian
+            self.levels[s] = level
+
+    def step(self, cells, dt):
+        if not cells:
+            return
+        states = list(cells.values())
+        positions = numpy.array([cell.pos for cell in states], dtype=float).reshape(len(states), 3)
+        self.cover(positions)
+        (flat, weight) = self.weights(positions)
+        voxels = int(numpy.prod(self.shape))
+        for s in range(self.nSignals):
+            added = numpy.bincount(flat.ravel(), weights=(weight * (self.rates[s] * dt)).ravel(), minlength=voxels)
+            self.levels[s] += added.reshape(self.shape) / self.voxelVolume
+        self.diffuse(dt)
+        sampled = numpy.stack([(self.levels[s].ravel()[flat] * weight).sum(axis=1) for s in range(self.nSignals)], axis=1)
+        for (cell, values) in zip(states, sampled.tolist()):
+            cell.signals[:] = values
+
+    def state(self):
+        # For checkpoints: what load() needs to put the grid back
+        return {'lo': None if self.lo is None else self.lo.copy(), 'levels': self.levels.copy()}
+
+    def load(self, state):
+        self.lo = None if state['lo'] is None else numpy.array(state['lo'], dtype=numpy.int64)
+        self.levels = numpy.array(state['levels'], dtype=float)
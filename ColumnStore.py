@@ -0,0 +1,135 @@
+import os
+import atexit
+import zipfile
+import numpy
+
+# Columnar run output: one compressed file per run in place of a cellStates pickle every
+# pickleSteps steps.
+#
+#   store = ColumnWriter(os.path.join(sim.outputDirPath, 'columns.npz'), every=10)
+#   store.record(step, cells)               # from update(), writes only every `every` steps
+#   store.record(step, cells, final=True)   # the end of the run, whatever its step
+#   ...
+#   run = ColumnReader('data/<run>/columns.npz')
+#   run.steps                               # recorded step numbers
+#   types = run.field('cellType')           # one array per recorded step, no other field is read
+#   run.counts(6)                           # cells of each type, shape (steps, 6)
+#
+# The file is a zip of .npy members, one per field per chunk of chunkSteps records:
+# <field>/<chunk>.npy holds the field of every cell of those steps concatenated, and
+# steps/<chunk>.npy, sizes/<chunk>.npy the step numbers and cell counts that split it.
+# A chunk is appended (and the zip closed again) as soon as it is full, so a run that dies
+# loses at most the records not yet flushed. numpy.load() opens the file as well.
+
+fields = ['id', 'cellType', 'volume', 'pos', 'rnaamt', 'geneamt']
+
+def member(name, chunk):
+    return '%s/%05d.npy' % (name, chunk)
+
+class ColumnWriter:
+
+    def __init__(self, path, every=10, nGenes=4, chunkSteps=10):
+        self.path = path
+        self.every = every
+        self.nGenes = nGenes
+        self.chunkSteps = chunkSteps
+        self.chunk = 0
+        self.pending = []
+        if os.path.exists(path):
+            os.remove(path)
+        atexit.register(self.close)
+
+    def record(self, step, cells, eng=None, final=False):
+        # Add the cells of this step if it is a recorded one, or the last of the run (final).
+        # With eng, an ExpressionEngine synced to cells, the expression columns are taken from
+        # it instead of the CellStates
+        if step < 0 or (step % self.every and not final):
+            return
+        n = len(cells)
+        states = cells.values()
+        columns = {'pos': numpy.array([cell.pos for cell in states], dtype=float).reshape(n, 3)}
+        if eng is not None:
+            columns['id'] = eng.ids.copy()
+            columns['cellType'] = eng.cellType.copy()
+            columns['volume'] = eng.volume.copy()
+            columns['rnaamt'] = eng.rnaamt.copy()
+            columns['geneamt'] = eng.geneamt.copy()
+        else:
+            columns['id'] = numpy.fromiter(cells.keys(), dtype=numpy.int64, count=n)
+            columns['cellType'] = numpy.fromiter((cell.cellType for cell in states), dtype=numpy.int32, count=n)
+            columns['volume'] = numpy.fromiter((cell.volume for cell in states), dtype=float, count=n)
+            columns['rnaamt'] = numpy.array([cell.rnaamt[:self.nGenes] for cell in states], dtype=float).reshape(n, self.nGenes)
+            columns['geneamt'] = numpy.array([cell.geneamt[:self.nGenes] for cell in states], dtype=float).reshape(n, self.nGenes)
+        self.pending.append((step, columns))
+        if len(self.pending) >= self.chunkSteps:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        arrays = {'steps': numpy.array([step for (step, columns) in self.pending], dtype=numpy.int64),
+                  'sizes': numpy.array([len(columns['id']) for (step, columns) in self.pending], dtype=numpy.int64)}
+        for name in fields:
+            arrays[name] = numpy.concatenate([columns[name] for (step, columns) in self.pending])
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+            for (name, array) in arrays.items():
+                with zf.open(member(name, self.chunk), 'w', force_zip64=True) as f:
+                    numpy.lib.format.write_array(f, array, allow_pickle=False)
+        self.chunk += 1
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.close)
+
+
+class ColumnReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        names = self.zip.namelist()
+        self.fields = sorted({name.split('/')[0] for name in names} - {'steps', 'sizes'})
+        self.chunks = sorted({name.split('/')[1] for name in names if name.startswith('steps/')})
+        self.steps = self.chunkColumn('steps')
+        self.sizes = self.chunkColumn('sizes')
+        lengths = [len(self.load('sizes', chunk)) for chunk in self.chunks]
+        self.chunkOf = numpy.repeat(numpy.arange(len(self.chunks)), lengths) # chunk of each record
+        self.firstRecord = numpy.concatenate([[0], numpy.cumsum(lengths)]) # first record of each chunk
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(self.sizes)])
+
+    def load(self, name, chunk):
+        with self.zip.open('%s/%s' % (name, chunk)) as f:
+            return numpy.lib.format.read_array(f, allow_pickle=False)
+
+    def chunkColumn(self, name):
+        parts = [self.load(name, chunk) for chunk in self.chunks]
+        return numpy.concatenate(parts) if parts else numpy.zeros(0, dtype=numpy.int64)
+
+    def flat(self, name):
+        # The field of every recorded cell, all steps concatenated (split at self.offsets)
+        return self.chunkColumn(name)
+
+    def field(self, name):
+        # The field as one array per recorded step
+        return numpy.split(self.flat(name), self.offsets[1:-1])
+
+    def at(self, step):
+        # Every field of one recorded step, reading only the chunk that holds it
+        i = int(numpy.searchsorted(self.steps, step))
+        if i == len(self.steps) or self.steps[i] != step:
+            raise KeyError('step %d was not recorded' % step)
+        chunk = self.chunkOf[i]
+        first = self.firstRecord[chunk]
+        start = int(self.offsets[i] - self.offsets[first])
+        end = start + int(self.sizes[i])
+        return {name: self.load(name, self.chunks[chunk])[start:end] for name in self.fields}
+
+    def counts(self, nTypes=6):
+        # Cells of each type at each recorded step, shape (steps, nTypes)
+        step = numpy.repeat(numpy.arange(len(self.steps)), self.sizes)
+        flat = numpy.bincount(step * nTypes + self.flat('cellType'), minlength=len(self.steps) * nTypes)
+        return flat.reshape(len(self.steps), nTypes)
+
+    def close(self):
+        self.zip.close()
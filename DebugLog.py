@@ -0,0 +1,44 @@
+import sys
+
+# Rate-limited debug output, for the per-cell prints in the models' update() and divide().
+#
+#   debug = DebugLog(lines=20, everySteps=10) # the models' debugLog, made in setup()
+#   debug.step(time)                        # top of update()
+#   debug('cell sp = %s', cell.species[1])  # formatted and written only if it gets through
+#
+# On every everySteps-th step the first lines messages are written; everything else is only
+# counted, and a step that dropped messages ends with one line saying how many. Messages are
+# %-formatted when written, so a dropped one costs a call and a counter. DebugLog(None) writes
+# every message, as the plain prints did, and DebugLog(0) none.
+
+class DebugLog:
+
+    def __init__(self, lines=20, everySteps=10, stream=None):
+        self.lines = lines
+        self.everySteps = everySteps
+        self.stream = stream # sys.stdout at the time of writing by default
+        self.stepNum = 0
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, text):
+        # Unconditional output (summaries the models write every outputSteps), except from DebugLog(0)
+        if self.lines != 0:
+            print(text, file=self.stream or sys.stdout)
+
+    def active(self):
+        return self.lines is None or (self.lines > 0 and self.stepNum % self.everySteps == 0)
+
+    def step(self, stepNum):
+        if self.dropped and self.active():
+            self.write('... %d more debug lines in step %d' % (self.dropped, self.stepNum))
+        self.stepNum = stepNum
+        self.written = 0
+        self.dropped = 0
+
+    def __call__(self, message, *args):
+        if self.active() and (self.lines is None or self.written < self.lines):
+            self.written += 1
+            self.write(message % args if args else message)
+        else:
+            self.dropped += 1
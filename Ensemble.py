@@ -0,0 +1,141 @@
+import random
+import importlib.util
+import numpy
+from CellState import CellState
+
+# Many replicate inclusions of a physics-free model advanced together in one process.
+#
+# The cells of all replicates live in the model's ExpressionEngine, tagged by the
+# replicate column, so one updateEngine()/updateNetwork() call steps every replicate at
+# once and divisions go through the model's divideEngine(). Growth is the well-mixed one
+# (WellMixedBiophysics): volume grows at growthRate and is halved on division.
+#
+#   ens = Ensemble('Asym-production-E-euo-washout.py', 1000, seed=1)
+#   counts = ens.run(600) # counts[step, replicate, cellType]
+#
+# Keyword flags set module attributes (useNetwork=True, ...) and params updates entries of
+# the model's params dict (params={'pr1': 0.03}).
+#
+# The model's own setup() and init() make the first cells: the Ensemble stands in for the
+# CellModeller Simulator with the model set to wellMixed. Each replicate has its own numpy
+# Generator, spawned from seed, for the germination, conversion and division draws, and
+# the global random module is reseeded from it before init() runs for that replicate.
+# With seed=None the global random streams are used as they are, which for one replicate
+# reproduces a serial well-mixed run.
+#
+# Cell ids are numbered per replicate: the k-th cell of replicate r has id k*replicates + r,
+# so a replicate's ids do not depend on the others. With the model's randomSeed set the draws
+# are counter-based (CellRandom.py) and keyed by those, and replicate r is bit-identical to a
+# serial well-mixed run with randomSeed + r.
+
+class Ensemble:
+
+    def __init__(self, modelPath, replicates, seed=None, dt=0.025, nTypes=8, params=None, **flags):
+        spec = importlib.util.spec_from_file_location('ensemble_model', modelPath)
+        self.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.module)
+        for (name, value) in flags.items():
+            setattr(self.module, name, value)
+        if params:
+            self.module.params.update(params) # entries of the model's params dict
+        self.module.wellMixed = True
+        self.moduleName = self.module.__name__
+        self.replicates = replicates
+        self.nTypes = nTypes
+        self.dt = dt
+        self.is_gui = False
+        self.cellStates = {}
+        self.pickleSteps = 10
+        self.nextId = numpy.zeros(replicates, dtype=numpy.int64) # next local id of each replicate
+        self.lineage = None # a LineageRecorder (Lineage.py) set here records every division
+
+        self.engine = self.module.engine
+        self.engine.colors = False
+        if seed is not None:
+            children = numpy.random.SeedSequence(seed).spawn(replicates)
+            self.engine.streams = [numpy.random.default_rng(s) for s in children]
+        self.module.setup(self)
+        self.engine.newRows = numpy.arange(len(self.engine))
+
+    # Simulator interface used by the model's setup()
+    def init(self, phys, reg, sig, integ):
+        self.phys = phys
+        self.reg = reg
+
+    def addCell(self, cellType=0, length=3.5, **kwargs):
+        # One copy of the cell per replicate, made by the model's init(). length is the
+        # Simulator.addCell() default
+        eng = self.engine
+        rows = eng.append(self.replicates)
+        for (r, row) in enumerate(rows):
+            if eng.streams is not None:
+                random.seed(int(eng.streams[r].integers(2**63)))
+            cs = CellState(int(self.nextId[r]) * self.replicates + r)
+            self.nextId[r] += 1
+            cs.cellType = cellType
+            self.reg.addCell(cs)
+            self.phys.addCell(cs, length=length, **kwargs)
+            eng.readCell(row, cs)
+            eng.volume[row] = cs.volume
+            eng.replicate[row] = r
+
+    def addRenderer(self, renderer):
+        pass
+
+    def step(self):
+        m = self.module
+        eng = self.engine
+        m.time += 1
+        if m.useNetwork:
+            m.updateNetwork(eng)
+        else:
+            m.updateEngine(eng)
+        eng.newRows = eng.newRows[:0]
+        self.divide()
+        eng.volume *= 1 + eng.growthRate * self.dt
+
+    def divide(self):
+        # Parents are dropped and their daughters appended, d1 then d2, as in cellStates.
+        # Rows of different replicates interleave but each replicate keeps its own order
+        eng = self.engine
+        parents = numpy.nonzero(eng.divideFlag)[0]
+        if len(parents) == 0:
+            return
+        kept = numpy.nonzero(~eng.divideFlag)[0]
+        parentIds = eng.ids[parents]
+        parentTypes = eng.cellType[parents]
+        eng.take(numpy.concatenate([kept, numpy.repeat(parents, 2)]))
+        d1 = numpy.arange(len(kept), len(eng), 2)
+        d2 = d1 + 1
+        daughters = numpy.arange(len(kept), len(eng))
+        # The k-th dividing parent of a replicate takes its next local ids + 2k, 2k + 1
+        rep = eng.replicate[d1]
+        perReplicate = numpy.bincount(rep, minlength=self.replicates)
+        order = numpy.argsort(rep, kind='stable')
+        rank = numpy.empty(len(parents), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(parents)) - numpy.repeat(numpy.cumsum(perReplicate) - perReplicate, perReplicate)
+        local = self.nextId[rep] + 2*rank
+        eng.ids[d1] = local * self.replicates + rep
+        eng.ids[d2] = (local + 1) * self.replicates + rep
+        self.nextId += 2*perReplicate
+        eng.divideFlag[daughters] = False
+        eng.volume[daughters] /= 2
+        eng.newRows = daughters
+        self.module.divideEngine(eng, d1, d2)
+        if self.lineage is not None:
+            self.lineage.record(self.module.time - 1, parentIds, eng.ids[d1], eng.ids[d2],
+                                parentTypes, eng.cellType[d1], eng.cellType[d2])
+
+    def counts(self):
+        # Cells of each type in each replicate, shape (replicates, nTypes)
+        eng = self.engine
+        flat = numpy.bincount(eng.replicate * self.nTypes + eng.cellType, minlength=self.replicates * self.nTypes)
+        return flat.reshape(self.replicates, self.nTypes)
+
+    def run(self, steps):
+        # Count time series, shape (steps, replicates, nTypes), counted after each step
+        out = numpy.zeros((steps, self.replicates, self.nTypes), dtype=numpy.int64)
+        for i in range(steps):
+            self.step()
+            out[i] = self.counts()
+        return out
@@ -0,0 +1,250 @@
+import gc
+import random
+import numpy
+
+# Structure-of-arrays copy of the per-cell state that update() works on.
+# Each model keeps one ExpressionEngine, calls sync(cells) at the top of update(),
+# advances whole cell types with masked array operations and then calls scatter(cells)
+# so CellModeller (biophysics, divide(), pickles, renderers) sees the new values.
+# The rows are the source of truth between steps, so on a step whose state is not
+# pickled, recorded or drawn scatter(cells, eng.changedRows()) writes back only what
+# CellModeller reads before the next update(): the type, growth and division flag of the
+# cells whose values moved, and everything of the dividing cells, which their daughters copy.
+#
+# Rows are kept in cellStates dict order so that random draws made through
+# uniformDraws() consume the global random stream in the same order as the
+# per-cell loop did, which keeps the vectorised path bit-identical to it.
+# An Ensemble keeps the cells of many replicates in one engine, tagged by the
+# replicate column, and sets streams so each replicate draws from its own generator.
+
+# Celltypes: 0=germ_EB, 1=RBr, 2=RBe, 3=IB, 4=pre_EB, 5=EB
+NO_COLOR = 0     # color not touched this step
+FLAT_COLOR = 1   # cell.color = [r, g, b]
+NESTED_COLOR = 2 # cell.color = [[r, g, b]], as the per-cell update() writes it
+
+class ExpressionEngine:
+
+    def __init__(self, nGenes):
+        self.nGenes = nGenes
+        self.resize(0)
+        self.newRows = numpy.zeros(0, dtype=numpy.int64) # rows added by the last sync()
+        self.idOrder = None # argsort of ids, built on demand by rowsOf()
+        self.streams = None # per-replicate numpy Generators (Ensemble), None for the global random streams
+        self.colors = True # setColor() writes colors, off when nothing renders the cells (Ensemble)
+        self.synced = {} # cellColumns as sync() left them, for changedRows()
+
+    def resize(self, n):
+        self.ids = numpy.zeros(n, dtype=numpy.int64)
+        self.cellType = numpy.zeros(n, dtype=numpy.int32)
+        self.growthRate = numpy.zeros(n)
+        self.parentGrowth = numpy.zeros(n)
+        self.germTime = numpy.zeros(n)
+        self.percentchance = numpy.zeros(n)
+        self.volume = numpy.zeros(n)
+        self.targetVol = numpy.zeros(n)
+        self.divideFlag = numpy.zeros(n, dtype=bool)
+        self.rnaamt = numpy.zeros((n, self.nGenes))
+        self.geneamt = numpy.zeros((n, self.nGenes))
+        self.color = numpy.zeros((n, 3))
+        self.colorMode = numpy.zeros(n, dtype=numpy.int8)
+        self.lastStep = numpy.zeros(n, dtype=numpy.int64) # step the expression columns are current at
+        self.replicate = numpy.zeros(n, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Column names that are carried per row and reordered together in sync()
+    rowColumns = ['ids', 'cellType', 'growthRate', 'parentGrowth', 'germTime', 'percentchance',
+                  'targetVol', 'divideFlag', 'rnaamt', 'geneamt', 'color', 'lastStep', 'replicate']
+
+    def sync(self, cells, step=0):
+        # Bring the columns in line with cellStates: drop rows of divided parents,
+        # append rows for new daughters (read from their CellState) and refresh volume,
+        # which is owned by the biophysics. Rows that already exist are the source of truth.
+        # step is the step the cells are current at, the lastStep of the new daughters
+        n = len(cells)
+        ids = numpy.fromiter(cells.keys(), dtype=numpy.int64, count=n)
+        if not numpy.array_equal(ids, self.ids):
+            if len(self.ids):
+                order = numpy.argsort(self.ids)
+                sortedIds = self.ids[order]
+                pos = numpy.minimum(numpy.searchsorted(sortedIds, ids), len(sortedIds)-1)
+                known = sortedIds[pos] == ids
+                rows = order[pos]
+            else:
+                known = numpy.zeros(n, dtype=bool)
+                rows = numpy.zeros(n, dtype=numpy.int64)
+            old = {name: getattr(self, name) for name in self.rowColumns}
+            self.resize(n)
+            for name in self.rowColumns:
+                getattr(self, name)[known] = old[name][rows[known]]
+            self.newRows = numpy.nonzero(~known)[0]
+            for i in self.newRows:
+                self.readCell(i, cells[int(ids[i])], step)
+            self.idOrder = None
+        else:
+            self.newRows = self.newRows[:0]
+        self.volume[:] = numpy.fromiter((cell.volume for cell in cells.values()), dtype=float, count=n)
+        self.colorMode[:] = NO_COLOR
+        self.synced = {name: getattr(self, name).copy() for name in self.cellColumns}
+
+    # Columns CellModeller reads from the CellStates before the next update(): the biophysics
+    # and integrator (cellType, growthRate) and the Simulator's divisions (divideFlag)
+    cellColumns = ['cellType', 'growthRate', 'parentGrowth', 'divideFlag']
+
+    def changedRows(self):
+        # Rows whose CellState has to be written back after a step that is not pickled,
+        # recorded or drawn: those whose cellColumns moved since sync(), and the dividing cells
+        changed = self.divideFlag.copy()
+        for name in self.cellColumns:
+            changed |= getattr(self, name) != self.synced[name]
+        return numpy.nonzero(changed)[0]
+
+    def readCell(self, i, cell, step=0):
+        self.ids[i] = cell.id
+        self.cellType[i] = cell.cellType
+        self.growthRate[i] = cell.growthRate
+        self.parentGrowth[i] = cell.parentGrowth[0]
+        self.germTime[i] = cell.germTime[0]
+        self.percentchance[i] = cell.percentchance[0]
+        self.targetVol[i] = cell.targetVol
+        self.divideFlag[i] = cell.divideFlag
+        self.rnaamt[i] = cell.rnaamt[:self.nGenes]
+        self.geneamt[i] = cell.geneamt[:self.nGenes]
+        self.color[i] = numpy.ravel(cell.color)[:3]
+        self.lastStep[i] = getattr(cell, 'lastStep', step) # set on cells restored from a checkpoint
+
+    def scatter(self, cells, rows=None):
+        # Write the columns back onto the CellState objects, of every cell or of the given rows.
+        # The collector is held off meanwhile: the lists made here would otherwise set off
+        # collections that walk every CellState, which cost more than the writes
+        states = list(cells.values())
+        if rows is None:
+            rows = numpy.arange(len(states))
+        elif len(rows) == 0:
+            return
+        nGenes = self.nGenes
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            columns = [column[rows].tolist() for column in
+                       (self.cellType, self.growthRate, self.parentGrowth, self.percentchance, self.divideFlag,
+                        self.rnaamt, self.geneamt, self.color, self.colorMode)]
+            for (i, cellType, growthRate, parentGrowth, percentchance, divideFlag, rnaamt, geneamt, color,
+                 colorMode) in zip(rows.tolist(), *columns):
+                cell = states[i]
+                cell.cellType = cellType
+                cell.growthRate = growthRate
+                cell.parentGrowth[0] = parentGrowth
+                cell.percentchance[0] = percentchance
+                cell.divideFlag = divideFlag
+                cell.rnaamt[:nGenes] = rnaamt
+                cell.geneamt[:nGenes] = geneamt
+                if colorMode == FLAT_COLOR:
+                    cell.color = color
+                elif colorMode == NESTED_COLOR:
+                    cell.color = [color]
+        finally:
+            if collecting:
+                gc.enable()
+
+    def take(self, rows):
+        # Keep the given rows in the given order. Rows may repeat, which is how an Ensemble
+        # copies a dividing cell into its two daughters. Volume is carried too.
+        for name in self.rowColumns + ['volume', 'colorMode']:
+            setattr(self, name, getattr(self, name)[rows])
+        self.idOrder = None
+
+    def append(self, n):
+        # Add n zeroed rows at the end, returns their row indices
+        start = len(self)
+        old = {name: getattr(self, name) for name in self.rowColumns + ['volume']}
+        self.resize(start + n)
+        for (name, column) in old.items():
+            getattr(self, name)[:start] = column
+        self.idOrder = None
+        return numpy.arange(start, start + n)
+
+    def rowsOf(self, ids):
+        # Rows holding the given cell ids, -1 for ids that are no longer in cellStates
+        if self.idOrder is None:
+            self.idOrder = numpy.argsort(self.ids)
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        if len(self.ids) == 0:
+            return numpy.full(len(ids), -1, dtype=numpy.int64)
+        sortedIds = self.ids[self.idOrder]
+        pos = numpy.minimum(numpy.searchsorted(sortedIds, ids), len(sortedIds)-1)
+        return numpy.where(sortedIds[pos] == ids, self.idOrder[pos], -1)
+
+    def setColor(self, mask, r, g, b, mode=NESTED_COLOR):
+        # Same as cell.color = [[r, g, b]] for every cell in mask (scalars or full-length columns)
+        if not self.colors:
+            return
+        for j, c in enumerate((r, g, b)):
+            self.color[mask, j] = c[mask] if numpy.ndim(c) else c
+        self.colorMode[mask] = mode
+
+    def paint(self, setColors):
+        # setColors(self) with colors on, for a headless run that colors only the steps it records
+        colors, self.colors = self.colors, True
+        setColors(self)
+        self.colors = colors
+
+    def uniformDraws(self, *draws):
+        # draws are (mask, low, high) triples. Returns one column per triple holding
+        # random.uniform(low, high) for rows in mask (nan elsewhere). Values are taken from
+        # the global random stream cell by cell, and in argument order within a cell,
+        # exactly as the per-cell loop would consume it (see cellDraws for an Ensemble).
+        def uniform(total):
+            return numpy.fromiter((random.random() for _ in range(total)), dtype=float, count=total)
+        return [low + (high - low) * vals for (vals, (mask, low, high)) in
+                zip(self.cellDraws([mask for (mask, low, high) in draws], uniform, 'random'), draws)]
+
+    def normalDraws(self, *draws):
+        # Same for (mask, mean, sd) triples and numpy.random.normal(mean, sd), as divide() uses it
+        return [mean + sd * vals for (vals, (mask, mean, sd)) in
+                zip(self.cellDraws([mask for (mask, mean, sd) in draws], numpy.random.standard_normal,
+                                   'standard_normal'), draws)]
+
+    def cellDraws(self, masks, globalDraw, method):
+        # One column per mask of values drawn cell by cell, in mask order within a cell.
+        # Without streams the values come from globalDraw(total); with streams each
+        # replicate's cells draw, in row order, from that replicate's generator.
+        counts = numpy.sum(masks, axis=0, dtype=numpy.int64) if masks else numpy.zeros(len(self), dtype=numpy.int64)
+        total = int(counts.sum())
+        if self.streams is None:
+            flat = globalDraw(total)
+            offset = numpy.cumsum(counts) - counts
+        else:
+            rows = numpy.nonzero(counts)[0]
+            rows = rows[numpy.argsort(self.replicate[rows], kind='stable')]
+            perReplicate = numpy.bincount(self.replicate[rows], weights=counts[rows], minlength=len(self.streams))
+            flat = numpy.concatenate([getattr(self.streams[r], method)(int(k))
+                                      for (r, k) in enumerate(perReplicate) if k] or [numpy.zeros(0)])
+            offset = numpy.zeros(len(self), dtype=numpy.int64)
+            offset[rows] = numpy.cumsum(counts[rows]) - counts[rows]
+        out = []
+        for mask in masks:
+            vals = numpy.full(len(self), numpy.nan)
+            vals[mask] = flat[offset[mask]]
+            offset = offset + mask
+            out.append(vals)
+        return out
+
+    def readSpecies(self, cells, rnaIdx, geneIdx):
+        # When the kinetics run in the OpenCL species kernel, cell.species holds the
+        # RNA and protein levels; copy them into the rnaamt/geneamt columns
+        species = numpy.array([cell.species for cell in cells.values()]).reshape(len(cells), -1)
+        self.rnaamt[:] = species[:, rnaIdx:rnaIdx+self.nGenes]
+        self.geneamt[:] = species[:, geneIdx:geneIdx+self.nGenes]
+
+    def writeSpecies(self, cells, rnaIdx, geneIdx, growthIdx, growth):
+        # Push host-side changes (pinned levels, the per-cell growth factor used by the
+        # kernel) back into cell.species
+        rnaamt = self.rnaamt.tolist()
+        geneamt = self.geneamt.tolist()
+        growth = growth.tolist()
+        for i, cell in enumerate(cells.values()):
+            cell.species[rnaIdx:rnaIdx+self.nGenes] = rnaamt[i]
+            cell.species[geneIdx:geneIdx+self.nGenes] = geneamt[i]
+            cell.species[growthIdx] = growth[i]
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import traceback
+import multiprocessing
+import concurrent.futures
+import numpy
+import BatchRunner
+from Checkpoint import restore, resume
+
+# What-if branches continued from one checkpoint, so the shared prefix of a sweep (germination
+# and the RB expansion) is simulated once:
+#
+#   fork = Fork('Asym-production-E-euo-washout.py', 'data/<run>/checkpoints', step=200,
+#               flags={'wellMixed': True}) # flags of the run the checkpoint came from
+#   manifest = fork.run({'washout20': {'params': {'washoutHours': 20}, 'seed': 1},
+#                        'washout30': {'params': {'washoutHours': 30}, 'seed': 2},
+#                        'network':   {'flags': {'useNetwork': True}, 'seed': 3}}, steps=400)
+#
+# The checkpoint is restored once, in this process. Branches run in worker processes
+# forked from it, so each starts from the same cellStates through copy-on-write pages
+# instead of a reload, and only pages a branch writes to are copied. Each branch imports
+# the model afresh, applies the common flags, then its own flags and params overrides, seeds random and
+# numpy.random with its seed, loads the state into a new Simulator (saving to
+# outputDir/<name>) and runs steps more steps. No OpenCL context exists before the fork;
+# workers take an OpenCL device the way BatchRunner's do. manifest.json in outputDir lists
+# the branches, as BatchRunner's lists its jobs.
+
+forkData = None # the restored checkpoint, inherited by the forked workers
+forkFlags = {} # module flags of every branch
+
+def runBranch(model, name, branch, steps, dt, outputDir):
+    # Run one branch in this worker, returns (output directory, seconds)
+    from CellModeller.Simulator import Simulator
+    start = time.time()
+    path, fileName = os.path.split(os.path.abspath(model))
+    moduleName = os.path.splitext(fileName)[0]
+    if path not in sys.path:
+        sys.path.append(path)
+    sys.modules.pop(moduleName, None)
+    module = __import__(moduleName)
+    for (flag, value) in dict(forkFlags, **branch.get('flags', {})).items():
+        setattr(module, flag, value)
+    module.params.update(branch.get('params', {}))
+    seed = branch.get('seed', 0)
+    random.seed(seed)
+    numpy.random.seed(seed)
+    (platform, device) = BatchRunner.workerDevice
+    finished = None
+    try:
+        sim = Simulator(moduleName, dt, clPlatformNum=platform, clDeviceNum=device, saveOutput=True,
+                        outputDirName=os.path.join(outputDir, name))
+        data = dict(forkData)
+        resume(module, data)
+        sim.loadFromPickle(data)
+        end = sim.stepNum + steps
+        while sim.stepNum < end:
+            sim.step()
+        finished = sim
+    finally:
+        BatchRunner.closeOutputs(module, finished)
+    return (os.path.abspath(getattr(sim, 'outputDirPath', os.path.join('data', outputDir, name))), time.time() - start)
+
+class Fork:
+
+    def __init__(self, model, checkpointDir, step=None, flags=None, dt=0.025, workers=None, platform=0,
+                 devices=(0,), outputDir='forks'):
+        self.model = model
+        self.flags = dict(flags or {})
+        self.checkpointDir = checkpointDir
+        self.data = restore(checkpointDir, step)
+        self.step = self.data['stepNum']
+        self.dt = dt
+        self.workers = workers or os.cpu_count()
+        self.platform = platform
+        self.devices = list(devices)
+        self.outputDir = outputDir
+
+    def run(self, branches, steps):
+        # Run every branch for steps steps from the checkpoint, return the manifest
+        global forkData, forkFlags
+        forkData = self.data
+        forkFlags = self.flags
+        ctx = multiprocessing.get_context('fork')
+        slots = ctx.Queue()
+        for slot in range(self.workers):
+            slots.put(slot)
+        jobs = {name: {'name': name, 'branch': branch, 'status': 'pending', 'outputDir': None,
+                       'seconds': None, 'error': None} for (name, branch) in branches.items()}
+        with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=BatchRunner.initWorker,
+                                                    initargs=(slots, self.platform, self.devices)) as pool:
+            futures = {pool.submit(runBranch, self.model, name, branch, steps, self.dt, self.outputDir): name
+                       for (name, branch) in branches.items()}
+            for future in concurrent.futures.as_completed(futures):
+                job = jobs[futures[future]]
+                try:
+                    (job['outputDir'], job['seconds']) = future.result()
+                    job['status'] = 'done'
+                except Exception as e:
+                    job['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                    job['status'] = 'failed'
+        return BatchRunner.writeManifest(self.outputDir, {'model': self.model, 'checkpoint': self.checkpointDir,
+                                                          'step': self.step, 'steps': steps,
+                                                          'jobs': list(jobs.values())})
@@ -0,0 +1,187 @@
+import numpy
+
+# Declarative gene regulatory network for the expression models.
+#
+# A model describes its network as a dict and compiles it once in setup():
+#
+#   networkSpec = {
+#       'genes': ['ectExp', 'Euo', 'HctA', 'HctB'],
+#       # cellType: {gene: (pr, dr, pp, dp)}, genes left out have all rates 0
+#       'rates': {1: {'Euo': (0.02, 0.02, 0.5, 0.08)}, ...},
+#       # which growth value drives expression in each cellType
+#       'growth': {1: 'growthRate', 3: 'parentGrowth', ...},
+#       # decay terms that are multiplied by the growth value, as (RNA, protein) per gene
+#       'decayScaled': {'Euo': (True, True)},
+#       # (source, target, 'repress' or 'activate', K, n): Hill factor on target transcription
+#       'edges': [('Euo', 'HctA', 'repress', 3.0, numpy.inf)],
+#       # (cellType, source, target, K): in cellType the target keeps its RNA and protein
+#       # for the step when the source protein is above K after it
+#       'freezes': [(3, 'Euo', 'HctA', 3.0)],
+#       # (fromType, gene, '<=' or '>=', threshold, toType)
+#       'transitions': [(3, 'Euo', '<=', 0.6, 4)],
+#       # the order the type blocks run in within a step, all types by default
+#       'order': [1, 2, 3, 4, 5],
+#   }
+#   grn = GeneNetwork(networkSpec)
+#
+# step() advances the cells of an ExpressionEngine at once:
+#   rna  += pr*G*R - dr*rna*(G or 1)
+#   gene += pp*G*rna - dp*gene*(G or 1)
+# where the rates are rows of dense (cellType x gene) tables picked by each cell's type,
+# G is the cell's growth value and R is the product of the Hill factors of all edges
+# into the gene. Adding regulation is one more entry in 'edges'.
+#
+# update() takes one update() step the way the per-cell loops do: the types in 'order',
+# each block stepping its cells and then applying its transitions, so a cell that changes
+# type runs the block of its new type in the same step. A transition on '>=' -inf always
+# fires, which gives transient types that a cell passes through within one step.
+
+class GeneNetwork:
+
+    def __init__(self, spec, nTypes=8):
+        self.genes = list(spec['genes'])
+        nGenes = len(self.genes)
+        index = {name: i for (i, name) in enumerate(self.genes)}
+        self.index = index
+
+        # Rate tables, one row per cellType
+        self.pr = numpy.zeros((nTypes, nGenes))
+        self.dr = numpy.zeros((nTypes, nGenes))
+        self.pp = numpy.zeros((nTypes, nGenes))
+        self.dp = numpy.zeros((nTypes, nGenes))
+        for (cellType, table) in spec.get('rates', {}).items():
+            for (gene, (pr, dr, pp, dp)) in table.items():
+                i = index[gene]
+                self.pr[cellType, i] = pr
+                self.dr[cellType, i] = dr
+                self.pp[cellType, i] = pp
+                self.dp[cellType, i] = dp
+
+        self.useParentGrowth = numpy.zeros(nTypes, dtype=bool)
+        for (cellType, growth) in spec.get('growth', {}).items():
+            if growth not in ('growthRate', 'parentGrowth'):
+                raise ValueError('unknown growth value %s for cellType %d' % (growth, cellType))
+            self.useParentGrowth[cellType] = growth == 'parentGrowth'
+
+        self.rnaDecayScaled = numpy.zeros(nGenes, dtype=bool)
+        self.geneDecayScaled = numpy.zeros(nGenes, dtype=bool)
+        for (gene, (rnaScaled, geneScaled)) in spec.get('decayScaled', {}).items():
+            self.rnaDecayScaled[index[gene]] = rnaScaled
+            self.geneDecayScaled[index[gene]] = geneScaled
+
+        # Regulation matrices, indexed [target, source]. sign is -1 repress, +1 activate, 0 no edge
+        self.sign = numpy.zeros((nGenes, nGenes))
+        self.K = numpy.ones((nGenes, nGenes))
+        self.n = numpy.zeros((nGenes, nGenes))
+        for (source, target, kind, K, n) in spec.get('edges', []):
+            if kind not in ('repress', 'activate'):
+                raise ValueError('unknown edge type %s' % kind)
+            if K <= 0:
+                raise ValueError('edge %s -> %s needs K > 0' % (source, target))
+            t, s = index[target], index[source]
+            self.sign[t, s] = -1 if kind == 'repress' else 1
+            self.K[t, s] = K
+            self.n[t, s] = n
+        self.regulated = numpy.any(self.sign != 0)
+
+        self.freezes = [(cellType, index[source], index[target], K)
+                        for (cellType, source, target, K) in spec.get('freezes', [])]
+
+        transitions = spec.get('transitions', [])
+        self.fromType = numpy.array([t[0] for t in transitions], dtype=numpy.int32)
+        self.gene = numpy.array([index[t[1]] for t in transitions], dtype=numpy.int32)
+        self.below = numpy.array([t[2] == '<=' for t in transitions], dtype=bool)
+        self.threshold = numpy.array([t[3] for t in transitions], dtype=float)
+        self.toType = numpy.array([t[4] for t in transitions], dtype=numpy.int32)
+        for t in transitions:
+            if t[2] not in ('<=', '>='):
+                raise ValueError('unknown transition test %s' % t[2])
+
+        types = set(spec.get('rates', {})) | set(spec.get('growth', {}))
+        types |= set(self.fromType.tolist()) | set(self.toType.tolist())
+        self.order = list(spec.get('order', sorted(types)))
+        self.transitionsOf = {cellType: [k for k in range(len(transitions)) if self.fromType[k] == cellType]
+                              for cellType in self.order}
+
+    def regulation(self, geneamt):
+        # Product over sources of the Hill factor of each edge, shape (cells, genes)
+        if not self.regulated:
+            return numpy.ones_like(geneamt)
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            ratio = (geneamt[:, None, :] / self.K) ** self.n
+            repress = 1 / (1 + ratio)
+        factor = numpy.where(self.sign < 0, repress, numpy.where(self.sign > 0, 1 - repress, 1.0))
+        return numpy.prod(factor, axis=2)
+
+    def growth(self, eng):
+        return numpy.where(self.useParentGrowth[eng.cellType], eng.parentGrowth, eng.growthRate)
+
+    def step(self, eng, rows=slice(None)):
+        # Advance RNA then protein of every (selected) cell by one step of its type's rates
+        ct = eng.cellType[rows]
+        G = numpy.where(self.useParentGrowth[ct], eng.parentGrowth[rows], eng.growthRate[rows])[:, None]
+        rna0 = eng.rnaamt[rows]
+        gene0 = eng.geneamt[rows]
+        R = self.regulation(gene0)
+        rnaDecay = numpy.where(self.rnaDecayScaled, G, 1.0)
+        geneDecay = numpy.where(self.geneDecayScaled, G, 1.0)
+        rna = rna0 + (self.pr[ct] * G * R) - (self.dr[ct] * rna0 * rnaDecay)
+        gene = gene0 + (self.pp[ct] * G * rna) - (self.dp[ct] * gene0 * geneDecay)
+        for (cellType, source, target, K) in self.freezes:
+            frozen = (ct == cellType) & (gene[:, source] > K)
+            rna[frozen, target] = rna0[frozen, target]
+            gene[frozen, target] = gene0[frozen, target]
+        eng.rnaamt[rows] = rna
+        eng.geneamt[rows] = gene
+
+    def update(self, eng, rows=None, tested=None, moves=(), pins=None):
+        # One update() step of the cells in the mask rows (all by default), block by block in
+        # self.order. After a block's step its pins {cellType: {gene: level}} hold protein
+        # levels, its cells in a moves (mask, toType) pair take the transition the model drew
+        # (in the first block they run), then its threshold transitions are tested for the
+        # cells in tested (all by default) and those that moved earlier in the step. A cell
+        # takes at most one transition per block. Returns a mask of the cells that moved.
+        ct = eng.cellType
+        if rows is None:
+            rows = numpy.ones(len(ct), dtype=bool)
+        tested = rows.copy() if tested is None else tested & rows
+        moved = numpy.zeros(len(ct), dtype=bool)
+        moves = [(mask.copy(), toType) for (mask, toType) in moves]
+        for cellType in self.order:
+            block = numpy.nonzero(rows & (ct == cellType))[0]
+            if len(block) == 0:
+                continue
+            self.step(eng, block)
+            for (gene, level) in (pins or {}).get(cellType, {}).items():
+                eng.geneamt[block, self.index[gene]] = level
+            for (mask, toType) in moves:
+                hit = block[mask[block]]
+                mask[hit] = False
+                ct[hit] = toType
+                moved[hit] = True
+            test = block[(tested[block] | moved[block]) & (ct[block] == cellType)]
+            for k in self.transitionsOf[cellType]:
+                level = eng.geneamt[test, self.gene[k]]
+                hit = level <= self.threshold[k] if self.below[k] else level >= self.threshold[k]
+                hit = test[hit & (ct[test] == cellType)]
+                ct[hit] = self.toType[k]
+                moved[hit] = True
+        return moved
+
+    def transitions(self, eng, rows=None):
+        # Apply the threshold transitions to every cell, or only to the row indices in rows.
+        # All tests use the types at the start of the call so a cell moves at most one stage
+        # per step. Returns a mask of the cells that moved.
+        ct = eng.cellType
+        if rows is None:
+            rows = numpy.arange(len(ct))
+        moves = []
+        for k in range(len(self.toType)):
+            level = eng.geneamt[rows, self.gene[k]]
+            hit = level <= self.threshold[k] if self.below[k] else level >= self.threshold[k]
+            moves.append(rows[(ct[rows] == self.fromType[k]) & hit])
+        moved = numpy.zeros(len(ct), dtype=bool)
+        for k, hitRows in enumerate(moves):
+            ct[hitRows] = self.toType[k]
+            moved[hitRows] = True
+        return moved
@@ -0,0 +1,78 @@
+import os
+import pickle
+import hashlib
+
+# On-disk cache of compiled OpenCL programs, so repeated runs (sweeps, batch workers, forks)
+# load the binaries of CLBacterium, the integrators (with the model's specRateCL() and
+# sigRateCL() in their source) and GridDiffusion instead of compiling them again.
+#
+#   KernelCache.install('kernel-cache')   # in setup(), before the OpenCL objects are made
+#   KernelCache.uninstall()
+#
+# CellModeller builds its programs with pyopencl's own cache turned off, so install() wraps
+# pyopencl.Program.build for the process: a program is keyed by the sha256 of its source, the
+# build options, and the platform, name, version and driver of each device. A key found in
+# the cache builds the program from its binaries; a miss (or binaries the driver no longer
+# takes) compiles from source and stores the binaries. Entries are written to a temporary
+# file and renamed, so workers sharing the directory only ever read whole entries. The cache
+# never needs clearing for correctness, as any change of source or driver is a new key.
+
+installed = None # (path, original Program.build) while installed
+
+def key(source, options, devices):
+    digest = hashlib.sha256(source.encode())
+    digest.update(repr(options).encode())
+    for device in devices:
+        digest.update(('\0%s\0%s\0%s\0%s' % (device.platform.name, device.name, device.version,
+                                             device.driver_version)).encode())
+    return digest.hexdigest()
+
+def load(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def store(path, binaries):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(binaries, f, protocol=-1)
+    os.replace(tmp, path)
+
+def install(path='kernel-cache'):
+    global installed
+    import pyopencl
+    if installed is not None:
+        uninstall()
+    os.makedirs(path, exist_ok=True)
+    original = pyopencl.Program.build
+
+    def build(program, options=[], devices=None, cache_dir=None):
+        source = getattr(program, '_source', None)
+        if source is None: # built from binaries already
+            return original(program, options, devices, cache_dir)
+        context = program._context
+        devices = devices or context.devices
+        entry = os.path.join(path, key(source, options, devices) + '.bin')
+        binaries = load(entry)
+        if binaries is not None and len(binaries) == len(devices):
+            try:
+                return original(pyopencl.Program(context, devices, binaries), options, devices)
+            except (pyopencl.Error, RuntimeError):
+                pass # stale or foreign binaries, compile again
+        built = original(program, options, devices, cache_dir)
+        binaries = built.get_info(pyopencl.program_info.BINARIES)
+        if all(binaries):
+            store(entry, binaries)
+        return built
+
+    pyopencl.Program.build = build
+    installed = (path, original)
+
+def uninstall():
+    global installed
+    if installed is not None:
+        import pyopencl
+        pyopencl.Program.build = installed[1]
+        installed = None
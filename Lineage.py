@@ -0,0 +1,152 @@
+import os
+import atexit
+import numpy
+
+# Lineage of a run, recorded as cells divide.
+#
+#   lineage = LineageRecorder(os.path.join(sim.outputDirPath, 'lineage.npz'))
+#   lineage.record(step, parent.id, d1.id, d2.id, parent.cellType, d1.cellType, d2.cellType) # in divide()
+#   ...
+#   tree = LineageIndex.load('data/<run>/lineage.npz')
+#   tree.ancestors(cid)                     # parent, grandparent, ... of a cell
+#   tree.descendants(cid)                   # every cell born below it
+#   rbe = tree.founders(2)                  # cells that turned RBe (were born RBr and divided as RBe)
+#   tree.descendantCounts(rbe, 3)           # IBs born in the lineage of each of them
+#
+# Each division is one row of an int64 table (parent, d1, d2, step, parentType, d1Type,
+# d2Type) that grows by doubling, and lineage.npz is rewritten every saveRows divisions and on
+# close(). Step is the sim step the division happened in (the first pickle it shows up in).
+#
+# LineageIndex lays the tree out a generation at a time with array operations and numbers
+# the cells in depth-first order, after which the descendants of a cell are one contiguous
+# range and subtree counts are two searchsorted calls.
+
+columns = ['parent', 'd1', 'd2', 'step', 'parentType', 'd1Type', 'd2Type']
+
+class LineageRecorder:
+
+    def __init__(self, path=None, saveRows=1000):
+        self.path = path
+        self.saveRows = saveRows
+        self.table = numpy.zeros((1024, len(columns)), dtype=numpy.int64)
+        self.n = 0
+        self.saved = 0
+        if path is not None:
+            atexit.register(self.close)
+
+    def record(self, step, parent, d1, d2, parentType, d1Type, d2Type):
+        # One division, or many at once with array arguments
+        rows = numpy.column_stack(numpy.broadcast_arrays(step, parent, d1, d2, parentType, d1Type, d2Type))
+        end = self.n + len(rows)
+        if end > len(self.table):
+            grown = numpy.zeros((max(end, 2*len(self.table)), len(columns)), dtype=numpy.int64)
+            grown[:self.n] = self.table[:self.n]
+            self.table = grown
+        self.table[self.n:end] = rows[:, [1, 2, 3, 0, 4, 5, 6]]
+        self.n = end
+        if self.path is not None and self.n - self.saved >= self.saveRows:
+            self.save()
+
+    def rows(self):
+        return self.table[:self.n]
+
+    def save(self):
+        tmp = self.path + '.tmp.npz'
+        numpy.savez_compressed(tmp, table=self.rows(), columns=numpy.array(columns))
+        os.replace(tmp, self.path)
+        self.saved = self.n
+
+    def close(self):
+        if self.path is not None and self.n > self.saved:
+            self.save()
+        atexit.unregister(self.close)
+
+
+class LineageIndex:
+
+    def __init__(self, table):
+        table = numpy.asarray(table, dtype=numpy.int64).reshape(-1, len(columns))
+        self.table = table
+        parent, d1, d2 = table[:, 0], table[:, 1], table[:, 2]
+        n = int(table[:, :3].max()) + 1 if len(table) else 0
+        self.parent = numpy.full(n, -1, dtype=numpy.int64)
+        self.parent[d1] = parent
+        self.parent[d2] = parent
+        self.bornType = numpy.full(n, -1, dtype=numpy.int64) # cellType a cell had after its birth
+        self.bornType[d1] = table[:, 5]
+        self.bornType[d2] = table[:, 6]
+        self.bornStep = numpy.full(n, -1, dtype=numpy.int64)
+        self.bornStep[d1] = table[:, 3]
+        self.bornStep[d2] = table[:, 3]
+        self.division = numpy.full(n, -1, dtype=numpy.int64) # table row where a cell divides
+        self.division[parent] = numpy.arange(len(table))
+        self.known = numpy.zeros(n, dtype=bool)
+        self.known[table[:, :3].ravel()] = True
+        self.layout()
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as data:
+            return cls(data['table'])
+
+    def layout(self):
+        # Depth-first numbering: order[cell], and size[cell] cells in its subtree (itself
+        # included). Generations are collected from the roots down, sizes summed back up
+        # and numbers handed out down again, each a whole generation at a time.
+        n = len(self.parent)
+        roots = numpy.nonzero(self.known & (self.parent < 0))[0]
+        generations = [] # (parents, d1s, d2s) of the divisions in each generation
+        level = roots
+        while len(level):
+            rows = self.division[level]
+            level = level[rows >= 0]
+            rows = rows[rows >= 0]
+            generations.append((level, self.table[rows, 1], self.table[rows, 2]))
+            level = numpy.concatenate([self.table[rows, 1], self.table[rows, 2]])
+        self.size = self.known.astype(numpy.int64)
+        for (parents, a, b) in reversed(generations):
+            self.size[parents] += self.size[a] + self.size[b]
+        self.order = numpy.full(n, -1, dtype=numpy.int64)
+        self.order[roots] = numpy.concatenate([[0], numpy.cumsum(self.size[roots])[:-1]]) if len(roots) else roots
+        for (parents, a, b) in generations:
+            self.order[a] = self.order[parents] + 1
+            self.order[b] = self.order[a] + self.size[a]
+        cells = numpy.nonzero(self.known)[0]
+        self.byOrder = cells[numpy.argsort(self.order[cells])] # cells in depth-first order
+
+    def check(self, cid):
+        # cid as a row of the index, KeyError for a cell that is in no recorded division
+        if not 0 <= cid < len(self.known) or not self.known[cid]:
+            raise KeyError('cell %d is not in the lineage' % cid)
+        return int(cid)
+
+    def ancestors(self, cid):
+        chain = []
+        cid = self.parent[self.check(cid)]
+        while cid >= 0:
+            chain.append(int(cid))
+            cid = self.parent[cid]
+        return chain
+
+    def descendants(self, cid):
+        cid = self.check(cid)
+        start = self.order[cid]
+        return self.byOrder[start + 1:start + self.size[cid]]
+
+    def born(self, cellType):
+        # Cells whose type right after their birth was cellType
+        return numpy.nonzero(self.bornType == cellType)[0]
+
+    def founders(self, cellType):
+        # Cells that divided as cellType without being born as it, the first of their lineage
+        dividedAs = self.table[self.table[:, 4] == cellType, 0]
+        return dividedAs[self.bornType[dividedAs] != cellType]
+
+    def descendantCounts(self, cids, cellType):
+        # For each cell in cids, the descendants born as cellType
+        cids = numpy.asarray(cids, dtype=numpy.int64)
+        orders = numpy.sort(self.order[self.born(cellType)])
+        start = self.order[cids]
+        low = numpy.searchsorted(orders, start, side='right')
+        high = numpy.searchsorted(orders, start + self.size[cids], side='left')
+        return high - low
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import atexit
+import numpy
+
+# Per-phase timing of simulation steps, with counters, for finding where a slow run spends
+# its time.
+#
+#   profiler = Profiler(os.path.join(sim.outputDirPath, 'profile'))
+#   profiler.attach(sim, {'columns': store, 'checkpoint': checkpoint}) # in setup(), before sim.init()
+#   profiler.cells(typesBefore, typesAfter)    # from update(): cells per type, transitions
+#   profiler.enabled = False                   # and back on, at any time
+#
+# attach() wraps, on the instances, the methods each phase of a step goes through:
+#   step         sim.step, one row of the summary per call
+#   update       the regulator's step (the model's update())
+#   divide       sim.divide, one call per division (counted as divisions)
+#   biophysics   phys.step (calls counted: contact solver iterations) and phys.set_cells
+#   integrator   integ.step, the species and signal integration
+#   diffusion    sig.step, when the signalling has one
+#   pickle       sim.writePickle (bytes counted)
+# plus the save methods of the outputs given (ColumnWriter, OnlineAggregator,
+# LineageRecorder, CheckpointWriter), with the bytes they write. Phases that run inside
+# another (a checkpoint inside update) nest. sim.init is wrapped too, so the phases of the
+# physics, regulator and integrator objects are wrapped as setup() hands them over.
+#
+# A wrapper costs one attribute test while disabled. save() (also at exit, and from close())
+# writes, next to path:
+#   path.trace.json  Chrome trace (chrome://tracing, Perfetto, speedscope): every phase call
+#                    as a complete event, and the counters of each step as counter events
+#   path.folded      self time per phase stack in microseconds, for flamegraph.pl
+#   path.csv         per step: seconds in each phase, calls, and the counters
+
+class Profiler:
+
+    def __init__(self, path=None, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = [] # Chrome trace events
+        self.folded = {} # 'step;update;checkpoint': self microseconds
+        self.stack = [] # [phase, start, child seconds] of the calls in progress
+        self.rows = [] # summary row of every step
+        self.row = {} # seconds, calls and counters of the current step
+        self.wrapped = [] # (object, method name, original) to restore in detach()
+        self.stepNum = 0
+        if path is not None:
+            atexit.register(self.close)
+
+    # Instrumentation
+    def wrap(self, obj, name, phase, sizeOf=None, appends=False, counter=None):
+        # Replace obj.name with a timed call. sizeOf(args) is the size of what the call writes,
+        # counted as bytes after the call (the growth over the call if it appends to a file);
+        # counter is counted once per call
+        if obj is None or not hasattr(obj, name):
+            return
+        original = getattr(obj, name)
+        profiler = self
+        def timed(*args, **kwargs):
+            if not profiler.enabled:
+                return original(*args, **kwargs)
+            before = sizeOf(args) if appends else 0
+            profiler.push(phase)
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                profiler.pop()
+            if counter is not None:
+                profiler.count(counter)
+            if sizeOf is not None:
+                profiler.count('bytes', sizeOf(args) - before)
+            return result
+        setattr(obj, name, timed)
+        self.wrapped.append((obj, name, original))
+
+    def attach(self, sim, outputs=None):
+        pickleSize = lambda args: fileSize(os.path.join(getattr(sim, 'outputDirPath', ''), 'step-%05i.pickle' % sim.stepNum))
+        self.wrap(sim, 'step', 'step')
+        self.wrap(sim, 'divide', 'divide', counter='divisions')
+        self.wrap(sim, 'writePickle', 'pickle', pickleSize)
+        init = sim.init
+        def attachInit(phys, reg, sig, integ, *args, **kwargs):
+            self.wrap(reg, 'step', 'update')
+            self.wrap(phys, 'step', 'biophysics')
+            self.wrap(phys, 'set_cells', 'biophysics')
+            self.wrap(integ, 'step', 'integrator')
+            self.wrap(sig, 'step', 'diffusion')
+            return init(phys, reg, sig, integ, *args, **kwargs)
+        sim.init = attachInit
+        self.wrapped.append((sim, 'init', init))
+        for (phase, output) in (outputs or {}).items():
+            if output is None:
+                continue
+            if hasattr(output, 'deltaSteps'): # CheckpointWriter, the files of the recorded step
+                self.wrap(output, 'record', phase, lambda args, output=output: checkpointSize(output, args[0]))
+            elif hasattr(output, 'flush'): # ColumnWriter, appends a chunk
+                self.wrap(output, 'flush', phase, lambda args, output=output: fileSize(output.path), appends=True)
+            else: # OnlineAggregator, LineageRecorder, rewrite their file
+                self.wrap(output, 'save', phase, lambda args, output=output: fileSize(output.path))
+
+    def detach(self):
+        for (obj, name, original) in reversed(self.wrapped):
+            setattr(obj, name, original)
+        self.wrapped = []
+
+    def push(self, phase):
+        self.stack.append([phase, time.perf_counter(), 0.0])
+
+    def pop(self):
+        (phase, start, children) = self.stack.pop()
+        end = time.perf_counter()
+        seconds = end - start
+        self.events.append({'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': (start - self.origin) * 1e6,
+                            'dur': seconds * 1e6})
+        key = ';'.join([frame[0] for frame in self.stack] + [phase])
+        self.folded[key] = self.folded.get(key, 0.0) + (seconds - children) * 1e6
+        self.row[phase] = self.row.get(phase, 0.0) + seconds
+        self.row[phase + '.calls'] = self.row.get(phase + '.calls', 0) + 1
+        if self.stack:
+            self.stack[-1][2] += seconds
+        elif phase == 'step':
+            self.endStep(end)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.row[name] = self.row.get(name, 0) + value
+
+    def cells(self, before, after, nTypes=8):
+        # Cells updated per type and type transitions, from the cellTypes before and after update()
+        if not self.enabled:
+            return
+        after = numpy.asarray(after, dtype=numpy.int64)
+        for (t, n) in enumerate(numpy.bincount(after, minlength=nTypes).tolist()):
+            self.row['cells.%d' % t] = n
+        self.count('transitions', int(numpy.count_nonzero(numpy.asarray(before) != after)))
+
+    def endStep(self, end):
+        counters = {name: value for (name, value) in self.row.items()
+                    if not name.endswith('.calls') and not isinstance(value, float)}
+        if counters:
+            self.events.append({'name': 'counters', 'ph': 'C', 'pid': 0, 'tid': 0,
+                                'ts': (end - self.origin) * 1e6, 'args': counters})
+        self.rows.append(dict(self.row, stepNum=self.stepNum))
+        self.stepNum += 1
+        self.row = {}
+
+    # Output
+    def summary(self):
+        # Column names and per-step rows (0 where a phase did not run)
+        names = ['stepNum'] + sorted({name for row in self.rows for name in row if name != 'stepNum'})
+        return (names, [[row.get(name, 0) for name in names] for row in self.rows])
+
+    def save(self):
+        if self.path is None:
+            return
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        writeAtomic(self.path + '.trace.json', json.dumps({'traceEvents': self.events, 'displayTimeUnit': 'ms'}))
+        writeAtomic(self.path + '.folded', ''.join('%s %d\n' % (key, round(us)) for (key, us) in sorted(self.folded.items())))
+        (names, rows) = self.summary()
+        writeAtomic(self.path + '.csv', ','.join(names) + '\n' +
+                    ''.join(','.join('%.6g' % value if isinstance(value, float) else str(value) for value in row) + '\n'
+                            for row in rows))
+
+    def close(self):
+        self.save()
+        atexit.unregister(self.close)
+
+def fileSize(path):
+    return os.path.getsize(path) if path is not None and os.path.exists(path) else 0
+
+def checkpointSize(writer, step):
+    if step < 0 or step % writer.deltaSteps:
+        return 0
+    return sum(fileSize(os.path.join(writer.path, '%s-%05d.ckpt' % (kind, step))) for kind in ['base', 'delta'])
+
+def writeAtomic(path, text):
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
@@ -1,12 +1,24 @@
+import os
 import random
 from CellModeller.Regulation.ModuleRegulator import ModuleRegulator
-from CellModeller.Biophysics.BacterialModels.CLBacterium import CLBacterium
 import numpy
 import math
-
-from CellModeller.Integration.CLCrankNicIntegrator import CLCrankNicIntegrator 
-from CellModeller.Integration.CLEulerSigIntegrator import CLEulerSigIntegrator
-from CellModeller.Signalling.GridDiffusion import GridDiffusion 
+from ExpressionEngine import ExpressionEngine, FLAT_COLOR
+from GeneNetwork import GeneNetwork
+from LinearKinetics import LinearKinetics
+from TransitionScheduler import TransitionScheduler
+from WellMixed import WellMixedBiophysics, WellMixedRegulator
+from ColumnStore import ColumnWriter
+from Aggregator import OnlineAggregator
+from Lineage import LineageRecorder
+from Checkpoint import CheckpointWriter
+import CellRandom as cr # cr.GROWTH etc. are draw purposes; GROWTH below is a species index
+import HazardCurves
+from DebugLog import DebugLog
+from Profiler import Profiler
+import KernelCache
+from ColonyGrid import ColonyGrid
+from SpeciesIntegrator import AdaptiveIntegrator
 
 #Launch Code: python Scripts/CellModellerGUI.py
 #Launch Code Batch: python Scripts/batch.py
@@ -15,14 +27,72 @@ from CellModeller.Signalling.GridDiffusion import GridDiffusion
 
 max_cells = 1500
 
+clExpression = False # run the RNA/protein kinetics as species rates in the OpenCL kernel (expressionRateCL)
+# species layout with clExpression: the model species, then the growth factor, RNA[0..4], protein[0..4]
+GROWTH = 4
+RNA = 5
+GENE = 10
+tickTime = 0.025 # integrator time per update() step, set from sim.dt in setup()
+wellMixed = False # no contact mechanics, diffusion grid or species integration, volume growth only (WellMixed.py)
+
 #Specify parameter for solving diffusion dynamics #Add
 grid_size = (4, 4, 4) # grid size
 grid_dim = (64, 8, 12) # dimension of diffusion space, unit = number of grid
 grid_orig = (-128, -14, -8) # where to place the diffusion space onto simulation space
 
 def setup(sim):
+    global tickTime, grn, kin, sched, store, stats, lineage, checkpoint, cellRandom, hazard, profiler, colonyGrid, speciesInteg, scatterAll, debug
+    tickTime = sim.dt
+    grn = GeneNetwork(networkSpec)
+    kin = LinearKinetics(grn)
+    sched = TransitionScheduler(grn, kin) if useScheduler else None
+    store = None
+    if columnOutput and getattr(sim, 'saveOutput', False):
+        store = ColumnWriter(os.path.join(sim.outputDirPath, 'columns.npz'), outputSteps, engine.nGenes)
+    stats = None
+    if aggregate and getattr(sim, 'saveOutput', False):
+        stats = OnlineAggregator(os.path.join(sim.outputDirPath, 'summary.npz'), nGenes=engine.nGenes)
+    lineage = None
+    if recordLineage and getattr(sim, 'saveOutput', False):
+        lineage = LineageRecorder(os.path.join(sim.outputDirPath, 'lineage.npz'))
+    checkpoint = None
+    if checkpoints and getattr(sim, 'saveOutput', False):
+        checkpoint = CheckpointWriter(sim, os.path.join(sim.outputDirPath, 'checkpoints'), restartSteps, outputSteps)
+    cellRandom = None
+    if randomSeed is not None: # an Ensemble numbers its cells per replicate
+        cellRandom = cr.CellRandom(randomSeed, getattr(sim, 'replicates', 1))
+    hazard = HazardCurves.table(conversionCurve) if conversionCurve is not None else None
+    scatterAll = sim.is_gui
+    debug = debugLog if debugLog is not None else DebugLog(lines=20, everySteps=10) if sim.is_gui else DebugLog(0)
+    if lazyColor and not sim.is_gui:
+        engine.colors = False # update() paints the recorded steps
+    profiler = None
+    if profile:
+        profiler = Profiler(os.path.join(sim.outputDirPath, 'profile') if getattr(sim, 'saveOutput', False) else None)
+        profiler.attach(sim, {'columns': store, 'summary': stats, 'lineage': lineage, 'checkpoint': checkpoint})
+    colonyGrid = None
+    speciesInteg = None
+    if adaptiveSpecies:
+        if clExpression:
+            raise ValueError('adaptiveSpecies integrates specRate on the host and cannot run with clExpression')
+        speciesInteg = AdaptiveIntegrator(specRate, rtol=speciesTol[0], atol=speciesTol[1])
+        if profiler is not None:
+            profiler.wrap(speciesInteg, 'step', 'integrator')
+
+    if wellMixed:
+        # Population dynamics only: the callbacks run as usual, cells just grow and divide
+        if clExpression:
+            raise ValueError('clExpression needs the OpenCL integrator and cannot run with wellMixed')
+        sim.init(WellMixedBiophysics(sim), WellMixedRegulator(sim, 4, 1, sim.moduleName), None, None)
+        sim.addCell(cellType=0, pos=(0,0,0))
+        sim.pickleSteps = pickleInterval()
+        return
 
     # Set biophysics, signalling, and regulation models
+    # The OpenCL classes load here, not with the module, so well-mixed runs never import them
+    if kernelCache is not None:
+        KernelCache.install(kernelCache)
+    from CellModeller.Biophysics.BacterialModels.CLBacterium import CLBacterium
     # jitter turns on 3d
     # gamma controls growth inhibition from neighbors
     biophys = CLBacterium(sim, jitter_z=False, gamma = 200000)
@@ -30,16 +100,34 @@ def setup(sim):
     # add the planes to set physical  boundaries of cell growth
     #biophys.addPlane((0,-16,0), (0,1,0), 1)
     #biophys.addPlane((0,16,0), (0,-1,0), 1)
-    sig = GridDiffusion(sim, 1, grid_dim, grid_size, grid_orig, [10.0])
+    nSpecies = GENE + 5 if clExpression else 4
+    if speciesInteg is not None and not adaptiveGrid:
+        raise ValueError('adaptiveSpecies leaves the signal without an integrator, run it with adaptiveGrid')
+    if adaptiveGrid:
+        # The signal goes on a ColonyGrid that update() steps, at the k1 of sigRateCL
+        from CellModeller.Integration.CLEulerIntegrator import CLEulerIntegrator
+        sig = None
+        colonyGrid = ColonyGrid(1, grid_size, grid_orig, [10.0], rates=[1.0])
+        integ = CLEulerIntegrator(sim, nSpecies, max_cells) if speciesInteg is None else None
+        if profiler is not None:
+            profiler.wrap(colonyGrid, 'step', 'diffusion')
+    else:
+        from CellModeller.Signalling.GridDiffusion import GridDiffusion
+        from CellModeller.Integration.CLCrankNicIntegrator import CLCrankNicIntegrator
+        sig = GridDiffusion(sim, 1, grid_dim, grid_size, grid_orig, [10.0])
 
-    # Here we set up the numerical integration:
-    # Crank-Nicholson method:
-    integ = CLCrankNicIntegrator(sim, 1, 4, max_cells, sig, boundcond='reflect')
-    # Alternative is to use the simple forward Euler method:
-    #integ = CLEulerSigIntegrator(sim, 1, 2, max_cells, sig, boundcond='reflect')
+        # Here we set up the numerical integration:
+        # Crank-Nicholson method:
+        integ = CLCrankNicIntegrator(sim, 1, nSpecies, max_cells, sig, boundcond='reflect')
+        # Alternative is to use the simple forward Euler method:
+        #from CellModeller.Integration.CLEulerSigIntegrator import CLEulerSigIntegrator
+        #integ = CLEulerSigIntegrator(sim, 1, 2, max_cells, sig, boundcond='reflect')
 
     # use this file for reg too
-    regul = ModuleRegulator(sim, sim.moduleName)    
+    if integ is not None:
+        regul = ModuleRegulator(sim, sim.moduleName)
+    else: # update() integrates the species, the regulator gives the cells their arrays
+        regul = WellMixedRegulator(sim, nSpecies, 1, sim.moduleName)
     # Only biophys and regulation
     sim.init(biophys, regul, sig, integ)
 
@@ -54,7 +142,7 @@ def setup(sim):
         #sigrend = Renderers.GLGridRenderer(sig, integ)
         #sim.addRenderer(sigrend) #Add
 
-    sim.pickleSteps = 10
+    sim.pickleSteps = pickleInterval()
 
 def init(cell):
 
@@ -63,7 +151,7 @@ def init(cell):
     cell.targetVol = 2 #* numpy.random.normal(1, 0.05) #for normally distributed variance (middle, std)
     
     # Specify growth rate of cells
-    cell.growthRate = 1.0 + random.uniform(-0.05,0.05) #remove either targetVol or GrowthRate variability
+    cell.growthRate = 1.0 + cellUniform(cell, cr.GROWTH, -0.05,0.05) #remove either targetVol or GrowthRate variability
     cell.parentGrowth = [0] #progenitor cell logged growthRate. "Metabolism rate" as these cells don't realy grow
     
     cell.color = [2.0, 0.5, 1.5]#specify color of cell
@@ -76,24 +164,89 @@ def init(cell):
     cell.geneamt = [0.0,0.0,0.0,0.0,0.0]   #[0]= ectExp, [1]=Euo, [2]=HctA, [3]=CtcB, [4]=HctB
     
     #EB to RB germination time
-    cell.germTime = [(120 + random.uniform(-40,40))] #based on livecell and single cell expansion data: need to measure actually germ time variation and fit to dist
+    cell.germTime = [(120 + cellUniform(cell, cr.GERM_TIME, -40,40))] #based on livecell and single cell expansion data: need to measure actually germ time variation and fit to dist
 
     #RBr > RBi conversion percent
     cell.percentchance = [0,0] #curve that drives RBr > RBi conversion
 
     #Specify initial concentration of chemical 
-    cell.species[:] = [0.0] #species is concentration, I checked TC, cell growth causes steady state, cell division increases concentration
+    cell.species[:] = 0.0 #species is concentration, I checked TC, cell growth causes steady state, cell division increases concentration
+    if colonyGrid is not None:
+        cell.signals = numpy.zeros(1) # no signalling integrator, update() sets the levels
     cell.signals[:] = [0.0]
 
+def expressionRateCL():
+    # Euo/HctA/CtcB/HctB kinetics of updateEngine() as species rates keyed on cellType.
+    # g is growthRate for RBs and parentGrowth for IBs, written into species by update().
+    # Rates are per update() step, so they are divided by the integrator time of one step.
+    if not clExpression:
+        return ''
+    return '''
+    const float tick = %ff;
+    float g = species[%d];
+    float r1 = species[%d];
+    float r2 = species[%d];
+    float r3 = species[%d];
+    float r4 = species[%d];
+    float e1 = species[%d];
+    float e2 = species[%d];
+    float e3 = species[%d];
+    float e4 = species[%d];
+    for (int i=%d; i<%d; i++) rates[i] = 0.0f;
+
+    if (cellType==1 || cellType==2 || cellType==3){ //RBr, RBi, IBr: Euo
+    rates[%d] = (0.02f*g - 0.02f*r1)/tick;
+    rates[%d] = (0.5f*r1*g - 0.08f*e1)/tick;
+    }
+    if (cellType==3 && e1 <= 3.0f){ //IBr: high Euo blocks HctA and CtcB
+    rates[%d] = (0.02f*g - 0.01f*r2)/tick;
+    rates[%d] = (0.5f*r2*g - 0.05f*e2)/tick;
+    rates[%d] = (0.06f*g - 0.024f*r3)/tick;
+    rates[%d] = (0.5f*r3*g - 0.01f*e3)/tick;
+    }
+    if (cellType==4){ //IBe: HctA and CtcB protein decay
+    rates[%d] = (-0.05f*e2)/tick;
+    rates[%d] = (-0.01f*e3)/tick;
+    }
+    if (cellType==4 || cellType==5){ //IBe, EB: HctB
+    rates[%d] = (0.06f*g - 0.024f*r4)/tick;
+    rates[%d] = (0.5f*r4*g - 0.01f*e4)/tick;
+    }
+    ''' % (tickTime, GROWTH, RNA+1, RNA+2, RNA+3, RNA+4, GENE+1, GENE+2, GENE+3, GENE+4, GROWTH, GENE+5,
+           RNA+1, GENE+1,
+           RNA+2, GENE+2, RNA+3, GENE+3,
+           GENE+2, GENE+3,
+           RNA+4, GENE+4)
+
 def specRateCL(): # Signal adds at rate k1
 
-    return '''
+    return expressionRateCL() + '''
     const float k0 = 0.0f;
     const float d0 = 0.3f;
     float x0 = species[0];
     rates[0] = k0 - d0*x0;
     '''
    
+def specRate(species, cellType):
+    # specRateCL() in NumPy, for adaptiveSpecies
+    k0 = 0.0
+    d0 = 0.3
+    rates = numpy.zeros_like(species)
+    rates[:, 0] = k0 - d0*species[:, 0]
+    return rates
+
+def stepSpecies(cells):
+    # One sim step of the species of every cell with speciesInteg, logging the sub-steps on
+    # the recorded steps
+    states = list(cells.values())
+    species = numpy.array([cell.species for cell in states], dtype=float).reshape(len(states), -1)
+    cellType = numpy.fromiter((cell.cellType for cell in states), dtype=numpy.int64, count=len(states))
+    species = speciesInteg.step(species, tickTime, cellType=cellType)
+    for (cell, values) in zip(states, species):
+        cell.species[:] = values
+    if (time - 1) % outputSteps == 0:
+        debug.write('step %d %s' % (time - 1, speciesInteg.report()))
+
 def sigRateCL(): #Add
 
     return '''
@@ -102,23 +255,187 @@ def sigRateCL(): #Add
     rates[0] = k1;
     ''' 
     
+vectorized = True # advance cells as NumPy columns (ExpressionEngine) instead of the per-cell loop
+engine = ExpressionEngine(5)
+
+useNetwork = False # drive expression from networkSpec (GeneNetwork) instead of updateEngine()
+# Celltypes: 0=germ_EB, 1=RBr, 2=RBi, 3=IBr, 4=IBe, 5=EB
+networkSpec = {
+    'genes': ['ectExp', 'Euo', 'HctA', 'CtcB', 'HctB'],
+    # cellType: {gene: (RNA production, RNA degradation, protein production, protein degradation)}
+    'rates': {
+        1: {'Euo': (0.02, 0.02, 0.5, 0.08)},
+        2: {'Euo': (0.02, 0.02, 0.5, 0.08)},
+        3: {'Euo': (0.02, 0.02, 0.5, 0.08), 'HctA': (0.02, 0.01, 0.5, 0.05), 'CtcB': (0.06, 0.024, 0.5, 0.01)},
+        4: {'HctA': (0.0, 0.0, 0.0, 0.05), 'CtcB': (0.0, 0.0, 0.0, 0.01), 'HctB': (0.06, 0.024, 0.5, 0.01)},
+        5: {'HctB': (0.06, 0.024, 0.5, 0.01)},
+    },
+    'growth': {1: 'growthRate', 2: 'growthRate', 3: 'parentGrowth', 4: 'parentGrowth', 5: 'parentGrowth'},
+    # (source, target, 'repress'/'activate', K, Hill n). Wanted feedback: ('HctA', 'Euo', 'repress', 5.0, 2),
+    # ('CtcB', 'HctB', 'activate', 2.0, 2), ('HctB', 'Euo', 'repress', 10.0, 2),
+    # ('HctB', 'HctA', 'repress', 10.0, 2), ('HctB', 'CtcB', 'repress', 10.0, 2)
+    'edges': [],
+    # High Euo blocks HctA and CtcB in IBrs, degradation too
+    'freezes': [(3, 'Euo', 'HctA', 3.0), (3, 'Euo', 'CtcB', 3.0)],
+    'transitions': [(3, 'CtcB', '>=', 4, 4), (4, 'HctB', '>=', 15, 5)],
+}
+# Named rate constants and thresholds of updateEngine() and germination(), the values a
+# Sweep varies. The per-cell loop keeps its own literals and networkSpec its own rates.
+params = {
+    'pr1': 0.02, 'nr1': 0.02, 'p1': 0.5, 'n1': 0.08, # Euo
+    'pr2': 0.02, 'nr2': 0.01, 'p2': 0.5, 'n2': 0.05, # HctA
+    'pr3': 0.06, 'nr3': 0.024, 'p3': 0.5, 'n3': 0.01, # CtcB
+    'pr4': 0.06, 'nr4': 0.024, 'p4': 0.5, 'n4': 0.01, # HctB
+    'euoBlock': 3, # Euo above this blocks HctA and CtcB in IBrs
+    'ctcBSwitch': 4, # IBr -> IBe when CtcB reaches this
+    'hctBSwitch': 15, # IBe -> EB when HctB reaches this
+    # percentchance = pcMax/(1 + exp((pcMid - hours*growthRate)*pcSlope)) + pcBase
+    'pcMax': 97.81, 'pcMid': 21.5841312, 'pcSlope': 0.677630536, 'pcBase': 2.19,
+}
+grn = None # GeneNetwork compiled from networkSpec in setup()
+kin = None # LinearKinetics over grn, for exact multi-step jumps
+fastForwardTypes = [5] # terminal types left out of the per-step network update, jumped forward to the recorded steps
+useScheduler = True # test network transitions only for cells whose predicted event is due
+sched = None # TransitionScheduler, built in setup() when useScheduler
+columnOutput = True # record the cells to columns.npz in the output dir (ColumnStore.py) every outputSteps
+outputSteps = 10 # steps between column records, and between pickles without columnOutput
+restartSteps = 100 # steps between restart points: checkpoint bases, or cellStates pickles without checkpoints
+store = None # ColumnWriter of this run, opened in setup()
+aggregate = True # per-type counts and expression statistics of every step to summary.npz (Aggregator.py)
+stats = None # OnlineAggregator of this run, opened in setup()
+recordLineage = True # record every division (parent, daughters, step, types) to lineage.npz (Lineage.py)
+lineage = None # LineageRecorder of this run, opened in setup()
+checkpoints = True # restart checkpoints (Checkpoint.py): a base every restartSteps, deltas every outputSteps
+checkpoint = None # CheckpointWriter of this run, opened in setup()
+dropPickles = False # opt in: pickle cellStates only for what the columns and checkpoints do not cover (every restartSteps without checkpoints, else step 0 only); scripts that read the step pickles need it off
+randomSeed = None # seed of counter-based per-cell draws (CellRandom.py), keyed by cell id, step and purpose; None takes them from the global random streams
+cellRandom = None # CellRandom of this run, built in setup() from randomSeed
+conversionCurve = None # RBr -> RBi conversion chance from a curve of HazardCurves.py ('lva', 'livecell', 'early'), tabulated and evaluated on conversion steps only; None computes the pc* logistic of params every step
+hazard = None # HazardTable of conversionCurve, built in setup()
+scatterAll = False # write every CellState back on every step, set in setup() for the GUI, which draws them all; otherwise only on the recorded and pickled steps (recordedStep())
+lazyColor = True # outside the GUI, color the cells from cellType and geneamt (setColors) in one pass on the recorded steps (every outputSteps) only
+debugLog = None # per-cell debug output of update() and divide(): a DebugLog, at most lines a step every everySteps steps, DebugLog(None) prints all of it; None is DebugLog(lines=20, everySteps=10) in the GUI and silent otherwise
+debug = DebugLog(0) # the DebugLog in use, chosen in setup()
+profile = False # time each phase of a step (update, divide, biophysics, integrator, diffusion, pickles, outputs) and count cells per type, transitions, divisions and bytes written (Profiler.py), to profile.trace.json, .folded and .csv in the output dir; profiler.enabled switches it at run time
+profiler = None # Profiler of this run, made in setup()
+kernelCache = 'kernel-cache' # directory of compiled OpenCL programs (KernelCache.py), reused by later runs on the same device and driver; None compiles them every run
+adaptiveGrid = False # diffuse the signal on the voxels around the colony only (ColonyGrid.py), re-gridding as it grows, instead of GridDiffusion over all of grid_dim; the species then integrate with CLEulerIntegrator
+colonyGrid = None # ColonyGrid of this run, made in setup()
+adaptiveSpecies = False # integrate the species on the host from specRate, with error-controlled sub-steps per cell and ROS2 for the stiff ones (SpeciesIntegrator.py), instead of the OpenCL integrator; the sub-steps taken go to the run log every outputSteps. With physics it needs adaptiveGrid, which then carries the signal (setup() raises otherwise)
+speciesTol = (1e-4, 1e-6) # relative and absolute error allowed to adaptiveSpecies
+speciesInteg = None # AdaptiveIntegrator of this run, made in setup()
+
+def cellUniform(cell, purpose, low, high):
+    # random.uniform(low, high), or the draw of this cell, step and purpose with randomSeed
+    if cellRandom is None:
+        return random.uniform(low, high)
+    return cellRandom.uniform(cell.id, time, purpose, low, high)
+
+def cellNormal(cell, purpose, mean, sd):
+    # numpy.random.normal(mean, sd), or the draw of this cell, step and purpose with randomSeed
+    if cellRandom is None:
+        return numpy.random.normal(mean, sd)
+    return cellRandom.normal(cell.id, time, purpose, mean, sd)
+
+def pickleInterval():
+    # sim.pickleSteps: a pickle every outputSteps, or with dropPickles only for what columns
+    # and checkpoints do not cover
+    if store is None or not dropPickles:
+        return outputSteps
+    if checkpoint is None:
+        return restartSteps
+    return 10**9 # the step 0 pickle only, restarts come from the checkpoints
+
+
+def recordedStep():
+    # Whether the state this update() leaves is pickled, recorded or drawn, when every CellState
+    # has to hold it. On the other steps the engine writes back only what CellModeller reads
+    # before the next update() (ExpressionEngine.changedRows())
+    return scatterAll or (time - 1) % outputSteps == 0 or (time - 1) % pickleInterval() == 0
+
+def recordState(cells, step, final=False):
+    # The state of step to the columns, summary and checkpoints that are on: from update(), for
+    # the step before the one it advances, and from finish() for the last
+    if not (vectorized or clExpression):
+        if store is not None:
+            store.record(step, cells, final=final)
+        if stats is not None:
+            stats.recordCells(step, cells, final)
+        if checkpoint is not None:
+            checkpoint.record(step, cells, time=step + 1, grid=colonyGrid.state() if colonyGrid is not None else None)
+        return
+    if useNetwork and not clExpression and (final or (stats is not None and stats.records(step))):
+        kin.catchUp(engine, step + 1) # parked cells, on the steps the summary takes
+    if store is not None:
+        store.record(step, cells, engine, final)
+    if stats is not None:
+        stats.record(step, engine.cellType, engine.rnaamt, engine.geneamt, final)
+    if checkpoint is not None:
+        checkpoint.record(step, cells, time=step + 1, lastStep=(engine.ids.copy(), engine.lastStep.copy()),
+                          grid=colonyGrid.state() if colonyGrid is not None else None)
+
+def finish(cells):
+    # Record the state the last update() left, which no later update() will. BatchRunner and
+    # Fork call this when a run is over, before they close the outputs
+    if vectorized or clExpression:
+        engine.sync(cells, time)
+        if clExpression:
+            engine.readSpecies(cells, RNA, GENE)
+        if useNetwork and not clExpression:
+            kin.catchUp(engine, time) # parked cells, before they are written back
+        engine.scatter(cells)
+    recordState(cells, time - 1, final=True)
+
 time = 0
 def update(cells): #Iterate through each cell update and flag cells that reach target size for division
     global time
     #global n0 #whats this and why global?
     time += 1
+    debug.step(time)
+    if vectorized or clExpression:
+        engine.sync(cells, time - 1) # the daughters are as far as their parents
+        before = engine.cellType.copy() if profiler is not None else None
+        if clExpression:
+            engine.readSpecies(cells, RNA, GENE)
+        recordState(cells, time - 2) # the state step-<time-2>.pickle would hold
+        if colonyGrid is not None: # after the record, so its checkpoint holds the grid the recorded cells were sampled from
+            colonyGrid.step(cells, tickTime)
+        if speciesInteg is not None:
+            stepSpecies(cells)
+        if useNetwork and not clExpression:
+            updateNetwork(engine)
+        else:
+            updateEngine(engine)
+        if clExpression:
+            growth = numpy.where(engine.cellType >= 3, engine.parentGrowth, engine.growthRate)
+            engine.writeSpecies(cells, RNA, GENE, GROWTH, growth)
+        if not engine.colors and lazyColor and (time - 1) % outputSteps == 0:
+            engine.paint(setColors) # the state the next pickle or checkpoint holds
+        if profiler is not None:
+            profiler.cells(before, engine.cellType)
+        engine.scatter(cells, None if recordedStep() else engine.changedRows())
+        return
+    recordState(cells, time - 2)
+    if colonyGrid is not None: # after the record, so its checkpoint holds the grid the recorded cells were sampled from
+        colonyGrid.step(cells, tickTime)
+    if speciesInteg is not None:
+        stepSpecies(cells)
     time2 = (time/10) 
-    print('time = ' + str(time))
-    print('time2 = ' + str(time2)) 
+    debug('time = %s', time)
+    debug('time2 = %s', time2) 
     
     # Celltypes: 0=germ_EB, 1=RBr, 2=RBi, 3=IBr, 4=IBe, 5=EB
 
+    before = [cell.cellType for cell in cells.values()] if profiler is not None else None
     for (id, cell) in cells.items():
     
         if time >= cell.germTime[0]:
-            #cell.percentchance[0] = (105/(1 + numpy.exp((1.76663094e+01-time2)*3.77251916e-01)) - 5) #on singlecell LVA counts
-            cell.percentchance[0] = (97.81/(1 + numpy.exp((2.15841312e+01-((time2*cell.growthRate)))*6.77630536e-01)) + 2.19) #on livecell data and early RBe counts, percent chance of RB conversion
-            #cell.percentchance[0] = (96.45042921/(1 + numpy.exp((13.60222209-time2)*1.4553212)) + 1.68390956)#early RBi counts
+            if hazard is None:
+                #cell.percentchance[0] = (105/(1 + numpy.exp((1.76663094e+01-time2)*3.77251916e-01)) - 5) #on singlecell LVA counts
+                cell.percentchance[0] = (97.81/(1 + numpy.exp((2.15841312e+01-((time2*cell.growthRate)))*6.77630536e-01)) + 2.19) #on livecell data and early RBe counts, percent chance of RB conversion
+                #cell.percentchance[0] = (96.45042921/(1 + numpy.exp((13.60222209-time2)*1.4553212)) + 1.68390956)#early RBi counts
+            elif time2.is_integer() and cell.cellType <= 1:
+                cell.percentchance[0] = hazard(time2, cell.growthRate)
         #print('growthRate = ' + str(cell.growthRate))
         #print('percentchance = ' + str(cell.percentchance[0]))
 
@@ -130,7 +447,7 @@ def update(cells): #Iterate through each cell update and flag cells that reach t
             cell.growthRate = 0.0
             if time >= cell.germTime[0]: #Become RBr if time is reached
                 cell.cellType = 1 #RBr
-                cell.growthRate = 1.0 + random.uniform(-0.05,0.05)
+                cell.growthRate = 1.0 + cellUniform(cell, cr.GROWTH, -0.05,0.05)
                 
         if cell.cellType == 1: #RBr
             pr0 = 0.0 #RNA production rate of ectExp
@@ -153,12 +470,12 @@ def update(cells): #Iterate through each cell update and flag cells that reach t
             cell.color = [[1/cell.geneamt[1], 1, 1/cell.geneamt[1]]]
             #print('growthRate = ' + str(cell.growthRate))
             #print('percentchance = ' + str(cell.percentchance[0]))
-            print('RBi Trigger Value = ' + str(cell.percentchance[1]))
-            print('time2 = ' + str(time2))
+            debug('RBi Trigger Value = %s', cell.percentchance[1])
+            debug('time2 = %s', time2)
             
-            if time2.is_integer() and random.uniform(0,100) <= cell.percentchance[0]: # time2.is_integer() and  RBr to RBe. species[0] = magic Rbr>RBe signal
+            if time2.is_integer() and cellUniform(cell, cr.CONVERSION, 0,100) <= cell.percentchance[0]: # time2.is_integer() and  RBr to RBe. species[0] = magic Rbr>RBe signal
                 #print('time2 is int' + str(time2))
-                print('im an RBi')
+                debug('im an RBi')
                 cell.cellType = 2 #RBi conversion
                 cell.color = [[1/cell.geneamt[1], 1, 1/cell.geneamt[1]]] # color magic, fix
         
@@ -277,7 +594,162 @@ def update(cells): #Iterate through each cell update and flag cells that reach t
             cell.geneamt[4] = cell.geneamt[4] + (p4 * cell.rnaamt[4] * cell.parentGrowth[0]) - (n4 * cell.geneamt[4]) #hctB protein
             
             cell.color = [2.0, 0.0, 0.5]
+    if profiler is not None:
+        profiler.cells(before, [cell.cellType for cell in cells.values()])
             
+def germination(eng, germinating=None):
+    # Start of every vectorised step: conversion curve, division flags and EB germination.
+    # Draws are made for germinating cells and then RBr conversion in cell order, as in the
+    # per-cell loop. germinating, from the TransitionScheduler, marks the cells due to
+    # germinate; without it every cell is tested against germTime. Returns the RBr cells that convert to RBi this step.
+    time2 = (time/10)
+    ct = eng.cellType
+    g = eng.growthRate
+
+    germ = time >= eng.germTime
+    if hazard is None:
+        eng.percentchance[germ] = (params['pcMax']/(1 + numpy.exp((params['pcMid']-((time2*g[germ])))*params['pcSlope'])) + params['pcBase'])
+    elif time2.is_integer():
+        due = germ & (ct <= 1) # the RBrs after germination below, which make a conversion draw
+        eng.percentchance[due] = hazard(time2, g[due])
+
+    eng.divideFlag[eng.volume > eng.targetVol] = True
+
+    #germinating EB>RB
+    geb = ct == 0
+    eng.divideFlag[geb] = False
+    g[geb] = 0.0
+    germinate = geb & (germ if germinating is None else germinating)
+    ct[germinate] = 1 #RBr
+
+    rbr = ct == 1
+    trigger = rbr if time2.is_integer() else numpy.zeros_like(rbr)
+    if cellRandom is None:
+        germDraw, convDraw = eng.uniformDraws((germinate, -0.05, 0.05), (trigger, 0, 100))
+    else:
+        germDraw = cellRandom.uniform(eng.ids, time, cr.GROWTH, -0.05, 0.05, germinate)
+        convDraw = cellRandom.uniform(eng.ids, time, cr.CONVERSION, 0, 100, trigger)
+    g[germinate] = 1.0 + germDraw[germinate]
+    return trigger & (convDraw <= eng.percentchance)
+
+def updateEngine(eng):
+    # Vectorised form of the per-cell loop in update(): every cell of a type is advanced
+    # with one array operation on its rows, in the same order and with the same rates as the
+    # loop. The rows of a type are found once per block, so an operation costs its cells,
+    # not the whole population (an Ensemble's engine holds every replicate).
+    # With clExpression the kernel does the kinetics and only the cell type switching runs here
+    kinetics = not clExpression
+    ct = eng.cellType
+    g = eng.growthRate
+    pg = eng.parentGrowth
+    rna = eng.rnaamt
+    gene = eng.geneamt
+
+    pr1 = params['pr1'] #RNA production rate of Euo
+    nr1 = params['nr1'] #RNA degredation rate of Euo
+    p1 = params['p1']  #protein production rate of Euo
+    n1 = params['n1'] #protein degredation rate of Euo
+
+    pr2 = params['pr2'] #RNA production rate of HctA
+    nr2 = params['nr2'] #RNA degredation rate of HctA
+    p2 = params['p2']  #protein production rate of HctA
+    n2 = params['n2'] #protein degredation rate of HctA
+
+    pr3 = params['pr3'] #RNA production rate of CtcB
+    nr3 = params['nr3'] #RNA degredation rate of CtcB
+    p3 = params['p3']  #protein production rate of CtcB
+    n3 = params['n3'] #protein degredation rate of CtcB
+
+    pr4 = params['pr4'] #RNA production rate of HctB
+    nr4 = params['nr4'] #RNA degredation rate of HctB
+    p4 = params['p4']  #protein production rate of HctB
+    n4 = params['n4'] #protein degredation rate of HctB
+
+    # ectExp rates are all 0.0 in every cell type, so channel 0 is never advanced here
+
+    def euoStep(m, rate):
+        if not kinetics:
+            return
+        rna[m,1] = rna[m,1] + (pr1 * rate) - (nr1 * rna[m,1]) #Euo RNA
+        gene[m,1] = gene[m,1] + (p1 * rna[m,1] * rate) - (n1 * gene[m,1]) #Euo protein
+
+    def hctBStep(m):
+        if not kinetics:
+            return
+        rna[m,4] = rna[m,4] + (pr4 * pg[m]) - (nr4 * rna[m,4]) #hctB RNA
+        gene[m,4] = gene[m,4] + (p4 * rna[m,4] * pg[m]) - (n4 * gene[m,4]) #HctB protein
+
+    rbi = numpy.nonzero(germination(eng))[0]
+
+    #RBr
+    rbr = numpy.nonzero(ct == 1)[0]
+    euoStep(rbr, g[rbr])
+    with numpy.errstate(divide='ignore'):
+        eng.setColor(rbr, 1/gene[:,1], 1, 1/gene[:,1])
+    ct[rbi] = 2 #RBi conversion
+
+    #RBi
+    rbi = numpy.nonzero(ct == 2)[0]
+    euoStep(rbi, g[rbi])
+
+    #IBr, high Euo blocks expression of HctA and CtcB
+    ibr = numpy.nonzero(ct == 3)[0]
+    euoStep(ibr, pg[ibr])
+    on = numpy.where(gene[ibr,1] > params['euoBlock'], 0.0, 1.0)
+    p = pg[ibr]
+    if kinetics:
+        rna[ibr,2] = rna[ibr,2] + (on * pr2 * p) - (on * nr2 * rna[ibr,2]) #hctA RNA
+        gene[ibr,2] = gene[ibr,2] + (on * p2 * rna[ibr,2] * p) - (on * n2 * gene[ibr,2]) #hctA
+        rna[ibr,3] = rna[ibr,3] + (on * pr3 * p) - (on * nr3 * rna[ibr,3]) #ctcB RNA
+        gene[ibr,3] = gene[ibr,3] + (on * p3 * rna[ibr,3] * p) - (on * n3 * gene[ibr,3]) #CtcB protein
+    eng.setColor(ibr, 0, 0, gene[:,2]/100)
+    ct[ibr[gene[ibr,3] >= params['ctcBSwitch']]] = 4 #IBe
+
+    #IBe
+    ibe = numpy.nonzero(ct == 4)[0]
+    if kinetics:
+        gene[ibe,2] = gene[ibe,2] - (n2 * gene[ibe,2]) #HctA protein deg
+        gene[ibe,3] = gene[ibe,3] - (n3 * gene[ibe,3]) #CtcB protein deg
+    hctBStep(ibe)
+    eng.setColor(ibe, 0, 0, gene[:,4]/100)
+    ct[ibe[gene[ibe,4] >= params['hctBSwitch']]] = 5 #EB
+
+    #EB
+    eb = numpy.nonzero(ct == 5)[0]
+    hctBStep(eb)
+    eng.setColor(eb, 2.0, 0.0, 0.5, FLAT_COLOR)
+
+def updateNetwork(eng):
+    # updateEngine() driven by the compiled networkSpec: the type blocks in order, a cell that
+    # converts or crosses a threshold running the blocks of its new types in the same step
+    ct = eng.cellType
+    due = None
+    if sched is not None:
+        sched.track(eng, time)
+        due = numpy.zeros(len(ct), dtype=bool)
+        due[sched.due(eng, time)] = True
+    rbi = germination(eng, due)
+    parked = numpy.isin(ct, fastForwardTypes)
+    moved = grn.update(eng, ~parked, due, [(rbi, 2)]) #RBi conversion
+    eng.lastStep[~parked] = time
+    if sched is not None:
+        sched.schedule(eng, numpy.nonzero(due | moved)[0], time + 1)
+    if (time - 1) % outputSteps == 0:
+        kin.catchUp(eng, time) # parked cells, for the state the next pickle, column record or checkpoint holds
+    setColors(eng)
+
+def setColors(eng):
+    # Colors from the type and levels a cell ends the step with
+    if not eng.colors:
+        return # painted on the recorded steps (ExpressionEngine.paint()), or never in an Ensemble
+    ct = eng.cellType
+    gene = eng.geneamt
+    with numpy.errstate(divide='ignore'):
+        eng.setColor((ct == 1) | (ct == 2), 1/gene[:,1], 1, 1/gene[:,1])
+    eng.setColor(ct == 3, 0, 0, gene[:,2]/100)
+    eng.setColor(ct == 4, 0, 0, gene[:,4]/100)
+    eng.setColor(ct == 5, 2.0, 0.0, 0.5, FLAT_COLOR)
+
 def divide(parent, d1, d2):
     # Specify target cell size that triggers cell division
     # Celltype1=RBr, Celltype2=RBi, Celltype3=IBr, Celltype4=IBe, Celltype5=mature EB
@@ -285,11 +757,11 @@ def divide(parent, d1, d2):
     if parent.cellType == 1: # If RBr: make 2RBrs
         d1.cellType = 1
         d1.targetVol = 2 #* numpy.random.normal(1, 0.05)
-        d1.growthRate = parent.growthRate * numpy.random.normal(1, 0.05)
+        d1.growthRate = parent.growthRate * cellNormal(d1, cr.DIVISION, 1, 0.05)
         
         d2.cellType = 1
         d2.targetVol = 2 #* numpy.random.normal(1, 0.05)
-        d2.growthRate = parent.growthRate * numpy.random.normal(1, 0.05)
+        d2.growthRate = parent.growthRate * cellNormal(d2, cr.DIVISION, 1, 0.05)
         
         d1.geneamt[0] = parent.geneamt[0]/2
         d2.geneamt[0] = parent.geneamt[0]/2
@@ -299,7 +771,7 @@ def divide(parent, d1, d2):
     if parent.cellType == 2: # If RBi: make 1RBi, 1IBe
         d1.cellType = 2
         d1.targetVol = 2 #* numpy.random.normal(1, 0.05)
-        d1.growthRate = parent.growthRate * numpy.random.normal(1, 0.05)
+        d1.growthRate = parent.growthRate * cellNormal(d1, cr.DIVISION, 1, 0.05)
         
         d2.cellType = 3
         d2.growthRate = 0
@@ -311,6 +783,51 @@ def divide(parent, d1, d2):
         d1.geneamt[1] = parent.geneamt[1]/2
         d2.geneamt[1] = parent.geneamt[1]/2 
         
+    if clExpression: # protein levels live in species when the kernel runs the kinetics
+        d1.species[GENE:GENE+2] = d1.geneamt[0:2]
+        d2.species[GENE:GENE+2] = d2.geneamt[0:2]
+
+    if lineage is not None:
+        lineage.record(time - 1, parent.id, d1.id, d2.id, parent.cellType, d1.cellType, d2.cellType)
+
+def divideEngine(eng, d1, d2):
+    # Vectorised divide() for an Ensemble. d1 and d2 are the rows of each parent's two
+    # daughters, which start as copies of the parent as in CellModeller. Draws are made
+    # per parent, d1 then d2, in the order divide() makes them.
+    ct = eng.cellType[d1].copy()
+    growth = eng.growthRate[d1].copy()
+    rbr = ct == 1
+    rbi = ct == 2
+    first = numpy.zeros(len(eng), dtype=bool)
+    second = numpy.zeros(len(eng), dtype=bool)
+    first[d1[rbr | rbi]] = True
+    second[d2[rbr]] = True
+    if cellRandom is None:
+        n1, n2 = eng.normalDraws((first, 1, 0.05), (second, 1, 0.05))
+    else:
+        n1 = cellRandom.normal(eng.ids, time, cr.DIVISION, 1, 0.05, first)
+        n2 = cellRandom.normal(eng.ids, time, cr.DIVISION, 1, 0.05, second)
+
+    # RBr: make 2 RBrs
+    eng.cellType[d1[rbr]] = 1
+    eng.targetVol[d1[rbr]] = 2
+    eng.growthRate[d1[rbr]] = growth[rbr] * n1[d1[rbr]]
+    eng.cellType[d2[rbr]] = 1
+    eng.targetVol[d2[rbr]] = 2
+    eng.growthRate[d2[rbr]] = growth[rbr] * n2[d2[rbr]]
+
+    # RBi: make 1 RBi, 1 IBe
+    eng.cellType[d1[rbi]] = 2
+    eng.targetVol[d1[rbi]] = 2
+    eng.growthRate[d1[rbi]] = growth[rbi] * n1[d1[rbi]]
+    eng.cellType[d2[rbi]] = 3
+    eng.growthRate[d2[rbi]] = 0
+    eng.parentGrowth[d2[rbi]] = growth[rbi]
+    eng.targetVol[d2[rbi]] = 10
+
+    split = numpy.concatenate([d1[rbr | rbi], d2[rbr | rbi]])
+    eng.geneamt[split, 0:2] = eng.geneamt[split, 0:2]/2
+
     #print('d1.percentchance[1] =' + str(d1.percentchance[1]))
     #print('d2.percentchance[1] =' + str(d2.percentchance[1]))         
 
@@ -0,0 +1,164 @@
+import os
+import re
+import glob
+import json
+import pickle
+import hashlib
+import concurrent.futures
+import numpy
+import pandas
+from ColumnStore import ColumnReader
+
+# Loader for the analysis notebooks: reads whole run directories into one tidy frame.
+#
+#   import RunLoader
+#   runs = RunLoader.runDirs('data/Asym-production-E-euo-washout-22-04-10-14-*')
+#   df_typespec3 = RunLoader.cells(runs, ['cellType', 'geneamt'])  # one row per cell per step
+#   df1 = RunLoader.counts(runs, first=['geneamt'])                # one row per step
+#
+# A run is read from its columns.npz (ColumnStore.py) when it has one and the fields are
+# there, otherwise from its step-N.pickle files, which are unpickled in parallel worker
+# processes. Each file becomes a set of columns (step, cell_id and the fields, vector fields
+# split into field0, field1, ...) and a run is one concatenation of them, no row-by-row
+# appends. The parsed run is cached in cacheDir under a hash of its file paths, mtimes and
+# the fields read, so reopening the notebook only reads runs that changed.
+
+typeNames = ['init', 'RBr', 'RBe', 'IB', 'pEB', 'mEB', 'AB_RB', 'AB_IB'] # the notebook's count columns
+
+def stepOf(path):
+    match = re.search(r'step-(\d+)\.pickle$', path)
+    return int(match.group(1)) if match else None
+
+def runDirs(pattern):
+    return sorted(path for path in glob.glob(pattern) if os.path.isdir(path))
+
+def stepFiles(run):
+    files = [path for path in glob.glob(os.path.join(run, 'step-*.pickle')) if stepOf(path) is not None]
+    return sorted(files, key=stepOf)
+
+def readPickle(path, fields):
+    # Columns of one step pickle: step, cell_id and each field as an (n,) or (n, k) array
+    with open(path, 'rb') as f:
+        cellStates = pickle.load(f)['cellStates']
+    cells = list(cellStates.values())
+    columns = {'step': numpy.full(len(cells), stepOf(path), dtype=numpy.int64),
+               'cell_id': numpy.array([cell.id for cell in cells], dtype=numpy.int64)}
+    for field in fields:
+        values = numpy.array([getattr(cell, field) for cell in cells])
+        columns[field] = values.reshape(len(cells), -1) if values.ndim > 1 else values
+    return columns
+
+def readColumns(path, fields):
+    # The same columns for every recorded step of a columns.npz, None if a field is not in it
+    reader = ColumnReader(path)
+    if any(field not in reader.fields for field in fields):
+        reader.close()
+        return None
+    columns = {'step': numpy.repeat(reader.steps, reader.sizes), 'cell_id': reader.flat('id')}
+    for field in fields:
+        columns[field] = reader.flat(field)
+    reader.close()
+    return columns
+
+def concatenate(parts, fields):
+    if not parts:
+        return {name: numpy.zeros(0) for name in ['step', 'cell_id'] + list(fields)}
+    return {name: numpy.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+class RunLoader:
+
+    def __init__(self, cacheDir='analysis-cache', workers=None):
+        self.cacheDir = cacheDir
+        self.workers = workers
+
+    def files(self, run):
+        columns = os.path.join(run, 'columns.npz')
+        return stepFiles(run) + ([columns] if os.path.exists(columns) else [])
+
+    def key(self, run, fields):
+        stamp = [(os.path.abspath(path), os.path.getmtime(path)) for path in self.files(run)]
+        settings = {'run': os.path.abspath(run), 'files': stamp, 'fields': list(fields)}
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def load(self, runs, fields):
+        # {run: columns} for every run, parsing only the runs not in the cache
+        fields = list(fields)
+        loaded = {}
+        missing = []
+        for run in runs:
+            path = os.path.join(self.cacheDir, self.key(run, fields) + '.npz')
+            if os.path.exists(path):
+                with numpy.load(path) as data:
+                    loaded[run] = {name: data[name] for name in data.files}
+            else:
+                missing.append(run)
+        pickled = [] # (run, step file) of the runs without usable columns
+        for run in missing:
+            columns = None
+            if os.path.exists(os.path.join(run, 'columns.npz')):
+                columns = readColumns(os.path.join(run, 'columns.npz'), fields)
+            if columns is None:
+                pickled += [(run, path) for path in stepFiles(run)]
+            else:
+                loaded[run] = columns
+        if pickled:
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+                parts = pool.map(readPickle, [path for (run, path) in pickled], [fields] * len(pickled), chunksize=8)
+                byRun = {}
+                for ((run, path), part) in zip(pickled, parts):
+                    byRun.setdefault(run, []).append(part)
+            for run in missing:
+                if run not in loaded:
+                    loaded[run] = concatenate(byRun.get(run, []), fields)
+        for run in missing:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            path = os.path.join(self.cacheDir, self.key(run, fields) + '.npz')
+            numpy.savez(path + '.tmp.npz', **loaded[run])
+            os.replace(path + '.tmp.npz', path)
+        return {run: loaded[run] for run in runs}
+
+    def cells(self, runs, fields=('cellType', 'geneamt')):
+        # One row per cell per step: sim, time, cell_id and the fields
+        frames = []
+        for (run, columns) in self.load(runs, fields).items():
+            frame = {'sim': os.path.basename(os.path.normpath(run)), 'time': columns['step'],
+                     'cell_id': columns['cell_id']}
+            for field in fields:
+                values = columns[field]
+                if values.ndim > 1:
+                    for k in range(values.shape[1]):
+                        frame['%s%d' % (field, k)] = values[:, k]
+                else:
+                    frame[field] = values
+            frames.append(pandas.DataFrame(frame))
+        return pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()
+
+    def counts(self, runs, nTypes=8, first=()):
+        # One row per step: sim, time, the cells of each type (typeNames) and, for each field
+        # in first, its value in the first cell of the step as the notebook's df1 has it
+        fields = ['cellType'] + [field for field in first if field != 'cellType']
+        frames = []
+        for (run, columns) in self.load(runs, fields).items():
+            steps, start, index = numpy.unique(columns['step'], return_index=True, return_inverse=True)
+            flat = numpy.bincount(index * nTypes + columns['cellType'].astype(numpy.int64),
+                                  minlength=len(steps) * nTypes).reshape(len(steps), nTypes)
+            names = typeNames[:nTypes] + ['type%d' % k for k in range(len(typeNames), nTypes)]
+            frame = {'sim': os.path.basename(os.path.normpath(run)), 'time': steps}
+            for (k, name) in enumerate(names):
+                frame[name] = flat[:, k]
+            for field in first:
+                values = columns[field][start]
+                if values.ndim > 1:
+                    for k in range(values.shape[1]):
+                        frame['%s%d' % (field, k)] = values[:, k]
+                else:
+                    frame[field] = values
+            frames.append(pandas.DataFrame(frame))
+        return pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()
+
+# Module-level shortcuts with the default cache
+def cells(runs, fields=('cellType', 'geneamt'), cacheDir='analysis-cache', workers=None):
+    return RunLoader(cacheDir, workers).cells(runs, fields)
+
+def counts(runs, nTypes=8, first=(), cacheDir='analysis-cache', workers=None):
+    return RunLoader(cacheDir, workers).counts(runs, nTypes, first)
@@ -0,0 +1,145 @@
+import numpy
+
+# Species integration on the host with error control per cell, for models that give their
+# specRateCL() a NumPy twin (specRate):
+#
+#   speciesInteg = AdaptiveIntegrator(specRate, rtol=1e-4, atol=1e-6)
+#   species = speciesInteg.step(species, dt, cellType=cellType) # (n, nSpecies) over one sim step
+#   debug.write(speciesInteg.report())                          # the sub-steps taken, for the run log
+#
+# specRate(species, **params) returns the rates of an (m, nSpecies) block of cells; params
+# are per-cell arrays (cellType, ...) and are sliced along with the cells.
+#
+# Every cell crosses dt in its own sub-steps. The first is the whole of dt for cells near
+# steady state, which then take one step, and otherwise short enough to move the cell by
+# about rtol**(1/3) of its scale (as ode23 starts): on a linear species the error estimate
+# of the pair is -y*z**3*(1 + z)/48, with z = h*rate, so it vanishes at z = -1 and a first
+# step too long to resolve anything could be accepted. A sub-step is accepted when its error estimate is within
+# atol + rtol*|y| in every species; the next one is scaled from the error (between 1/5 and 5
+# times). The explicit sub-step is the Bogacki-Shampine 3(2) pair. A cell whose step is
+# rejected while h times its stiffness estimate (|f(y1) - f(y')| / |y1 - y'|, from the
+# last two stages, after Hairer) is beyond the stability limit of the pair is stiff: it
+# finishes dt with ROS2, the 2-stage L-stable Rosenbrock method, with linearly implicit
+# Euler as the error estimate and a finite-difference Jacobian. So the small steps are
+# taken only by the cells that need them, and only where accuracy needs them.
+#
+# report() gives, since the last report: cells, sub-steps per cell, the smallest, median and
+# largest sub-step, rejected sub-steps, stiff cells and rate evaluations per cell.
+
+stabilityLimit = 2.5 # of the Bogacki-Shampine pair along the negative real axis
+gamma = 1 + 1 / numpy.sqrt(2) # ROS2
+
+class AdaptiveIntegrator:
+
+    def __init__(self, rate, rtol=1e-4, atol=1e-6, maxSubsteps=10000):
+        self.rate = rate
+        self.rtol = rtol
+        self.atol = atol
+        self.maxSubsteps = maxSubsteps
+        self.clear()
+
+    def clear(self):
+        self.cells = 0
+        self.steps = []
+        self.rejected = 0
+        self.stiff = 0
+        self.evaluations = 0
+
+    def f(self, y, params, rows):
+        self.evaluations += len(rows)
+        return self.rate(y, **{name: value[rows] for (name, value) in params.items()})
+
+    def error(self, y, yNew, estimate):
+        scale = self.atol + self.rtol * numpy.maximum(numpy.abs(y), numpy.abs(yNew))
+        return numpy.max(numpy.abs(estimate) / scale, axis=1)
+
+    def explicit(self, y, h, params, rows):
+        # Bogacki-Shampine: (3rd order y, error, stiffness estimate)
+        k1 = self.f(y, params, rows)
+        k2 = self.f(y + h * (k1 / 2), params, rows)
+        y3 = y + h * (0.75 * k2)
+        k3 = self.f(y3, params, rows)
+        yNew = y + h * (2/9 * k1 + 1/3 * k2 + 4/9 * k3)
+        k4 = self.f(yNew, params, rows)
+        estimate = h * (-5/72 * k1 + 1/12 * k2 + 1/9 * k3 - 1/8 * k4)
+        distance = numpy.linalg.norm(yNew - y3, axis=1)
+        stiffness = numpy.linalg.norm(k4 - k3, axis=1) / numpy.maximum(distance, 1e-300)
+        return (yNew, self.error(y, yNew, estimate), stiffness)
+
+    def jacobian(self, y, fy, params, rows):
+        n = y.shape[1]
+        jac = numpy.empty((len(y), n, n))
+        for j in range(n):
+            delta = 1.5e-8 * numpy.maximum(numpy.abs(y[:, j]), 1.0)
+            shifted = y.copy()
+            shifted[:, j] += delta
+            jac[:, :, j] = (self.f(shifted, params, rows) - fy) / delta[:, None]
+        return jac
+
+    def rosenbrock(self, y, h, params, rows):
+        # ROS2: (2nd order y, error against linearly implicit Euler)
+        fy = self.f(y, params, rows)
+        w = numpy.eye(y.shape[1]) - (gamma * h)[:, :, None] * self.jacobian(y, fy, params, rows)
+        k1 = numpy.linalg.solve(w, fy[:, :, None])[:, :, 0]
+        k2 = numpy.linalg.solve(w, (self.f(y + h * k1, params, rows) - 2 * k1)[:, :, None])[:, :, 0]
+        yNew = y + h * (1.5 * k1 + 0.5 * k2)
+        return (yNew, self.error(y, yNew, h * 0.5 * (k1 + k2)))
+
+    def firstStep(self, y, dt, params):
+        # dt, or less where rate/scale says the species move by more than 0.8 rtol**(1/3) in it
+        scale = numpy.maximum(numpy.abs(y), self.atol / self.rtol)
+        speed = numpy.max(numpy.abs(self.f(y, params, numpy.arange(len(y)))) / scale, axis=1, initial=0.0)
+        return numpy.minimum(float(dt), 0.8 * self.rtol**(1/3) / numpy.maximum(speed, 1e-300))
+
+    def step(self, species, dt, **params):
+        y = numpy.array(species, dtype=float)
+        n = len(y)
+        params = {name: numpy.asarray(value) for (name, value) in params.items()}
+        t = numpy.zeros(n)
+        h = self.firstStep(y, dt, params)
+        stiff = numpy.zeros(n, dtype=bool)
+        taken = numpy.zeros(n, dtype=numpy.int64)
+        while True:
+            rows = numpy.nonzero(t < dt * (1 - 1e-12))[0]
+            if len(rows) == 0:
+                break
+            if taken[rows].max() >= self.maxSubsteps:
+                raise RuntimeError('species of %d cells need more than %d sub-steps in a step of %g'
+                                   % (numpy.count_nonzero(taken[rows] >= self.maxSubsteps), self.maxSubsteps, dt))
+            hh = numpy.minimum(h[rows], dt - t[rows])
+            yNew = numpy.empty((len(rows), y.shape[1]))
+            err = numpy.empty(len(rows))
+            implicit = stiff[rows]
+            switch = numpy.zeros(len(rows), dtype=bool)
+            if not implicit.all():
+                part = ~implicit
+                (yNew[part], err[part], stiffness) = self.explicit(y[rows[part]], hh[part, None], params, rows[part])
+                switch[part] = (err[part] > 1) & (hh[part] * stiffness > stabilityLimit)
+                stiff[rows[switch]] = True
+                self.stiff += int(numpy.count_nonzero(switch))
+            if implicit.any():
+                (yNew[implicit], err[implicit]) = self.rosenbrock(y[rows[implicit]], hh[implicit, None], params, rows[implicit])
+            accept = err <= 1
+            done = rows[accept]
+            y[done] = yNew[accept]
+            t[done] += hh[accept]
+            taken[done] += 1
+            self.steps.append(hh[accept])
+            self.rejected += int(numpy.count_nonzero(~accept))
+            order = numpy.where(stiff[rows], 2.0, 3.0) # of the method the error estimate scales with
+            factor = numpy.clip(0.9 * numpy.maximum(err, 1e-10)**(-1 / order), 0.2, 5.0)
+            h[rows] = numpy.where(switch, hh, hh * factor) # a cell turned stiff tries its step again with ROS2
+        self.cells += n
+        return y
+
+    def report(self):
+        # One line on the sub-steps since the last report, then start counting again
+        steps = numpy.concatenate(self.steps) if self.steps else numpy.zeros(0)
+        if self.cells == 0 or len(steps) == 0:
+            line = 'species: no cells integrated'
+        else:
+            line = ('species: %d cells, %.3g sub-steps/cell, h min %.3g median %.3g max %.3g, %d rejected, '
+                    '%d stiff, %.3g rates/cell' % (self.cells, len(steps) / self.cells, steps.min(), numpy.median(steps),
+                                                   steps.max(), self.rejected, self.stiff, self.evaluations / self.cells))
+        self.clear()
+        return line
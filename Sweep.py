@@ -0,0 +1,184 @@
+import os
+import ast
+import json
+import hashlib
+import itertools
+import concurrent.futures
+import numpy
+from Ensemble import Ensemble
+
+# Parameter sweeps over the named constants in a model's params dict.
+#
+#   sweep = Sweep('Asym-production-E-euo-washout.py', {'pr1': (0.01, 0.04), 'euoSwitch': (0.4, 0.8)},
+#                 replicates=100, steps=600)
+#   points = sweep.latinHypercube(64)      # or sweep.grid(5), sweep.morris(10)
+#   results = sweep.run(points, workers=8) # [{'mean': (steps, nTypes), 'std': ...}, ...]
+#
+# Each point is run as an Ensemble of replicates (physics-free) in a process pool, all
+# points with the same seed so they see the same random streams. The per-type mean and std
+# count curves of a point are cached in cacheDir under a hash of the point, the run settings
+# and the model version (the source of the model file, Ensemble.py and every module of the
+# model's folder they import, directly or through each other), so a sweep that overlaps an earlier one only runs the new points and editing the model
+# invalidates the cache.
+#
+# For a Morris design, sweep.sensitivity(results) gives the elementary effect summary
+# (mu*, sigma) of each parameter on a scalar or vector metric of the curves, by default the
+# final mean count of every cell type.
+
+def localModules(paths):
+    # The files of paths and of the modules next to them that they import, at any depth and
+    # wherever the import statement is (a function body included), in a fixed order
+    found = []
+    pending = [os.path.abspath(path) for path in paths]
+    while pending:
+        path = pending.pop(0)
+        if path in found or not os.path.exists(path):
+            continue
+        found.append(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        folder = os.path.dirname(path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            pending += [os.path.join(folder, name.split('.')[0] + '.py') for name in names]
+    return found
+
+def runPoint(model, point, replicates, steps, seed, flags):
+    counts = Ensemble(model, replicates, seed=seed, params=point, **flags).run(steps)
+    return (counts.mean(axis=1), counts.std(axis=1))
+
+def finalCounts(result):
+    return result['mean'][-1]
+
+class Sweep:
+
+    def __init__(self, model, ranges, replicates=100, steps=600, seed=1, cacheDir='sweep-cache', flags=None):
+        self.model = model
+        self.ranges = {name: (float(low), float(high)) for (name, (low, high)) in ranges.items()}
+        self.names = sorted(self.ranges)
+        self.replicates = replicates
+        self.steps = steps
+        self.seed = seed
+        self.cacheDir = cacheDir
+        self.flags = dict(flags or {})
+        self.version = self.modelVersion()
+        self.trajectories = None # (point indices, parameter order) of each Morris trajectory
+
+    def modelVersion(self):
+        digest = hashlib.sha256()
+        ensemble = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Ensemble.py')
+        for path in localModules([self.model, ensemble]):
+            digest.update(os.path.basename(path).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def key(self, point):
+        settings = {'params': point, 'version': self.version, 'replicates': self.replicates,
+                    'steps': self.steps, 'seed': self.seed, 'flags': self.flags}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def scale(self, unit):
+        # Points from rows of a unit-cube design
+        points = []
+        for row in numpy.atleast_2d(unit):
+            point = {}
+            for (name, u) in zip(self.names, row):
+                low, high = self.ranges[name]
+                point[name] = float(low + u * (high - low))
+            points.append(point)
+        return points
+
+    # Designs
+    def grid(self, levels):
+        axis = numpy.linspace(0, 1, levels)
+        return self.scale(numpy.array(list(itertools.product(axis, repeat=len(self.names)))))
+
+    def latinHypercube(self, n, seed=0):
+        # One point in each of n strata along every parameter, strata paired at random
+        rng = numpy.random.default_rng(seed)
+        unit = numpy.empty((n, len(self.names)))
+        for j in range(len(self.names)):
+            unit[:, j] = (rng.permutation(n) + rng.random(n)) / n
+        return self.scale(unit)
+
+    def morris(self, trajectories, levels=4, seed=0):
+        # Morris one-at-a-time trajectories on a levels grid: each trajectory moves every
+        # parameter once by delta, in random order
+        rng = numpy.random.default_rng(seed)
+        k = len(self.names)
+        delta = levels / (2.0 * (levels - 1))
+        starts = numpy.arange(levels) / (levels - 1)
+        rows = []
+        self.trajectories = []
+        for t in range(trajectories):
+            x = rng.choice(starts[starts + delta <= 1 + 1e-12], size=k)
+            order = rng.permutation(k)
+            indices = [len(rows)]
+            rows.append(x.copy())
+            for j in order:
+                x[j] = x[j] + delta if x[j] + delta <= 1 + 1e-12 else x[j] - delta
+                indices.append(len(rows))
+                rows.append(x.copy())
+            self.trajectories.append((indices, order))
+        self.delta = delta
+        return self.scale(numpy.array(rows))
+
+    # Running
+    def cachePath(self, key):
+        return os.path.join(self.cacheDir, key + '.npz')
+
+    def load(self, point):
+        path = self.cachePath(self.key(point))
+        if not os.path.exists(path):
+            return None
+        with numpy.load(path) as data:
+            return {'params': point, 'mean': data['mean'], 'std': data['std']}
+
+    def store(self, point, mean, std):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        path = self.cachePath(self.key(point))
+        numpy.savez(path + '.tmp.npz', mean=mean, std=std, params=json.dumps(point))
+        os.replace(path + '.tmp.npz', path)
+
+    def run(self, points, workers=None):
+        # Results for every point, in order, running only the points not in the cache
+        results = [self.load(point) for point in points]
+        missing = [i for (i, result) in enumerate(results) if result is None]
+        if missing:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = {pool.submit(runPoint, self.model, points[i], self.replicates, self.steps,
+                                       self.seed, self.flags): i for i in missing}
+                for future in concurrent.futures.as_completed(futures):
+                    i = futures[future]
+                    (mean, std) = future.result()
+                    self.store(points[i], mean, std)
+                    results[i] = {'params': points[i], 'mean': mean, 'std': std}
+        return results
+
+    # Sensitivity
+    def sensitivity(self, results, metric=finalCounts):
+        # Morris summary over the trajectories of the last morris() design: for each
+        # parameter, mu* (mean absolute elementary effect) and sigma (their spread), per
+        # metric output. Effects are per unit of the scaled [0, 1] range.
+        if self.trajectories is None:
+            raise ValueError('sensitivity() needs the results of a morris() design')
+        y = [numpy.atleast_1d(numpy.asarray(metric(result), dtype=float)) for result in results]
+        effects = {name: [] for name in self.names}
+        for (indices, order) in self.trajectories:
+            for (step, j) in enumerate(order):
+                before, after = indices[step], indices[step + 1]
+                moved = results[after]['params'][self.names[j]] - results[before]['params'][self.names[j]]
+                sign = 1.0 if moved > 0 else -1.0
+                effects[self.names[j]].append(sign * (y[after] - y[before]) / self.delta)
+        summary = {}
+        for (name, values) in effects.items():
+            values = numpy.array(values)
+            summary[name] = {'muStar': numpy.abs(values).mean(axis=0), 'mu': values.mean(axis=0),
+                             'sigma': values.std(axis=0)}
+        return summary
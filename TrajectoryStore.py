@@ -0,0 +1,133 @@
+import os
+import json
+import numpy
+from RunLoader import RunLoader
+
+# Per-cell trajectories of many runs, for the analyses the notebook does with pivot_table
+# over string ids.
+#
+#   TrajectoryStore.build('trajectories', RunLoader.runDirs('data/Asym-production-E-euo-washout-*'))
+#   store = TrajectoryStore('trajectories')        # memory-mapped
+#   traj = store.cell(run=0, cid=17)               # {'step', 'cellType', 'rnaamt', 'geneamt'}
+#   rows = store.between(3, 200, 300)              # every IB record from 20 h to 30 h
+#   store.geneamt[rows, 1]                         # their Euo
+#   steps, cells, euo = store.pivot(3, 'geneamt', 1, 200, 300) # steps x cells, nan where absent
+#
+# The records (one per cell per recorded step) are sorted by (run, cell id, step) and kept
+# as one .npy file per field, so the history of a cell is a contiguous slice; cellOf.npy
+# gives the cell of each record. Two indexes sit beside them:
+#   cells.npy    (run, cell id, first row, end row) of every cell, sorted
+#   segments.npy (cellType, first step, last step, first row, end row, cell) of every stretch
+#                of a cell's records with one cellType, sorted by type and first step
+# Files are opened with mmap_mode='r', so a store larger than memory is only paged in where
+# it is read. build() writes them run by run into preallocated memmaps (runs are read, and
+# cached, through RunLoader).
+
+class TrajectoryStore:
+
+    fields = ['step', 'cellType', 'rnaamt', 'geneamt']
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.runs = self.meta['runs']
+        mode = 'r' if mmap else None
+        for name in self.fields + ['cellOf']:
+            setattr(self, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode=mode))
+        self.cells = numpy.load(os.path.join(path, 'cells.npy'))
+        self.segments = numpy.load(os.path.join(path, 'segments.npy'))
+        self.typeStart = numpy.searchsorted(self.segments[:, 0], numpy.arange(self.meta['nTypes'] + 1))
+        self.idSpan = int(self.cells[:, 1].max()) + 1 if len(self.cells) else 1
+        self.cellKey = self.cells[:, 0] * self.idSpan + self.cells[:, 1] # sorted, for rowsOf()
+
+    @classmethod
+    def build(cls, path, runs, loader=None, nTypes=8):
+        loader = loader or RunLoader()
+        fields = ['cellType', 'rnaamt', 'geneamt']
+        sizes = [len(loader.load([run], fields)[run]['step']) for run in runs] # parses and caches each run
+        total = sum(sizes)
+        os.makedirs(path, exist_ok=True)
+        out = {}
+        cells, segments = [], []
+        row = 0
+        nCells = 0
+        for (r, run) in enumerate(runs):
+            columns = loader.load([run], fields)[run]
+            order = numpy.lexsort((columns['step'], columns['cell_id']))
+            step = columns['step'][order]
+            cid = columns['cell_id'][order]
+            cellType = columns['cellType'][order]
+            for (name, values) in [('step', step), ('cellType', cellType),
+                                   ('rnaamt', columns['rnaamt'][order]), ('geneamt', columns['geneamt'][order])]:
+                if name not in out:
+                    out[name] = numpy.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                                             dtype=values.dtype, shape=(total,) + values.shape[1:])
+                out[name][row:row + len(values)] = values
+            n = len(step)
+            # Cells: where the id changes. Segments: where the id or the cellType changes
+            newCell = numpy.concatenate([[True], cid[1:] != cid[:-1]]) if n else numpy.zeros(0, dtype=bool)
+            newSegment = newCell | numpy.concatenate([[False], cellType[1:] != cellType[:-1]]) if n else newCell
+            cellStart = numpy.nonzero(newCell)[0]
+            cellEnd = numpy.append(cellStart[1:], n)
+            segStart = numpy.nonzero(newSegment)[0]
+            segEnd = numpy.append(segStart[1:], n)
+            cellOf = nCells + numpy.cumsum(newCell) - 1 # cell index of each record
+            cells.append(numpy.column_stack([numpy.full(len(cellStart), r), cid[cellStart], row + cellStart, row + cellEnd]))
+            segments.append(numpy.column_stack([cellType[segStart], step[segStart], step[segEnd - 1],
+                                                row + segStart, row + segEnd, cellOf[segStart]]))
+            if 'cellOf' not in out:
+                out['cellOf'] = numpy.lib.format.open_memmap(os.path.join(path, 'cellOf.npy'), mode='w+',
+                                                             dtype=numpy.int64, shape=(total,))
+            out['cellOf'][row:row + n] = cellOf
+            row += n
+            nCells += len(cellStart)
+        for array in out.values():
+            array.flush()
+        cells = numpy.concatenate(cells).astype(numpy.int64) if cells else numpy.zeros((0, 4), dtype=numpy.int64)
+        segments = numpy.concatenate(segments).astype(numpy.int64) if segments else numpy.zeros((0, 6), dtype=numpy.int64)
+        segments = segments[numpy.lexsort((segments[:, 1], segments[:, 0]))]
+        numpy.save(os.path.join(path, 'cells.npy'), cells)
+        numpy.save(os.path.join(path, 'segments.npy'), segments)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'runs': [os.path.basename(os.path.normpath(run)) for run in runs], 'nTypes': nTypes,
+                       'records': total}, f, indent=1)
+        return cls(path)
+
+    def rowsOf(self, run, cid):
+        # Slice of the records of one cell (run index or name)
+        if not isinstance(run, (int, numpy.integer)):
+            run = self.runs.index(run)
+        key = numpy.searchsorted(self.cellKey, run * self.idSpan + cid)
+        if cid >= self.idSpan or key == len(self.cells) or self.cellKey[key] != run * self.idSpan + cid:
+            raise KeyError('no cell %d in run %s' % (cid, self.runs[run]))
+        return slice(int(self.cells[key, 2]), int(self.cells[key, 3]))
+
+    def cell(self, run, cid):
+        rows = self.rowsOf(run, cid)
+        return {name: numpy.asarray(getattr(self, name)[rows]) for name in self.fields}
+
+    def spans(self, cellType, start, end):
+        # Segments of cellType that overlap steps [start, end]
+        segments = self.segments[self.typeStart[cellType]:self.typeStart[cellType + 1]]
+        segments = segments[:numpy.searchsorted(segments[:, 1], end, side='right')]
+        return segments[segments[:, 2] >= start]
+
+    def between(self, cellType, start, end):
+        # Rows of the records of cellType at steps start..end, grouped by cell
+        segments = self.spans(cellType, start, end)
+        lengths = segments[:, 4] - segments[:, 3]
+        rows = numpy.repeat(segments[:, 3] - numpy.cumsum(lengths) + lengths, lengths) + numpy.arange(lengths.sum())
+        step = numpy.asarray(self.step[rows]) if len(rows) else numpy.zeros(0, dtype=numpy.int64)
+        return rows[(step >= start) & (step <= end)]
+
+    def pivot(self, cellType, field, channel, start, end):
+        # (steps, cells, values): one column per cell of cellType in steps start..end, one row
+        # per recorded step, nan where the cell was absent or another type. cells are rows of
+        # self.cells
+        rows = self.between(cellType, start, end)
+        steps, stepIndex = numpy.unique(numpy.asarray(self.step[rows]), return_inverse=True)
+        cells, cellIndex = numpy.unique(numpy.asarray(self.cellOf[rows]), return_inverse=True)
+        values = numpy.full((len(steps), len(cells)), numpy.nan)
+        values[stepIndex, cellIndex] = numpy.asarray(getattr(self, field)[rows])[:, channel]
+        return (steps, self.cells[cells], values)
@@ -0,0 +1,167 @@
+import heapq
+import numpy
+
+# Event-driven cell type transitions for the network path.
+#
+# Instead of testing every cell against every threshold each step, a cell's next event is
+# predicted when it enters a regime (a new cell, or a change of type) and kept in a heap
+# keyed by step number. Only cells whose event is due are tested and, if nothing happened
+# (e.g. Euo was pinned by the washout), predicted again. Events are:
+#   - germination of a germinating EB at germTime
+#   - the gene thresholds of GeneNetwork transitions (IB -> pre_EB on Euo, pre_EB -> EB on HctB)
+#   - a regulator crossing K of a step (n = inf) edge into an expressed gene, which changes
+#     the regime the prediction was made for
+# Levels are predicted with LinearKinetics, exact for the linear kinetics between events.
+# Cells whose expressed genes have finite Hill edges are not linear, nor are cells of a type
+# with freezes, and they are polled every step. The due rows are what GeneNetwork.update()
+# tests for transitions.
+#
+# Heap entries are (step, cell id, version); rescheduling a cell bumps its version so older
+# entries are dropped when popped.
+
+class TransitionScheduler:
+
+    def __init__(self, network, kinetics, maxDoublings=20):
+        self.grn = network
+        self.kin = kinetics
+        self.maxDoublings = maxDoublings # predictions look at most 2**maxDoublings steps ahead
+        self.heap = []
+        self.version = {}
+
+        # Step edges (source, target, K) and the (cellType, gene) pairs fed by finite Hill edges
+        grn = network
+        edges = numpy.argwhere(grn.sign != 0)
+        self.stepEdges = [(s, t, grn.K[t, s]) for (t, s) in edges if numpy.isinf(grn.n[t, s])]
+        hillTargets = [t for (t, s) in edges if not numpy.isinf(grn.n[t, s])]
+        self.polled = numpy.zeros(grn.pr.shape[0], dtype=bool)
+        for t in hillTargets:
+            self.polled |= grn.pr[:, t] > 0
+        for (cellType, source, target, K) in grn.freezes:
+            self.polled[cellType] = True
+
+    def track(self, eng, time):
+        # Schedule cells added to the engine since the last step (new daughters, first cells)
+        if len(eng.newRows):
+            self.schedule(eng, eng.newRows, time)
+
+    def due(self, eng, time):
+        # Pop the events due at or before time and return the rows they belong to
+        ids = []
+        while self.heap and self.heap[0][0] <= time:
+            (step, cid, version) = heapq.heappop(self.heap)
+            if self.version.get(cid) == version:
+                ids.append(cid)
+        rows = eng.rowsOf(ids)
+        for cid in numpy.asarray(ids)[rows < 0]:
+            del self.version[int(cid)]
+        return numpy.unique(rows[rows >= 0])
+
+    def schedule(self, eng, rows, now):
+        # Predict the next event of each row. Levels are those after step now-1, so an event
+        # k steps ahead falls on step now-1+k. Gene events are scheduled one step early and
+        # simply re-predicted if the level is not there yet, which absorbs rounding.
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        if len(rows) == 0:
+            return
+        grn = self.grn
+        ct = eng.cellType[rows]
+        never = numpy.iinfo(numpy.int64).max
+        event = numpy.full(len(rows), never, dtype=numpy.int64)
+
+        geb = ct == 0
+        if numpy.any(geb):
+            germ = numpy.ceil(eng.germTime[rows[geb]]).astype(numpy.int64)
+            event[geb] = numpy.maximum(germ, now)
+
+        polled = self.polled[ct]
+        event[polled] = now
+
+        # Candidate crossings as flat (row, gene, threshold, below) columns, predicted together
+        sel, gene, threshold, below = [], [], [], []
+        def candidate(mask, g, level, side):
+            idx = numpy.nonzero(mask)[0]
+            sel.append(idx)
+            gene.append(numpy.full(len(idx), g))
+            threshold.append(numpy.full(len(idx), level, dtype=float))
+            below.append(numpy.full(len(idx), side, dtype=bool))
+        for k in range(len(grn.toType)):
+            candidate((ct == grn.fromType[k]) & ~polled, grn.gene[k], grn.threshold[k], grn.below[k])
+        for (s, t, K) in self.stepEdges:
+            expressed = (grn.pr[ct, t] > 0) & ~polled
+            above = eng.geneamt[rows, s] > K
+            candidate(expressed & above, s, K, True)
+            candidate(expressed & ~above, s, K, False)
+        sel = numpy.concatenate(sel) if sel else numpy.zeros(0, dtype=numpy.int64)
+        if len(sel):
+            k = self.firstCrossing(eng, rows[sel], numpy.concatenate(gene),
+                                   numpy.concatenate(threshold), numpy.concatenate(below))
+            found = k < never
+            early = numpy.maximum(now, now + k[found] - 2)
+            numpy.minimum.at(event, sel[found], early)
+
+        for (cid, step) in zip(eng.ids[rows].tolist(), event.tolist()):
+            version = self.version.get(cid, 0) + 1
+            self.version[cid] = version
+            if step < never:
+                heapq.heappush(self.heap, (step, cid, version))
+
+    def firstCrossing(self, eng, rows, gene, threshold, below):
+        # Smallest k >= 1 after which the level of gene is on the wanted side of threshold,
+        # all given per row (rows may repeat).
+        # Between events a level is a constant plus two geometric terms, which has at most one
+        # turning point, so the steps on the wanted side form one interval. If a power of two
+        # lands in it that bounds the first hit; otherwise the interval can only sit around the
+        # extremum, which is located first. Both searches go down the table of f**(2**j)
+        # (binary lifting), one map product per bit.
+        never = numpy.iinfo(numpy.int64).max
+        kin = self.kin
+        col = numpy.arange(len(rows))
+        f = tuple(x[col, gene][:, None] for x in kin.stepMap(eng, rows))
+        table = kin.doublings(f, self.maxDoublings + 1)
+        horizon = 2**self.maxDoublings
+        rna = eng.rnaamt[rows, gene]
+        level0 = eng.geneamt[rows, gene]
+        sign = numpy.where(below, -1.0, 1.0)
+        target = sign * threshold
+
+        def score(g):
+            # level after map g measured towards the threshold, a hit is score >= target
+            a, c, d, b, e = g
+            return sign * (c[:, 0] * rna + d[:, 0] * level0 + e[:, 0])
+
+        def select(mask, g, h):
+            return tuple(numpy.where(mask[:, None], x, y) for (x, y) in zip(g, h))
+
+        one = numpy.ones_like(f[0])
+        zero = numpy.zeros_like(f[0])
+        identity = (one, zero, one, zero, zero)
+
+        hitSample = numpy.array([score(g) >= target for g in table]) # k = 2**j, shape (j, rows)
+        found = numpy.any(hitSample, axis=0)
+        hi = numpy.where(found, 2**numpy.argmax(hitSample, axis=0), never)
+
+        # No sample hit: find the last step at which the score still rises
+        missed = ~found
+        if numpy.any(missed):
+            peak = numpy.ones(len(rows), dtype=numpy.int64)
+            at, before = f, identity
+            for j in reversed(range(self.maxDoublings + 1)):
+                nextAt = kin.compose(table[j], at)
+                nextBefore = kin.compose(table[j], before)
+                ok = missed & (peak + 2**j <= horizon) & (score(nextAt) > score(nextBefore))
+                peak = numpy.where(ok, peak + 2**j, peak)
+                at = select(ok, nextAt, at)
+                before = select(ok, nextBefore, before)
+            h = missed & (score(at) >= target)
+            hi = numpy.where(h, peak, hi)
+
+        # Last miss below hi, the first hit follows it
+        search = hi < never
+        last = numpy.zeros(len(rows), dtype=numpy.int64)
+        at = identity
+        for j in reversed(range(self.maxDoublings + 1)):
+            nextAt = kin.compose(table[j], at)
+            ok = search & (last + 2**j < hi) & (score(nextAt) < target)
+            last = numpy.where(ok, last + 2**j, last)
+            at = select(ok, nextAt, at)
+        return numpy.where(search, last + 1, never)
@@ -0,0 +1,79 @@
+import numpy
+from CellModeller.Regulation.ModuleRegulator import ModuleRegulator
+
+# Physics-free backend for runs that only need the population curves.
+#
+# WellMixedBiophysics stands in for CLBacterium: there are no contacts, positions or
+# diffusion grid, every cell just grows its volume at growthRate each step and is split
+# in two when the model's update() flags it (volume > targetVol). A model selects it in
+# setup() and keeps its init/update/divide callbacks:
+#
+#   biophys = WellMixedBiophysics(sim)
+#   regul = WellMixedRegulator(sim, nSpecies, nSignals, sim.moduleName)
+#   sim.init(biophys, regul, None, None)
+#
+# Without an integrator CellModeller does not give cells species/signals arrays, so
+# WellMixedRegulator attaches zeroed ones before init() runs. They are not integrated
+# (specRateCL/sigRateCL are not used) and keep the values the callbacks write into them,
+# unless the model integrates the species itself (adaptiveSpecies, SpeciesIntegrator.py).
+# Pickles hold the usual cellStates; pos/dir stay where the first cell was placed.
+
+class WellMixedBiophysics:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.regulator = None
+
+    def setRegulator(self, regulator):
+        self.regulator = regulator
+
+    def addCell(self, cellState, pos=(0,0,0), dir=(1,0,0), length=4.0, rad=0.5, **kwargs):
+        cellState.pos = list(pos)
+        cellState.dir = list(dir)
+        cellState.length = length
+        cellState.radius = rad
+        cellState.volume = length # starting size, in the units targetVol is given in
+        cellState.strainRate = 0.0
+
+    def divide(self, parentState, d1State, d2State, f1=0.5, f2=0.5, **kwargs):
+        # Daughters are deep copies of the parent, only the volume is split
+        volume = parentState.volume
+        d1State.volume = volume * f1 / (f1 + f2)
+        d2State.volume = volume * f2 / (f1 + f2)
+
+    def set_cells(self):
+        pass
+
+    def step(self, dt):
+        # Exponential growth at growthRate, one Euler step per sim step
+        cells = list(self.sim.cellStates.values())
+        volume = numpy.fromiter((cell.volume for cell in cells), dtype=float, count=len(cells))
+        rate = numpy.fromiter((cell.growthRate for cell in cells), dtype=float, count=len(cells))
+        grown = (volume * (1 + rate * dt)).tolist()
+        for (cell, v, r) in zip(cells, grown, rate.tolist()):
+            cell.volume = v
+            cell.strainRate = r
+        return True
+
+    def hasNeighbours(self):
+        return False
+
+    def load_from_cellstates(self, cellStates):
+        pass
+
+    def reset(self):
+        pass
+
+
+class WellMixedRegulator(ModuleRegulator):
+    # ModuleRegulator that gives each new cell the species/signals arrays an integrator would
+
+    def __init__(self, sim, nSpecies, nSignals, modName=None):
+        ModuleRegulator.__init__(self, sim, modName)
+        self.nSpecies = nSpecies
+        self.nSignals = nSignals
+
+    def addCell(self, cellState):
+        cellState.species = numpy.zeros(self.nSpecies)
+        cellState.signals = numpy.zeros(self.nSignals)
+        ModuleRegulator.addCell(self, cellState)
@@ -0,0 +1,73 @@
+import os
+import sys
+import copy
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+from CellState import CellState
+import Benchmark
+from Benchmark import StubSim, modelFiles
+
+# Shared helpers of the tests. Model runs use the well-mixed backend through WellMixedSim, a
+# Benchmark.StubSim that also steps, so they need CellModeller (for ModuleRegulator) but no
+# OpenCL device; the tests that run a model skip without it.
+
+modelPaths = [os.path.join(root, name) for name in modelFiles]
+
+class WellMixedSim(StubSim):
+    # StubSim with Simulator's addCell(), divide(), step() and loadFromPickle(), in its order:
+    # update(), divisions, growth
+
+    def __init__(self, module, dt=0.025):
+        StubSim.__init__(self, module, dt)
+        self.stepNum = 0
+        self.nextId = 0
+
+    def addCell(self, cellType=0, length=3.5, **kwargs):
+        cell = CellState(self.nextId)
+        self.nextId += 1
+        cell.cellType = cellType
+        self.cellStates[cell.id] = cell
+        self.reg.addCell(cell)
+        self.phys.addCell(cell, length=length, **kwargs)
+
+    def divide(self, parent):
+        parent.divideFlag = False
+        d1 = copy.deepcopy(parent)
+        d2 = copy.deepcopy(parent)
+        (d1.id, d2.id) = (self.nextId, self.nextId + 1)
+        self.nextId += 2
+        self.lineage[d1.id] = self.lineage[d2.id] = parent.id
+        self.cellStates[d1.id] = d1
+        self.cellStates[d2.id] = d2
+        del self.cellStates[parent.id]
+        self.reg.divide(parent, d1, d2)
+        self.phys.divide(parent, d1, d2)
+
+    def step(self):
+        self.reg.step(self.dt)
+        for cell in list(self.cellStates.values()):
+            if cell.divideFlag:
+                self.divide(cell)
+        self.phys.set_cells()
+        self.phys.step(self.dt)
+        self.stepNum += 1
+
+    def loadFromPickle(self, data):
+        # The regulator holds on to cellStates, so it is refilled rather than replaced
+        self.cellStates.clear()
+        self.cellStates.update(data['cellStates'])
+        self.lineage = dict(data['lineage'])
+        self.stepNum = data['stepNum']
+        self.nextId = max(self.cellStates) + 1
+
+def loadModel(path, **flags):
+    # A fresh module of the model file, set up on a WellMixedSim with its flags
+    return Benchmark.loadModel(path, flags, WellMixedSim)
+
+def run(sim, steps):
+    for _ in range(steps):
+        sim.step()
+    return sim.cellStates
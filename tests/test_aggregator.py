@@ -0,0 +1,45 @@
+import numpy
+import Aggregator
+from Aggregator import OnlineAggregator
+
+# The per-step summary against the same statistics taken directly over the cells of each type.
+
+def test_summary_matches_direct_statistics(tmp_path):
+    path = str(tmp_path / 'summary.npz')
+    stats = OnlineAggregator(path, nTypes=6, nGenes=3, every=5, saveSteps=2)
+    rng = numpy.random.default_rng(0)
+    kept = {}
+    for step in range(-1, 23):
+        n = int(rng.integers(5, 40))
+        cellType = rng.choice([1, 3, 5], n) # types 0, 2 and 4 have no cells
+        rnaamt = rng.uniform(0, 1, (n, 3))
+        geneamt = rng.uniform(0, 10, (n, 3))
+        final = step == 22
+        stats.record(step, cellType, rnaamt, geneamt, final=final)
+        if step >= 0 and (step % 5 == 0 or final):
+            kept[step] = (cellType, rnaamt, geneamt)
+    stats.close()
+    with numpy.load(path) as data:
+        summary = dict(data)
+    assert summary['steps'].tolist() == [0, 5, 10, 15, 20, 22]
+    for (i, (cellType, rnaamt, geneamt)) in enumerate(kept.values()):
+        assert summary['counts'][i].tolist() == numpy.bincount(cellType, minlength=6).tolist()
+        for t in range(6):
+            cells = cellType == t
+            if not cells.any():
+                assert numpy.all(numpy.isnan(summary['geneMean'][i, t]))
+                continue
+            for (prefix, x) in [('rna', rnaamt), ('gene', geneamt)]:
+                assert numpy.allclose(summary[prefix + 'Mean'][i, t], x[cells].mean(axis=0))
+                assert numpy.allclose(summary[prefix + 'Var'][i, t], x[cells].var(axis=0))
+                assert numpy.array_equal(summary[prefix + 'Min'][i, t], x[cells].min(axis=0))
+                assert numpy.array_equal(summary[prefix + 'Max'][i, t], x[cells].max(axis=0))
+
+def test_close_releases_the_exit_hook(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(Aggregator.atexit, 'register', hooks.append)
+    monkeypatch.setattr(Aggregator.atexit, 'unregister', hooks.remove)
+    stats = OnlineAggregator(str(tmp_path / 'summary.npz'))
+    assert hooks == [stats.close]
+    stats.close()
+    assert hooks == []
@@ -0,0 +1,67 @@
+import json
+import concurrent.futures
+import pytest
+import BatchRunner
+from BatchRunner import closeOutputs
+
+# The runner's bookkeeping: retries, the manifest and closing a job's outputs. Jobs run in
+# threads with a stand-in runJob, so no model or OpenCL device is involved.
+
+class ThreadRunner(BatchRunner.BatchRunner):
+
+    def newPool(self):
+        return concurrent.futures.ThreadPoolExecutor(2)
+
+def test_retries_and_manifest(tmp_path, monkeypatch):
+    def runJob(job):
+        if job['replicate'] == 1 and job['attempts'] == 1:
+            raise RuntimeError('lost the device')
+        if job['replicate'] == 2:
+            raise ValueError('bad flags')
+        return (job['name'], 1.0)
+    monkeypatch.setattr(BatchRunner, 'runJob', runJob)
+    runner = ThreadRunner('model.py', replicates=3, seeds=[7, 8, 9], retries=2, outputDir=str(tmp_path))
+    manifest = runner.run()
+    jobs = manifest['jobs']
+    assert [job['name'] for job in jobs] == ['model-r000-s7', 'model-r001-s8', 'model-r002-s9']
+    assert [job['status'] for job in jobs] == ['done', 'done', 'failed']
+    assert [job['attempts'] for job in jobs] == [1, 2, 3]
+    assert jobs[1]['error'] is None
+    assert jobs[2]['error'] == 'ValueError: bad flags'
+    assert jobs[0]['outputDir'] == 'model-r000-s7'
+    with open(tmp_path / 'manifest.json') as f:
+        assert json.load(f) == manifest
+
+def test_too_few_seeds():
+    with pytest.raises(ValueError):
+        BatchRunner.BatchRunner('model.py', replicates=3, seeds=[1, 2])
+
+class Output:
+
+    def __init__(self, log, name):
+        (self.log, self.name) = (log, name)
+
+    def close(self):
+        self.log.append(self.name)
+
+class Module:
+    pass
+
+def test_close_outputs_after_a_failed_finish():
+    log = []
+    module = Module()
+    module.store = Output(log, 'store')
+    module.lineage = Output(log, 'lineage')
+    module.stats = None
+    def finish(cells):
+        log.append('finish')
+        raise RuntimeError('finish failed')
+    module.finish = finish
+    sim = Module()
+    sim.cellStates = {}
+    with pytest.raises(RuntimeError):
+        closeOutputs(module, sim)
+    assert log == ['finish', 'store', 'lineage']
+    log.clear()
+    closeOutputs(module) # a failed run: no finish()
+    assert log == ['store', 'lineage']
@@ -0,0 +1,40 @@
+import os
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths
+import Benchmark
+
+# The vectorised update() exists to be faster than the per-cell loop; Benchmark.benchUpdate()
+# times both over a record cycle, the engine's full write-back on the recorded step included.
+# The suite's populations, result names and baseline comparison are checked as well.
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_engine_faster_than_loop(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    results = Benchmark.benchUpdate(path, 10000, repeats=3, only=['engine', 'perCell'])
+    engine = results['%s/10000/update/engine' % name]
+    loop = results['%s/10000/update/perCell' % name]
+    assert engine < loop, '%s: engine %.4f s per update(), loop %.4f s' % (name, engine, loop)
+
+def test_population_and_result_keys():
+    (module, sim) = Benchmark.loadModel(modelPaths[0], {})
+    cells = Benchmark.populate(module, sim, 2000)
+    types = numpy.bincount([cell.cellType for cell in cells.values()], minlength=6) / 2000
+    for (cellType, fraction) in Benchmark.mix.items():
+        assert abs(types[cellType] - fraction) < 0.03
+    assert all(cell.growthRate == 0.0 for cell in cells.values() if cell.cellType >= 3)
+    results = Benchmark.benchModel(modelPaths[0], 200, repeats=1, only=['engine'])
+    name = os.path.splitext(os.path.basename(modelPaths[0]))[0]
+    assert sorted(results) == ['%s/200/%s' % (name, bench) for bench in
+                               ['columnsRead', 'columnsWrite', 'divide', 'pickleRead', 'pickleWrite', 'update/engine']]
+    assert all(seconds > 0 for seconds in results.values())
+
+def test_compare_with_a_saved_baseline(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    Benchmark.save(path, {'a/1/divide': 1.0, 'a/1/pickleRead': 2.0, 'gone': 1.0})
+    baseline = Benchmark.load(path)
+    rows = Benchmark.compare({'a/1/divide': 1.2, 'a/1/pickleRead': 3.0, 'new': 1.0}, baseline)
+    assert rows == [('a/1/divide', 1.2, 1.0, 1.2, False), ('a/1/pickleRead', 3.0, 2.0, 1.5, True)]
@@ -0,0 +1,51 @@
+import numpy
+import Sweep
+from Calibration import Calibration
+
+# The calibration loss on known curves, points served from the sweep cache, and a fit on a
+# stand-in model whose curves follow its params, so the best point is known.
+
+hours = numpy.array([1.0, 2.0, 3.0])
+observed = {'RB': ([1, 2], hours, [10.0, 20.0, 30.0]), 'EB': ([5], hours, [0.25, 1.0, 2.25])}
+
+def curves(point, steps=30, nTypes=8):
+    # Counts of a stand-in model at t hours: rate*t RBs and rate*t**2/40 EBs
+    t = numpy.arange(1, steps + 1) / 10.0
+    mean = numpy.zeros((steps, nTypes))
+    mean[:, 1] = point['rate'] * t
+    mean[:, 5] = 0.25 * point['rate'] * t**2 / 10.0
+    return {'params': point, 'mean': mean, 'std': numpy.zeros_like(mean)}
+
+def calibration(tmp_path, **kwargs):
+    (tmp_path / 'model.py').write_text('')
+    return Calibration(str(tmp_path / 'model.py'), {'rate': (0.0, 20.0)}, observed,
+                       cacheDir=str(tmp_path / 'cache'), **kwargs)
+
+def test_loss_of_known_curves(tmp_path):
+    cal = calibration(tmp_path)
+    assert cal.steps == 30
+    exact = curves({'rate': 10.0})
+    assert cal.series(exact)['RB'].tolist() == [10.0, 20.0, 30.0]
+    assert cal.lossOf(exact) == 0.0
+    off = curves({'rate': 11.0})
+    rb = numpy.mean(((numpy.array([11.0, 22.0, 33.0]) - [10, 20, 30]) / 30.0)**2)
+    eb = numpy.mean(((0.025 * 11 * hours**2 - [0.25, 1.0, 2.25]) / 2.25)**2)
+    assert numpy.isclose(cal.lossOf(off), rb + eb)
+
+def test_points_come_from_the_cache(tmp_path, monkeypatch):
+    cal = calibration(tmp_path)
+    point = {'rate': 10.0}
+    result = curves(point)
+    cal.store(point, result['mean'], result['std'])
+    def noPool(*args, **kwargs):
+        raise AssertionError('a cached point was run again')
+    monkeypatch.setattr(Sweep.concurrent.futures, 'ProcessPoolExecutor', noPool)
+    assert cal.loss(point) == 0.0
+
+def test_fit_finds_the_observed_rate(tmp_path, monkeypatch):
+    monkeypatch.setattr(Calibration, 'run', lambda self, points, workers=None: [curves(p) for p in points])
+    cal = calibration(tmp_path)
+    fit = cal.fit(generations=10, population=16, elite=4)
+    assert abs(fit['params']['rate'] - 10.0) < 0.2
+    assert fit['loss'] == min(loss for (point, loss) in fit['evaluated'])
+    assert len(fit['evaluated']) == 16 * 11
@@ -0,0 +1,35 @@
+import numpy
+from CellRandom import CellRandom, philox, GROWTH, CONVERSION
+
+def words(*values):
+    return [numpy.array([value], dtype=numpy.uint64) for value in values]
+
+def test_philox_known_answers():
+    # Known-answer vectors of philox4x32-10 from Random123 (kat_vectors)
+    vectors = [((0, 0, 0, 0), (0, 0), (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+               ((0xffffffff,) * 4, (0xffffffff,) * 2, (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+               ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0),
+                (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))]
+    for (counter, key, expected) in vectors:
+        out = philox(*words(*counter), *words(*key))
+        assert [int(w[0]) for w in out] == list(expected)
+
+def test_scalar_draws_match_columns():
+    rng = CellRandom(7)
+    ids = numpy.arange(50)
+    column = rng.uniform(ids, 12, GROWTH, -0.05, 0.05)
+    assert [rng.uniform(cid, 12, GROWTH, -0.05, 0.05) for cid in range(50)] == column.tolist()
+    mask = ids % 3 == 0
+    masked = rng.uniform(ids, 12, GROWTH, -0.05, 0.05, mask)
+    assert numpy.array_equal(masked[mask], column[mask])
+    assert numpy.isnan(masked[~mask]).all()
+    assert not numpy.array_equal(column, rng.uniform(ids, 12, CONVERSION, -0.05, 0.05))
+
+def test_replicates_draw_as_serial_runs():
+    # Cell i of replicate r in an Ensemble has id i * replicates + r and the draws of seed + r
+    replicates = 4
+    ensemble = CellRandom(11, replicates)
+    local = numpy.arange(30)
+    for r in range(replicates):
+        serial = CellRandom(11 + r).normal(local, 5, CONVERSION, 1, 0.05)
+        assert numpy.array_equal(ensemble.normal(local * replicates + r, 5, CONVERSION, 1, 0.05), serial)
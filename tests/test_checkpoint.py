@@ -0,0 +1,63 @@
+import os
+import copy
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths, loadModel, run
+from Checkpoint import CheckpointWriter, restore, resume, watchedAttrs
+from ColonyGrid import ColonyGrid
+
+# Restart checkpoints of well-mixed runs: what restore() gives back against the cells the run
+# had at that step, and a run resumed from it against the run that wrote it.
+
+tol = 1e-2 # of the CheckpointWriter, how far a restored expression value may be from the true one
+
+def recordingRun(path, folder, steps, truthSteps, grid=False):
+    # Run with a CheckpointWriter (and a ColonyGrid), keeping a copy of the cells of truthSteps
+    (module, sim) = loadModel(path, randomSeed=3)
+    module.checkpoint = CheckpointWriter(sim, folder, baseSteps=100, deltaSteps=10, tol=tol)
+    if grid:
+        module.colonyGrid = ColonyGrid(1, (4, 4, 4), (-128, -14, -8), [10.0], rates=[1.0])
+    truth = {}
+    levels = {}
+    for _ in range(steps):
+        sim.step()
+        if sim.stepNum - 1 in truthSteps:
+            truth[sim.stepNum - 1] = copy.deepcopy(sim.cellStates)
+        if grid:
+            levels[module.time] = module.colonyGrid.levels.copy()
+    return (truth, levels)
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_round_trip_within_tol(path, tmp_path):
+    (truth, _) = recordingRun(path, str(tmp_path), 420, [250, 300, 410])
+    for (step, cells) in truth.items():
+        data = restore(str(tmp_path), step)
+        assert data['stepNum'] == step
+        assert data['moduleState']['time'] == step + 1
+        restored = data['cellStates']
+        assert list(restored) == list(cells)
+        for (cid, cell) in cells.items():
+            back = restored[cid]
+            assert back.cellType == cell.cellType
+            assert back.volume == cell.volume
+            for name in watchedAttrs:
+                value = numpy.asarray(getattr(back, name), dtype=float)
+                true = numpy.asarray(getattr(cell, name), dtype=float)
+                assert numpy.all(numpy.abs(value - true) <= tol * (1 + numpy.abs(value))), (step, cid, name)
+
+def test_resumed_grid_continues(tmp_path):
+    # The checkpoint of step s holds the grid as update(s + 1) left it, so a run resumed
+    # from it steps the grid exactly as the original run did
+    path = modelPaths[0]
+    (_, levels) = recordingRun(path, str(tmp_path), 260, [], grid=True)
+    data = restore(str(tmp_path), 200)
+    (module, sim) = loadModel(path, randomSeed=3)
+    module.colonyGrid = ColonyGrid(1, (4, 4, 4), (-128, -14, -8), [10.0], rates=[1.0])
+    resume(module, data)
+    sim.loadFromPickle(data)
+    assert numpy.array_equal(module.colonyGrid.levels, levels[module.time])
+    run(sim, 20)
+    assert numpy.array_equal(module.colonyGrid.levels, levels[module.time])
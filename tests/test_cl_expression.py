@@ -0,0 +1,81 @@
+import os
+import re
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths, loadModel
+import Benchmark
+
+# clExpression moves the RNA/protein kinetics into the species kernel (expressionRateCL()).
+# The generated C is run here in Python and its RNA rates held against one host step of
+# updateEngine(), which they replace: RNA changes by rate*tick in both.
+
+def kernelRates(source, species, cellType):
+    # The rates[] one cell gets from an expressionRateCL() snippet
+    lines = []
+    depth = 0
+    for line in source.splitlines():
+        line = line.split('//')[0].strip()
+        if not line:
+            continue
+        if line == '}':
+            depth -= 1
+            continue
+        line = re.sub(r'(\d)f\b', r'\1', line).rstrip(';')
+        line = re.sub(r'^(const )?float ', '', line).replace('||', 'or').replace('&&', 'and')
+        loop = re.match(r'for \(int i=(\d+); i<(\d+); i\+\+\) (.*)', line)
+        if loop:
+            line = 'for i in range(%s, %s): %s' % loop.groups()
+        block = re.match(r'(else )?if \((.*)\)\s*\{$', line)
+        if block:
+            lines.append('    ' * depth + ('elif ' if block.group(1) else 'if ') + block.group(2) + ':')
+            depth += 1
+            continue
+        lines.append('    ' * depth + line)
+    rates = [0.0] * len(species)
+    exec('\n'.join(lines), {}, {'species': species, 'rates': rates, 'cellType': cellType})
+    return numpy.array(rates)
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_kernel_rna_rates_match_host_step(path):
+    (module, sim) = loadModel(path)
+    cells = Benchmark.populate(module, sim, 400)
+    eng = module.engine
+    eng.sync(cells)
+    module.clExpression = True
+    source = module.expressionRateCL()
+    module.clExpression = False
+    assert '%' not in source
+    (RNA, GENE, nGenes) = (module.RNA, module.GENE, eng.nGenes)
+    growth = numpy.where(eng.cellType >= 3, eng.parentGrowth, eng.growthRate)
+    species = numpy.zeros((len(eng), GENE + nGenes))
+    species[:, module.GROWTH] = growth
+    species[:, RNA:RNA + nGenes] = eng.rnaamt
+    species[:, GENE:GENE + nGenes] = eng.geneamt
+    (cellType, rna, gene) = (eng.cellType.copy(), eng.rnaamt.copy(), eng.geneamt.copy())
+    module.time = Benchmark.startTime + 1 # past the washout
+    module.updateEngine(eng)
+    # Cells that moved type ran two blocks of the host step, and the kernel tests the Euo
+    # block of 10-14-21 on the level it integrates from, the host on the stepped one
+    same = (eng.cellType == cellType) & ((gene[:, 1] > 3) == (eng.geneamt[:, 1] > 3))
+    assert same.sum() > 200
+    for i in numpy.nonzero(same)[0]:
+        rates = kernelRates(source, species[i].tolist(), int(cellType[i]))
+        assert numpy.allclose(rates[RNA:RNA + nGenes] * module.tickTime, eng.rnaamt[i] - rna[i], rtol=1e-9, atol=1e-12)
+
+def test_species_round_trip():
+    (module, sim) = loadModel(modelPaths[0])
+    cells = Benchmark.populate(module, sim, 50)
+    eng = module.engine
+    eng.sync(cells)
+    for cell in cells.values():
+        cell.species = numpy.zeros(module.GENE + eng.nGenes)
+    (rna, gene) = (eng.rnaamt.copy(), eng.geneamt.copy())
+    eng.writeSpecies(cells, module.RNA, module.GENE, module.GROWTH, eng.growthRate)
+    eng.rnaamt[:] = 0
+    eng.geneamt[:] = 0
+    eng.readSpecies(cells, module.RNA, module.GENE)
+    assert numpy.array_equal(eng.rnaamt, rna)
+    assert numpy.array_equal(eng.geneamt, gene)
@@ -0,0 +1,61 @@
+import numpy
+import pytest
+import ColumnStore
+from ColumnStore import ColumnWriter, ColumnReader
+from CellState import CellState
+
+# Columns written by a ColumnWriter against the cells they were taken from, read back whole,
+# by step and as type counts.
+
+def colony(step, rng):
+    cells = {}
+    for cid in range(5 + step % 7):
+        cell = CellState(cid)
+        cell.cellType = int(rng.integers(0, 6))
+        cell.volume = float(rng.uniform(1, 2))
+        cell.pos = list(rng.uniform(-5, 5, 3))
+        cell.rnaamt = list(rng.uniform(0, 1, 4))
+        cell.geneamt = list(rng.uniform(0, 10, 4))
+        cells[cid] = cell
+    return cells
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'columns.npz')
+    writer = ColumnWriter(path, every=10, nGenes=4, chunkSteps=3)
+    rng = numpy.random.default_rng(0)
+    written = {}
+    for step in range(-1, 95):
+        cells = colony(step, rng)
+        writer.record(step, cells)
+        if step >= 0 and step % 10 == 0:
+            written[step] = cells
+    cells = colony(95, rng)
+    writer.record(95, cells, final=True)
+    written[95] = cells
+    writer.close()
+    run = ColumnReader(path)
+    assert run.steps.tolist() == sorted(written)
+    assert len(run.chunks) == 4 # three full chunks and the flushed remainder
+    for (step, types) in zip(run.steps, run.field('cellType')):
+        assert types.tolist() == [cell.cellType for cell in written[step].values()]
+    for (step, cells) in written.items():
+        at = run.at(step)
+        assert at['id'].tolist() == list(cells)
+        assert numpy.array_equal(at['pos'], [cell.pos for cell in cells.values()])
+        assert numpy.array_equal(at['geneamt'], [cell.geneamt for cell in cells.values()])
+        assert numpy.array_equal(at['volume'], [cell.volume for cell in cells.values()])
+    counts = numpy.array([numpy.bincount([cell.cellType for cell in cells.values()], minlength=6)
+                          for (step, cells) in sorted(written.items())])
+    assert numpy.array_equal(run.counts(6), counts)
+    with pytest.raises(KeyError):
+        run.at(5)
+    run.close()
+
+def test_close_releases_the_exit_hook(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(ColumnStore.atexit, 'register', hooks.append)
+    monkeypatch.setattr(ColumnStore.atexit, 'unregister', hooks.remove)
+    writer = ColumnWriter(str(tmp_path / 'columns.npz'))
+    assert hooks == [writer.close]
+    writer.close()
+    assert hooks == []
@@ -0,0 +1,37 @@
+import io
+import os
+import pytest
+from DebugLog import DebugLog
+from conftest import modelPaths, loadModel
+
+# Rate limiting of DebugLog, and the log the models pick: silent unless in the GUI or set.
+
+def lines(log, steps, perStep):
+    for step in range(steps):
+        log.step(step)
+        for k in range(perStep):
+            log('cell %d of step %d', k, step)
+    log.step(steps)
+    return log.stream.getvalue().splitlines()
+
+def test_rate_limited():
+    out = lines(DebugLog(lines=2, everySteps=5, stream=io.StringIO()), 11, 3)
+    assert out == ['cell 0 of step 0', 'cell 1 of step 0', '... 1 more debug lines in step 0',
+                   'cell 0 of step 5', 'cell 1 of step 5', '... 1 more debug lines in step 5',
+                   'cell 0 of step 10', 'cell 1 of step 10', '... 1 more debug lines in step 10']
+    assert len(lines(DebugLog(None, stream=io.StringIO()), 11, 3)) == 33
+
+def test_silent():
+    log = DebugLog(0, stream=io.StringIO())
+    assert lines(log, 11, 3) == []
+    log.write('integrator report')
+    assert log.stream.getvalue() == ''
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_models_are_silent_headless(path):
+    pytest.importorskip('CellModeller')
+    (module, sim) = loadModel(path)
+    assert module.debug.lines == 0
+    mine = DebugLog(None)
+    (module, sim) = loadModel(path, debugLog=mine)
+    assert module.debug is mine
@@ -0,0 +1,52 @@
+import os
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths, loadModel, run
+from Ensemble import Ensemble
+
+# The vectorised paths against the per-cell loop they replace. With randomSeed the draws are
+# keyed by cell, step and purpose, so the paths see the same numbers whatever order they
+# draw in, and they must agree to the last bit.
+
+steps = 400
+
+def columns(cells):
+    states = sorted(cells.values(), key=lambda cell: cell.id)
+    return {'id': [cell.id for cell in states],
+            'cellType': [cell.cellType for cell in states],
+            'growthRate': [cell.growthRate for cell in states],
+            'parentGrowth': [cell.parentGrowth[0] for cell in states],
+            'volume': [cell.volume for cell in states],
+            'rnaamt': numpy.array([cell.rnaamt for cell in states]),
+            'geneamt': numpy.array([cell.geneamt for cell in states])}
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_engine_matches_loop(path):
+    (loopModule, loopSim) = loadModel(path, vectorized=False, randomSeed=5)
+    (engineModule, engineSim) = loadModel(path, vectorized=True, randomSeed=5)
+    run(loopSim, steps)
+    run(engineSim, steps)
+    # The engine writes every CellState back on the recorded steps only, and in finish()
+    loopModule.finish(loopSim.cellStates)
+    engineModule.finish(engineSim.cellStates)
+    loop = columns(loopSim.cellStates)
+    engine = columns(engineSim.cellStates)
+    assert len(loop['id']) > 50
+    for (name, values) in loop.items():
+        assert numpy.array_equal(values, engine[name]), name
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_ensemble_matches_serial_runs(path):
+    replicates = 3
+    ensemble = Ensemble(path, replicates, seed=5, randomSeed=40)
+    counts = ensemble.run(300)
+    for r in range(replicates):
+        (module, sim) = loadModel(path, randomSeed=40 + r)
+        serial = []
+        for _ in range(300):
+            sim.step()
+            serial.append(numpy.bincount([cell.cellType for cell in sim.cellStates.values()], minlength=ensemble.nTypes))
+        assert numpy.array_equal(numpy.array(serial), counts[:, r, :])
@@ -0,0 +1,34 @@
+import os
+import json
+import concurrent.futures
+import BatchRunner
+import Fork
+
+# Fork's bookkeeping with the branches run in threads by a stand-in runBranch: the manifest
+# goes where BatchRunner puts its own, outputDir/manifest.json.
+
+def threadPool(workers, **kwargs):
+    return concurrent.futures.ThreadPoolExecutor(workers)
+
+def test_manifest_beside_batch_runner_manifests(tmp_path, monkeypatch):
+    def runBranch(model, name, branch, steps, dt, outputDir):
+        if name == 'broken':
+            raise RuntimeError('no device')
+        return (os.path.join(outputDir, name), float(steps))
+    monkeypatch.setattr(Fork, 'runBranch', runBranch)
+    monkeypatch.setattr(Fork.concurrent.futures, 'ProcessPoolExecutor', threadPool)
+    fork = Fork.Fork.__new__(Fork.Fork) # without restoring a checkpoint
+    (fork.model, fork.checkpointDir, fork.data, fork.step, fork.dt) = ('model.py', 'checkpoints', {}, 200, 0.025)
+    (fork.flags, fork.workers, fork.platform, fork.devices) = ({}, 2, 0, [0])
+    fork.outputDir = str(tmp_path / 'forks')
+    manifest = fork.run({'washout20': {'seed': 1}, 'broken': {'seed': 2}}, steps=40)
+    with open(tmp_path / 'forks' / 'manifest.json') as f:
+        assert json.load(f) == manifest
+    jobs = {job['name']: job for job in manifest['jobs']}
+    assert jobs['washout20']['status'] == 'done' and jobs['washout20']['seconds'] == 40.0
+    assert jobs['broken']['status'] == 'failed' and jobs['broken']['error'] == 'RuntimeError: no device'
+    assert (manifest['step'], manifest['steps']) == (200, 40)
+    runner = BatchRunner.BatchRunner('model.py', outputDir=str(tmp_path / 'forks'))
+    runner.writeManifest()
+    with open(tmp_path / 'forks' / 'manifest.json') as f:
+        assert json.load(f)['jobs'][0]['name'] == 'model-r000-s0'
@@ -0,0 +1,34 @@
+import numpy
+import pytest
+import HazardCurves
+
+# HazardTable lookups against the fits they tabulate.
+
+@pytest.mark.parametrize('name', sorted(HazardCurves.curves))
+def test_table_matches_curve(name):
+    (curve, scaled) = HazardCurves.curves[name]
+    table = HazardCurves.table(name)
+    hours = numpy.random.default_rng(0).uniform(0, 200, 2000)
+    growth = numpy.random.default_rng(1).uniform(0.9, 1.1, 2000)
+    t = hours * growth if scaled else hours
+    assert numpy.max(numpy.abs(table(hours, growth) - curve(numpy.minimum(t, table.span)))) < 1e-4
+    # on the grid the table is the curve itself, past span it holds the last sample
+    assert table(8.0) == curve(numpy.array([8.0]))[0]
+    assert table(table.span + 50.0) == table.values[-1]
+
+def test_scalar_and_vector_arguments():
+    table = HazardCurves.table('livecell')
+    assert isinstance(table(20.0, 1.0), float)
+    assert table(20.0, numpy.array([1.0, 1.1])).shape == (2,)
+    assert table(20.0, 1.1) == pytest.approx(table(22.0, 1.0))
+    early = HazardCurves.table('early') # not scaled: growthRate only sets the shape
+    assert numpy.all(early(12.0, numpy.array([0.9, 1.1])) == early(12.0))
+
+def test_register_and_unknown_names():
+    HazardCurves.register('flat', lambda hours: numpy.full(numpy.shape(hours), 40.0), scaled=False)
+    try:
+        assert HazardCurves.table('flat', span=10.0)(3.3) == 40.0
+    finally:
+        del HazardCurves.curves['flat']
+    with pytest.raises(KeyError):
+        HazardCurves.table('nope')
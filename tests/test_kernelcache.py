@@ -0,0 +1,82 @@
+import os
+import sys
+import types
+import KernelCache
+
+# KernelCache against a stand-in pyopencl that records what it compiles: a program is
+# compiled once per source, options and device, later builds come from the stored binaries.
+
+class Device:
+
+    def __init__(self, name, driver='1.0'):
+        self.platform = types.SimpleNamespace(name='Platform')
+        (self.name, self.version, self.driver_version) = (name, 'OpenCL 3.0', driver)
+
+class Program:
+    compiled = [] # sources compiled from source
+    loaded = [] # binaries built from
+
+    def __init__(self, context, source_or_devices, binaries=None):
+        self._context = context
+        if binaries is None:
+            self._source = source_or_devices
+        else:
+            self.binaries = binaries
+
+    def build(self, options=[], devices=None, cache_dir=None):
+        if hasattr(self, '_source'):
+            Program.compiled.append(self._source)
+            self.binaries = [('bin:' + self._source).encode() for device in devices or self._context.devices]
+        elif self.binaries[0] == b'stale':
+            raise Error('wrong driver')
+        else:
+            Program.loaded.append(self.binaries)
+        return self
+
+    def get_info(self, what):
+        return self.binaries
+
+class Error(Exception):
+    pass
+
+def fakeOpenCL():
+    module = types.ModuleType('pyopencl')
+    (module.Program, module.Error) = (Program, Error)
+    module.program_info = types.SimpleNamespace(BINARIES='binaries')
+    Program.compiled, Program.loaded = [], []
+    return module
+
+def test_compile_once_then_load(tmp_path, monkeypatch):
+    cl = fakeOpenCL()
+    monkeypatch.setitem(sys.modules, 'pyopencl', cl)
+    original = cl.Program.build
+    context = types.SimpleNamespace(devices=[Device('gpu')])
+    KernelCache.install(str(tmp_path))
+    try:
+        for _ in range(3):
+            built = cl.Program(context, 'kernel A').build(['-O2'])
+            assert built.binaries == [b'bin:kernel A']
+        cl.Program(context, 'kernel A').build(['-O3']) # other options, another entry
+        cl.Program(context, 'kernel A').build(['-O2'], [Device('gpu', driver='2.0')]) # another driver
+        assert Program.compiled == ['kernel A'] * 3
+        assert len(Program.loaded) == 2
+        assert len(os.listdir(tmp_path)) == 3
+        for name in os.listdir(tmp_path): # binaries the driver refuses are compiled again
+            KernelCache.store(os.path.join(tmp_path, name), [b'stale'])
+        cl.Program(context, 'kernel A').build(['-O2'])
+        assert Program.compiled == ['kernel A'] * 4
+        cl.Program(context, 'kernel A').build(['-O2'])
+        assert Program.compiled == ['kernel A'] * 4
+    finally:
+        KernelCache.uninstall()
+    assert cl.Program.build is original and KernelCache.installed is None
+
+def test_unreadable_entries(tmp_path):
+    path = str(tmp_path / 'entry.bin')
+    assert KernelCache.load(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'\x80\x04trunc')
+    assert KernelCache.load(path) is None
+    KernelCache.store(path, [b'x'])
+    assert KernelCache.load(path) == [b'x']
+    assert os.listdir(tmp_path) == ['entry.bin']
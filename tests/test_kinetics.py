@@ -0,0 +1,51 @@
+import numpy
+from ExpressionEngine import ExpressionEngine
+from GeneNetwork import GeneNetwork
+from LinearKinetics import LinearKinetics
+
+# LinearKinetics jumps against the GeneNetwork steps they stand for.
+
+spec = {
+    'genes': ['Euo', 'HctB'],
+    'rates': {1: {'Euo': (0.02, 0.02, 0.5, 0.08)}, 5: {'HctB': (0.06, 0.024, 0.5, 0.01)}},
+    'growth': {1: 'growthRate', 5: 'parentGrowth'},
+    'decayScaled': {'Euo': (True, True), 'HctB': (False, True)},
+}
+
+def engine(n, seed=0):
+    rng = numpy.random.default_rng(seed)
+    eng = ExpressionEngine(2)
+    eng.append(n)
+    eng.cellType[:] = rng.choice([1, 5], n)
+    eng.growthRate[:] = rng.uniform(0.9, 1.1, n)
+    eng.parentGrowth[:] = rng.uniform(0.9, 1.1, n)
+    eng.rnaamt[:] = rng.uniform(0, 2, (n, 2))
+    eng.geneamt[:] = rng.uniform(0, 10, (n, 2))
+    return eng
+
+def stepped(eng, grn, lag):
+    # Each row stepped lag[row] times, one step at a time
+    for k in range(1, max(lag) + 1):
+        grn.step(eng, numpy.nonzero(lag >= k)[0])
+
+def test_advance_matches_steps():
+    grn = GeneNetwork(spec)
+    kin = LinearKinetics(grn)
+    for k in [1, 2, 7, 64]:
+        (jumped, steps) = (engine(50), engine(50))
+        kin.advance(jumped, k)
+        stepped(steps, grn, numpy.full(50, k))
+        assert numpy.allclose(jumped.rnaamt, steps.rnaamt, rtol=1e-12)
+        assert numpy.allclose(jumped.geneamt, steps.geneamt, rtol=1e-12)
+
+def test_catch_up_mixed_lags():
+    grn = GeneNetwork(spec)
+    kin = LinearKinetics(grn)
+    (jumped, steps) = (engine(200), engine(200))
+    lastStep = numpy.random.default_rng(1).integers(0, 13, 200)
+    jumped.lastStep[:] = lastStep
+    kin.catchUp(jumped, 12)
+    stepped(steps, grn, 12 - lastStep)
+    assert numpy.all(jumped.lastStep == 12)
+    assert numpy.allclose(jumped.rnaamt, steps.rnaamt, rtol=1e-12)
+    assert numpy.allclose(jumped.geneamt, steps.geneamt, rtol=1e-12)
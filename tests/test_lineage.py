@@ -0,0 +1,72 @@
+import numpy
+import pytest
+import Lineage
+from Lineage import LineageRecorder, LineageIndex
+
+# Lineage queries of the depth-first index against walking the recorded divisions directly.
+
+def divisions(seed=0, steps=12):
+    # A colony from two roots where each cell divides with chance 1/2 a step, types drawn at
+    # random, recorded a division at a time and a step at a time
+    rng = numpy.random.default_rng(seed)
+    recorder = LineageRecorder()
+    alive = {0: 1, 1: 1}
+    nextId = 2
+    for step in range(steps):
+        parents = [cid for cid in alive if rng.random() < 0.5]
+        for cid in parents:
+            (t1, t2) = rng.integers(1, 4, 2).tolist()
+            recorder.record(step, cid, nextId, nextId + 1, alive.pop(cid), t1, t2)
+            alive[nextId] = t1
+            alive[nextId + 1] = t2
+            nextId += 2
+    return recorder.rows()
+
+def test_queries_match_a_walk_of_the_table():
+    table = divisions()
+    tree = LineageIndex(table)
+    parent = {int(d): int(row[0]) for row in table for d in row[1:3]}
+    children = {}
+    for row in table:
+        children[int(row[0])] = [int(row[1]), int(row[2])]
+    bornAs = {int(row[k]): int(row[k + 4]) for row in table for k in (1, 2)}
+    for cid in numpy.unique(table[:, :3]).tolist():
+        chain = []
+        up = cid
+        while up in parent:
+            up = parent[up]
+            chain.append(up)
+        assert tree.ancestors(cid) == chain
+        below = []
+        pending = list(children.get(cid, []))
+        while pending:
+            c = pending.pop()
+            below.append(c)
+            pending += children.get(c, [])
+        assert sorted(tree.descendants(cid).tolist()) == sorted(below)
+        assert tree.descendantCounts([cid], 3).tolist() == [sum(bornAs[c] == 3 for c in below)]
+    founders = tree.founders(2)
+    assert all(tree.bornType[cid] != 2 for cid in founders)
+    assert sorted(founders.tolist()) == sorted(int(row[0]) for row in table if row[4] == 2 and tree.bornType[row[0]] != 2)
+
+def test_unknown_cells():
+    tree = LineageIndex(divisions())
+    unseen = len(tree.known)
+    for cid in (unseen, unseen + 10, -1):
+        with pytest.raises(KeyError):
+            tree.ancestors(cid)
+        with pytest.raises(KeyError):
+            tree.descendants(cid)
+
+def test_recorder_round_trip(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(Lineage.atexit, 'register', hooks.append)
+    monkeypatch.setattr(Lineage.atexit, 'unregister', hooks.remove)
+    path = str(tmp_path / 'lineage.npz')
+    recorder = LineageRecorder(path, saveRows=50)
+    assert hooks == [recorder.close]
+    table = divisions()
+    recorder.record(table[:, 3], table[:, 0], table[:, 1], table[:, 2], table[:, 4], table[:, 5], table[:, 6])
+    recorder.close()
+    assert hooks == []
+    assert numpy.array_equal(LineageIndex.load(path).table, table)
@@ -0,0 +1,53 @@
+import os
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths, loadModel
+from test_engine import columns
+from Aggregator import OnlineAggregator
+
+# updateNetwork() against updateEngine() over seeded runs. The compiled networkSpec takes the
+# type blocks in the loop's order, so cells convert and mature on the same steps; the levels
+# only differ in rounding (products taken in another order, the parked EBs jumped forward).
+
+steps = 600
+
+@pytest.mark.parametrize('useScheduler', [True, False])
+@pytest.mark.parametrize('seed', [2, 5])
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_network_matches_engine(path, seed, useScheduler):
+    (engineModule, engineSim) = loadModel(path, useNetwork=False, randomSeed=seed)
+    (networkModule, networkSim) = loadModel(path, useNetwork=True, useScheduler=useScheduler, randomSeed=seed)
+    for step in range(steps):
+        engineSim.step()
+        networkSim.step()
+        engineTypes = {cid: cell.cellType for (cid, cell) in engineSim.cellStates.items()}
+        networkTypes = {cid: cell.cellType for (cid, cell) in networkSim.cellStates.items()}
+        assert engineTypes == networkTypes, 'step %d' % step
+    engineModule.finish(engineSim.cellStates)
+    networkModule.finish(networkSim.cellStates)
+    engine = columns(engineSim.cellStates)
+    network = columns(networkSim.cellStates)
+    assert numpy.bincount(engine['cellType'])[3:].sum() > 10 # IBs and on reached
+    for name in ('rnaamt', 'geneamt'):
+        assert numpy.allclose(engine[name], network[name], rtol=1e-9, atol=1e-12), name
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_summary_of_parked_cells(path, tmp_path):
+    # The summary takes every step, parked EBs folded in as far as the step it records
+    series = []
+    for fastForwardTypes in ([5], []):
+        (module, sim) = loadModel(path, useNetwork=True, fastForwardTypes=fastForwardTypes, randomSeed=2)
+        module.stats = OnlineAggregator(str(tmp_path / 'summary.npz'), nGenes=module.engine.nGenes)
+        for _ in range(steps):
+            sim.step()
+        module.finish(sim.cellStates)
+        series.append(module.stats.series())
+    (parked, stepped) = series
+    assert parked['counts'][-1, 5] > 0
+    assert numpy.array_equal(parked['steps'], stepped['steps'])
+    assert numpy.array_equal(parked['counts'], stepped['counts'])
+    for name in ('rnaMean', 'geneMean', 'geneMax'):
+        assert numpy.allclose(parked[name], stepped[name], rtol=1e-9, atol=1e-12, equal_nan=True), name
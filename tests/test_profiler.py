@@ -0,0 +1,85 @@
+import os
+import json
+import Profiler
+
+# Phases, nesting and counters of a Profiler attached to a stand-in simulator whose step()
+# goes through the regulator, divisions and physics as CellModeller's does.
+
+class Part:
+
+    def __init__(self, log, name):
+        (self.log, self.name) = (log, name)
+
+    def step(self, *args):
+        self.log.append(self.name)
+
+class Sim:
+
+    def __init__(self, log, profiler):
+        self.log = log
+        self.profiler = profiler
+        self.stepNum = 0
+
+    def init(self, phys, reg, sig, integ):
+        (self.phys, self.reg, self.sig, self.integ) = (phys, reg, sig, integ)
+
+    def divide(self, cell):
+        self.log.append('divide')
+
+    def step(self):
+        self.reg.step(0.025)
+        self.profiler.cells([1, 1, 2], [1, 2, 3])
+        for cell in range(self.stepNum % 3):
+            self.divide(cell)
+        self.phys.step(0.025)
+        self.integ.step(0.025)
+        self.stepNum += 1
+
+def test_phases_and_counters(tmp_path):
+    log = []
+    path = str(tmp_path / 'out' / 'profile')
+    profiler = Profiler.Profiler(path)
+    sim = Sim(log, profiler)
+    output = Part(log, 'save')
+    output.path = None
+    output.save = lambda: output.step()
+    profiler.attach(sim, {'summary': output})
+    sim.init(Part(log, 'phys'), Part(log, 'reg'), None, Part(log, 'integ'))
+    for _ in range(4):
+        sim.step()
+    profiler.enabled = False
+    sim.step() # not counted
+    profiler.enabled = True
+    output.save() # outside a step: its own stack
+    assert log.count('reg') == 5 and log.count('divide') == 4
+    (names, rows) = profiler.summary()
+    table = [dict(zip(names, row)) for row in rows]
+    assert [row['stepNum'] for row in table] == [0, 1, 2, 3]
+    assert [row['divisions'] for row in table] == [0, 1, 2, 0]
+    assert [row['divide.calls'] for row in table] == [0, 1, 2, 0]
+    assert all(row['update.calls'] == 1 and row['biophysics.calls'] == 1 and row['integrator.calls'] == 1
+               for row in table)
+    assert all(row['transitions'] == 2 and row['cells.3'] == 1 for row in table)
+    assert all(row['step'] >= row['update'] + row['biophysics'] for row in table)
+    assert sorted(profiler.folded) == ['step', 'step;biophysics', 'step;divide', 'step;integrator',
+                                       'step;update', 'summary']
+    profiler.close()
+    with open(path + '.trace.json') as f:
+        events = json.load(f)['traceEvents']
+    assert sum(event['name'] == 'step' for event in events) == 4
+    assert sum(event['ph'] == 'C' for event in events) == 4
+    with open(path + '.csv') as f:
+        assert len(f.read().splitlines()) == 5
+    assert os.path.exists(path + '.folded')
+    profiler.detach()
+    assert 'timed' not in (sim.step.__name__, sim.reg.step.__name__, output.save.__name__)
+
+def test_close_releases_the_exit_hook(monkeypatch):
+    hooks = []
+    monkeypatch.setattr(Profiler.atexit, 'register', hooks.append)
+    monkeypatch.setattr(Profiler.atexit, 'unregister', hooks.remove)
+    profiler = Profiler.Profiler('unused')
+    profiler.save = lambda: None
+    assert hooks == [profiler.close]
+    profiler.close()
+    assert hooks == []
@@ -0,0 +1,75 @@
+import os
+import pickle
+import numpy
+import pytest
+import RunLoader
+from ColumnStore import ColumnWriter
+from CellState import CellState
+
+# Runs read from their columns or their step pickles into one frame, and read back from the
+# cache when their files have not changed.
+
+def colony(step):
+    cells = {}
+    for cid in range(3 + step // 10):
+        cell = CellState(cid)
+        cell.cellType = (cid + step // 10) % 6
+        cell.volume = 1.0 + cid
+        cell.growthRate = 1.0
+        cell.pos = [float(cid), 0.0, 0.0]
+        cell.rnaamt = [0.1 * cid] * 4
+        cell.geneamt = [float(step), float(cid), 0.0, 1.0]
+        cells[cid] = cell
+    return cells
+
+def writeRuns(folder):
+    # The same colony as a run with columns and a run with step pickles only
+    (columnsRun, pickleRun) = (str(folder / 'run-columns'), str(folder / 'run-pickles'))
+    for run in (columnsRun, pickleRun):
+        os.makedirs(run)
+    store = ColumnWriter(os.path.join(columnsRun, 'columns.npz'), every=10)
+    for step in range(0, 40, 10):
+        store.record(step, colony(step))
+        with open(os.path.join(pickleRun, 'step-%05d.pickle' % step), 'wb') as f:
+            pickle.dump({'cellStates': colony(step)}, f)
+    store.close()
+    return [columnsRun, pickleRun]
+
+def test_columns_and_pickles_agree(tmp_path):
+    runs = writeRuns(tmp_path)
+    loader = RunLoader.RunLoader(str(tmp_path / 'cache'), workers=2)
+    df = loader.cells(runs, ['cellType', 'geneamt'])
+    assert list(df.columns) == ['sim', 'time', 'cell_id', 'cellType', 'geneamt0', 'geneamt1', 'geneamt2', 'geneamt3']
+    (a, b) = (df[df.sim == 'run-columns'], df[df.sim == 'run-pickles'])
+    assert len(a) == sum(len(colony(step)) for step in range(0, 40, 10))
+    assert numpy.array_equal(a.drop(columns='sim').values, b.drop(columns='sim').values)
+    counts = loader.counts(runs, nTypes=6, first=['geneamt'])
+    assert counts.time.tolist() == [0, 10, 20, 30] * 2
+    assert counts[['init', 'RBr', 'RBe', 'IB', 'pEB', 'mEB']].sum(axis=1).tolist() == [3, 4, 5, 6] * 2
+    assert counts.geneamt0.tolist() == [0.0, 10.0, 20.0, 30.0] * 2
+
+def test_missing_field_falls_back_to_pickles(tmp_path):
+    (columnsRun, pickleRun) = writeRuns(tmp_path)
+    with open(os.path.join(columnsRun, 'step-00000.pickle'), 'wb') as f:
+        pickle.dump({'cellStates': colony(0)}, f)
+    # growthRate is not a column, so the run is read from its one pickle
+    loaded = RunLoader.RunLoader(str(tmp_path / 'cache')).load([columnsRun], ['cellType', 'growthRate'])
+    assert loaded[columnsRun]['step'].tolist() == [0, 0, 0]
+    assert loaded[columnsRun]['growthRate'].tolist() == [1.0, 1.0, 1.0]
+
+def test_cache(tmp_path, monkeypatch):
+    runs = writeRuns(tmp_path)
+    loader = RunLoader.RunLoader(str(tmp_path / 'cache'))
+    first = loader.load(runs, ['cellType'])
+    def unread(*args, **kwargs):
+        raise AssertionError('run parsed')
+    monkeypatch.setattr(RunLoader, 'readColumns', unread)
+    monkeypatch.setattr(RunLoader.concurrent.futures, 'ProcessPoolExecutor', unread)
+    again = loader.load(runs, ['cellType'])
+    for run in runs:
+        assert numpy.array_equal(first[run]['cellType'], again[run]['cellType'])
+    # a rewritten file is read again
+    later = os.path.getmtime(os.path.join(runs[0], 'columns.npz')) + 10
+    os.utime(os.path.join(runs[0], 'columns.npz'), (later, later))
+    with pytest.raises(AssertionError, match='run parsed'):
+        loader.load(runs, ['cellType'])
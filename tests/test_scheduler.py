@@ -0,0 +1,84 @@
+import numpy
+from ExpressionEngine import ExpressionEngine
+from GeneNetwork import GeneNetwork
+from LinearKinetics import LinearKinetics
+from TransitionScheduler import TransitionScheduler
+
+# Predicted transition steps of the TransitionScheduler against stepping the network until
+# the level crosses.
+
+spec = {
+    'genes': ['Euo', 'HctB'],
+    'rates': {1: {'Euo': (0.02, 0.02, 0.5, 0.08)}, 3: {'Euo': (0.0, 0.08, 0.0, 0.08)},
+              4: {'HctB': (0.08, 0.024, 0.5, 0.001)}},
+    'growth': {1: 'growthRate', 3: 'parentGrowth', 4: 'parentGrowth'},
+    'decayScaled': {'Euo': (True, True), 'HctB': (False, True)},
+    'transitions': [(3, 'Euo', '<=', 0.6, 4), (4, 'HctB', '>=', 70, 5)],
+}
+
+def engine(cellType, rna, gene, seed=0):
+    n = len(rna)
+    eng = ExpressionEngine(2)
+    eng.append(n)
+    eng.ids[:] = numpy.arange(n)
+    eng.cellType[:] = cellType
+    rng = numpy.random.default_rng(seed)
+    eng.growthRate[:] = rng.uniform(0.9, 1.1, n)
+    eng.parentGrowth[:] = rng.uniform(0.9, 1.1, n)
+    eng.rnaamt[:] = rna
+    eng.geneamt[:] = gene
+    return eng
+
+def firstStep(eng, grn, gene, test, limit=5000):
+    # The first k at which test(level) holds, stepping one step at a time
+    eng = engine(eng.cellType, eng.rnaamt, eng.geneamt)
+    found = numpy.zeros(len(eng), dtype=numpy.int64)
+    for k in range(1, limit):
+        grn.step(eng)
+        hit = (found == 0) & test(eng.geneamt[:, gene])
+        found[hit] = k
+    return found
+
+def crossings(eng, grn, gene, threshold, below):
+    sched = TransitionScheduler(grn, LinearKinetics(grn))
+    n = len(eng)
+    rows = numpy.arange(n)
+    return sched.firstCrossing(eng, rows, numpy.full(n, gene), numpy.full(n, float(threshold)),
+                               numpy.full(n, below))
+
+def test_first_crossing_falling_and_rising():
+    grn = GeneNetwork(spec)
+    rng = numpy.random.default_rng(1)
+    ib = engine(3, numpy.c_[rng.uniform(0, 3, 40), numpy.zeros(40)], numpy.c_[rng.uniform(1, 30, 40), numpy.zeros(40)])
+    assert numpy.array_equal(crossings(ib, grn, 0, 0.6, True), firstStep(ib, grn, 0, lambda x: x <= 0.6))
+    eb = engine(4, numpy.c_[numpy.zeros(40), rng.uniform(0, 2, 40)], numpy.c_[numpy.zeros(40), rng.uniform(0, 20, 40)])
+    assert numpy.array_equal(crossings(eb, grn, 1, 70, False), firstStep(eb, grn, 1, lambda x: x >= 70))
+
+def test_first_crossing_around_a_peak():
+    # RNA far above its steady state: Euo overshoots to a peak and settles back below the
+    # threshold, so the steps on the wanted side are one interval around the peak
+    grn = GeneNetwork(spec)
+    rb = engine(1, numpy.c_[numpy.full(20, 5.0), numpy.zeros(20)], numpy.zeros((20, 2)))
+    levels = []
+    probe = engine(1, rb.rnaamt, rb.geneamt)
+    for _ in range(400):
+        grn.step(probe)
+        levels.append(probe.geneamt[:, 0].copy())
+    peak = numpy.max(levels, axis=0)
+    threshold = float(numpy.min(peak)) - 0.5
+    predicted = crossings(rb, grn, 0, threshold, False)
+    assert numpy.array_equal(predicted, firstStep(rb, grn, 0, lambda x: x >= threshold, limit=400))
+    never = crossings(rb, grn, 0, float(numpy.max(peak)) + 1.0, False)
+    assert numpy.all(never == numpy.iinfo(numpy.int64).max)
+
+def test_due_drops_rescheduled_events():
+    grn = GeneNetwork(spec)
+    sched = TransitionScheduler(grn, LinearKinetics(grn))
+    eng = engine(3, numpy.c_[numpy.zeros(3), numpy.zeros(3)], numpy.c_[[5.0, 10.0, 20.0], numpy.zeros(3)])
+    sched.schedule(eng, [0, 1, 2], 1)
+    steps = sorted(step for (step, cid, version) in sched.heap)
+    sched.schedule(eng, [0], 1) # cell 0 again, its first entry is stale
+    assert len(sched.heap) == 4
+    due = [sched.due(eng, step).tolist() for step in steps]
+    assert due == [[0], [1], [2]]
+    assert sched.heap == []
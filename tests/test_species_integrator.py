@@ -0,0 +1,60 @@
+import numpy
+import pytest
+from SpeciesIntegrator import AdaptiveIntegrator
+
+# Error control of the Bogacki-Shampine / ROS2 integrator, against exact solutions.
+
+def production(y, a, b):
+    # y' = a - b*y for every species, a and b per cell
+    return a[:, None] - b[:, None] * y
+
+def exact(y0, a, b, t):
+    steady = (a / b)[:, None]
+    return steady + (y0 - steady) * numpy.exp(-b[:, None] * t)
+
+def relativeError(y, true, rtol, atol):
+    return numpy.max(numpy.abs(y - true) / (atol + rtol * numpy.abs(true)))
+
+def test_non_stiff_within_tolerance():
+    rng = numpy.random.default_rng(0)
+    (a, b) = (rng.uniform(0, 2, 200), rng.uniform(0.01, 2, 200))
+    y0 = rng.uniform(0, 5, (200, 3))
+    for (rtol, atol) in [(1e-3, 1e-5), (1e-6, 1e-8)]:
+        integ = AdaptiveIntegrator(production, rtol, atol)
+        y = integ.step(y0, 1.0, a=a, b=b)
+        assert relativeError(y, exact(y0, a, b, 1.0), rtol, atol) < 10
+        assert integ.stiff == 0
+
+def test_tighter_tolerance_is_more_accurate():
+    y0 = numpy.array([[1.0], [2.0]])
+    f = lambda y: -y * y # y = y0 / (1 + y0 t)
+    true = y0 / (1 + y0 * 2.0)
+    errors = [numpy.max(numpy.abs(AdaptiveIntegrator(f, rtol, rtol * 1e-2).step(y0, 2.0) - true))
+              for rtol in [1e-2, 1e-4, 1e-6]]
+    assert errors[0] > errors[1] > errors[2]
+
+def relaxation(y, b):
+    # A slow species decaying at 0.3 and a fast one relaxing onto it at rate b
+    return numpy.stack([-0.3 * y[:, 0], b * (y[:, 0] - y[:, 1])], axis=1)
+
+def test_stiff_cells_switch_to_rosenbrock():
+    # Cells with b = 1e4 are far beyond the stability limit of the explicit pair at dt = 1,
+    # the others are not; only the stiff ones should turn implicit. Started on the slow
+    # manifold (fast = b/(b - 0.3) * slow) they stay on it, which ROS2 follows in long steps
+    n = 100
+    b = numpy.where(numpy.arange(n) < 10, 1e4, 2.0)
+    slow = numpy.linspace(1, 5, n)
+    y0 = numpy.stack([slow, b / (b - 0.3) * slow], axis=1)
+    integ = AdaptiveIntegrator(relaxation, 1e-4, 1e-6)
+    y = integ.step(y0, 1.0, b=b)
+    assert integ.stiff == 10
+    assert relativeError(y, y0 * numpy.exp(-0.3), 1e-4, 1e-6) < 10
+    subSteps = len(numpy.concatenate(integ.steps))
+    assert subSteps / n < 50 # an explicit step would need h < 2.5e-4 on the stiff cells
+    assert 'stiff' in integ.report()
+    assert integ.cells == 0 # report() starts the counts again
+
+def test_sub_step_limit():
+    integ = AdaptiveIntegrator(production, 1e-10, 1e-12, maxSubsteps=3)
+    with pytest.raises(RuntimeError):
+        integ.step(numpy.full((4, 1), 3.0), 100.0, a=numpy.ones(4), b=numpy.ones(4))
@@ -0,0 +1,46 @@
+import os
+import numpy
+import pytest
+import Sweep
+from conftest import modelPaths
+
+# The sweep cache: a point is run once and read back on later sweeps, and its key moves
+# with the run settings and with the source of every local module the model imports.
+
+def test_model_version_follows_imports(tmp_path):
+    (tmp_path / 'model.py').write_text('import helper\n')
+    (tmp_path / 'helper.py').write_text('def rate():\n    import deeper\n')
+    (tmp_path / 'deeper.py').write_text('x = 1\n')
+    (tmp_path / 'unrelated.py').write_text('x = 1\n')
+    sweep = Sweep.Sweep(str(tmp_path / 'model.py'), {'pr1': (0.01, 0.04)}, cacheDir=str(tmp_path / 'cache'))
+    found = [os.path.basename(path) for path in Sweep.localModules([str(tmp_path / 'model.py')])]
+    assert found == ['model.py', 'helper.py', 'deeper.py']
+    version = sweep.modelVersion()
+    (tmp_path / 'unrelated.py').write_text('x = 2\n')
+    assert sweep.modelVersion() == version
+    (tmp_path / 'deeper.py').write_text('x = 2\n')
+    assert sweep.modelVersion() != version
+
+def test_key_follows_settings(tmp_path):
+    (tmp_path / 'model.py').write_text('')
+    def key(**settings):
+        sweep = Sweep.Sweep(str(tmp_path / 'model.py'), {'pr1': (0.01, 0.04)}, **settings)
+        return sweep.key({'pr1': 0.02})
+    base = key()
+    assert key() == base
+    assert len({base, key(replicates=10), key(steps=10), key(seed=2), key(flags={'useNetwork': True})}) == 5
+
+def test_cached_points_are_not_rerun(tmp_path, monkeypatch):
+    pytest.importorskip('CellModeller')
+    sweep = Sweep.Sweep(modelPaths[0], {'pr1': (0.01, 0.04)}, replicates=4, steps=40, cacheDir=str(tmp_path))
+    points = sweep.grid(2)
+    first = sweep.run(points, workers=1)
+    assert len(os.listdir(tmp_path)) == 2
+    def noPool(*args, **kwargs):
+        raise AssertionError('a cached point was run again')
+    monkeypatch.setattr(Sweep.concurrent.futures, 'ProcessPoolExecutor', noPool)
+    again = sweep.run(points)
+    for (a, b) in zip(first, again):
+        assert a['params'] == b['params']
+        assert numpy.array_equal(a['mean'], b['mean']) and numpy.array_equal(a['std'], b['std'])
+    assert first[0]['mean'].shape == (40, 8)
@@ -0,0 +1,75 @@
+import os
+import numpy
+import pandas
+import pytest
+from ColumnStore import ColumnWriter
+from CellState import CellState
+from RunLoader import RunLoader
+from TrajectoryStore import TrajectoryStore
+
+# Queries of a built TrajectoryStore against the same selections made on the flat records,
+# and pivot() against the notebook's pandas pivot_table.
+
+def writeRun(run, seed):
+    # Cells that come and go and change type at random, recorded every 10 steps
+    os.makedirs(run)
+    rng = numpy.random.default_rng(seed)
+    store = ColumnWriter(os.path.join(run, 'columns.npz'), every=10)
+    cellType = {cid: 1 for cid in range(6)}
+    records = []
+    for step in range(0, 300, 10):
+        for cid in list(cellType):
+            if rng.random() < 0.1:
+                del cellType[cid]
+            elif rng.random() < 0.3:
+                cellType[cid] = int(rng.integers(1, 5))
+        cells = {}
+        for (cid, t) in cellType.items():
+            cell = CellState(cid)
+            cell.cellType = t
+            cell.volume = 1.0
+            cell.pos = [0.0, 0.0, 0.0]
+            cell.rnaamt = list(rng.uniform(0, 1, 4))
+            cell.geneamt = list(rng.uniform(0, 10, 4))
+            cells[cid] = cell
+            records.append((os.path.basename(run), step, cid, t, cell.geneamt[1]))
+        store.record(step, cells)
+        cellType[max(cellType, default=-1) + 1] = 1
+    store.close()
+    return records
+
+@pytest.fixture
+def built(tmp_path):
+    runs = [str(tmp_path / 'run-a'), str(tmp_path / 'run-b')]
+    records = writeRun(runs[0], 0) + writeRun(runs[1], 1)
+    store = TrajectoryStore.build(str(tmp_path / 'trajectories'), runs, RunLoader(str(tmp_path / 'cache')))
+    frame = pandas.DataFrame(records, columns=['sim', 'step', 'cell_id', 'cellType', 'euo'])
+    return (store, frame)
+
+def test_cell_histories(built):
+    (store, frame) = built
+    for ((sim, cid), rows) in frame.groupby(['sim', 'cell_id']):
+        traj = store.cell(sim, cid)
+        assert traj['step'].tolist() == rows.step.tolist()
+        assert traj['cellType'].tolist() == rows.cellType.tolist()
+        assert numpy.array_equal(traj['geneamt'][:, 1], rows.euo.values)
+    with pytest.raises(KeyError):
+        store.cell('run-a', 10**6)
+
+@pytest.mark.parametrize('cellType', [1, 3])
+@pytest.mark.parametrize('span', [(0, 290), (95, 180), (200, 200)])
+def test_between_and_pivot(built, cellType, span):
+    (store, frame) = built
+    (start, end) = span
+    rows = store.between(cellType, start, end)
+    assert numpy.all(store.cellType[rows] == cellType)
+    assert numpy.all((store.step[rows] >= start) & (store.step[rows] <= end))
+    wanted = frame[(frame.cellType == cellType) & (frame.step >= start) & (frame.step <= end)]
+    assert len(wanted)
+    assert sorted(store.geneamt[rows, 1].tolist()) == sorted(wanted.euo.tolist())
+    (steps, cells, values) = store.pivot(cellType, 'geneamt', 1, start, end)
+    table = wanted.pivot_table(index='step', columns=['sim', 'cell_id'], values='euo')
+    assert steps.tolist() == table.index.tolist()
+    names = [(store.runs[run], cid) for (run, cid) in cells[:, :2].tolist()]
+    assert names == table.columns.tolist()
+    assert numpy.array_equal(values, table.values, equal_nan=True)
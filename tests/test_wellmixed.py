@@ -0,0 +1,63 @@
+import os
+import numpy
+import pytest
+
+pytest.importorskip('CellModeller')
+
+from conftest import modelPaths, loadModel, run
+from WellMixed import WellMixedBiophysics
+
+# The physics-free backend: exponential volume growth, volume split at division, and the
+# species arrays a model's callbacks expect.
+
+class Cell:
+    pass
+
+def test_growth_and_division():
+    sim = Cell()
+    phys = WellMixedBiophysics(sim)
+    cells = []
+    for (length, rate) in [(2.0, 1.0), (3.0, 0.5), (1.5, 0.0)]:
+        cell = Cell()
+        phys.addCell(cell, length=length)
+        cell.growthRate = rate
+        cells.append(cell)
+    sim.cellStates = dict(enumerate(cells))
+    volume = numpy.array([2.0, 3.0, 1.5])
+    for _ in range(40):
+        phys.step(0.025)
+        volume = volume * (1 + numpy.array([1.0, 0.5, 0.0]) * 0.025)
+    assert numpy.allclose([cell.volume for cell in cells], volume, rtol=1e-12)
+    assert [cell.strainRate for cell in cells] == [1.0, 0.5, 0.0]
+    (d1, d2) = (Cell(), Cell())
+    phys.divide(cells[0], d1, d2, f1=0.4, f2=0.6)
+    assert numpy.isclose(d1.volume + d2.volume, cells[0].volume)
+    assert numpy.isclose(d1.volume / d2.volume, 0.4 / 0.6)
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_model_run(path):
+    (module, sim) = loadModel(path, randomSeed=1)
+    cells = run(sim, 300)
+    assert len(cells) > 20
+    for cell in cells.values():
+        assert cell.species is not None and cell.signals is not None
+        # a cell over targetVol is split the step update() sees it, so it grows past it by one step at most
+        assert cell.volume <= cell.targetVol * (1 + cell.growthRate * sim.dt) or cell.cellType >= 3
+    assert sim.pickleSteps == module.pickleInterval()
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_step_pickles_by_default(path):
+    # Columns and checkpoints on, as setup() opens them with an output dir: the step pickles
+    # that notebooks read are still written unless dropped
+    (module, sim) = loadModel(path)
+    (module.store, module.checkpoint) = (object(), object())
+    assert module.pickleInterval() == module.outputSteps
+    module.dropPickles = True
+    assert module.pickleInterval() > 10**6
+    module.checkpoint = None
+    assert module.pickleInterval() == module.restartSteps
+
+@pytest.mark.parametrize('path', modelPaths, ids=os.path.basename)
+def test_cl_expression_needs_the_integrator(path):
+    with pytest.raises(ValueError):
+        loadModel(path, clExpression=True)